@@ -0,0 +1,307 @@
+import numpy as np
+from collections.abc import Mapping
+from sklearn.neighbors import KDTree
+
+from mdt_webapp.mdt.Network import Network
+from mdt_webapp.mdt.NetworkFile import network_to_arrays, read_network_file, read_spatial_index, get_version_path, SegmentColumns, FLOW_DECIMALS
+
+class ArrayNetwork(Network):
+    def __init__(self, arrays, hours, extras=None, path=None):
+        """
+        Creates a read-only network stored as contiguous arrays, rather than
+        as dictionaries of Node and Segment objects. Segments and nodes are
+        referred to by integer indices, and the usual network API is
+        provided through lightweight views that are created on demand.
+        :param arrays: network file arrays, keyed by name
+        :param hours:  hours covered by the flow data
+        :param extras: extra segment attributes, keyed by segment index
+        :param path:   network file the arrays were read from, used to read its K-D trees
+        """
+        self.arrays = arrays
+        self.path = path
+        self.spatial_indexes = {}
+        self.hours = list(hours)
+        self.columns = SegmentColumns(arrays, hours, extras or {})
+
+        self.segment_keys = np.asarray(arrays['segment_ids'])
+        self.node_keys = np.asarray(arrays['node_ids'])
+        self.node_coors = np.asarray(arrays['node_coors'], dtype=np.float64)
+
+        # Compressed sparse row (CSR) adjacency in both directions. The
+        # nodes of segment i are segment_nodes[segment_node_offsets[i]:segment_node_offsets[i+1]],
+        # and likewise for the segments attached to each node.
+        self.segment_node_offsets = np.asarray(arrays['segment_node_offsets'])
+        self.segment_nodes = np.asarray(arrays['segment_nodes'])
+        self.node_segment_offsets, self.node_segments = self.index_attached_segments()
+
+        # Hourly flow data, with shape (no. segments, no. hours, 3) and columns
+        # for the average speed, median speed and sample size. The stored
+        # array is used as it is, so memory mapped flow data is shared between
+        # processes, and only the values read are rounded.
+        if 'flow' in arrays:
+            self.flow = np.asarray(arrays['flow'])
+            self.has_flow = np.asarray(arrays['has_flow'])
+        else:
+            self.flow = np.zeros((len(self.segment_keys), len(self.hours), 3))
+            self.has_flow = np.zeros(len(self.segment_keys), dtype=bool)
+
+        self.segment_index = {key: i for i, key in enumerate(self.segment_keys.tolist())}
+        self.node_index = {key: i for i, key in enumerate(self.node_keys.tolist())}
+
+        self.closed = np.array(arrays['segment_closed'], dtype=bool)
+        self.segments = SegmentMapping(self)
+        self.nodes = NodeMapping(self)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens a network file as an array network. The arrays are memory
+        mapped, so the file is not read until the data is used. The network
+        keeps using the version of the file that was current when it was
+        opened, even if a new version is written.
+        :param path:          network file path
+        :return ArrayNetwork: loaded network
+        """
+        path = get_version_path(path)
+        arrays, hours, extras = read_network_file(path, mmap_mode='r')
+        return cls(arrays, hours, extras, path)
+
+    @classmethod
+    def from_network(cls, network):
+        """
+        Creates an array network from a network of Node and Segment objects.
+        :param network:       network object
+        :return ArrayNetwork: array network
+        """
+        arrays, hours, extras = network_to_arrays(network)
+        return cls(arrays, hours, extras)
+
+    def index_attached_segments(self):
+        """
+        Converts the node to segment adjacency, stored with segment IDs, into
+        segment indices. References to segments that are no longer in the
+        network are dropped.
+        :return ndarray: row offsets for each node
+        :return ndarray: attached segment indices
+        """
+        offsets = np.asarray(self.arrays['node_segment_offsets'], dtype=np.int64)
+        attached_ids = np.asarray(self.arrays['node_segment_ids'], dtype=np.int64)
+
+        order = np.argsort(self.segment_keys, kind='stable')
+        sorted_keys = self.segment_keys[order]
+        positions = np.minimum(np.searchsorted(sorted_keys, attached_ids), max(len(sorted_keys) - 1, 0))
+        if len(sorted_keys) > 0: valid = sorted_keys[positions] == attached_ids
+        else: valid = np.zeros(len(attached_ids), dtype=bool)
+
+        rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        new_offsets = np.zeros(len(offsets), dtype=np.int64)
+        new_offsets[1:] = np.cumsum(np.bincount(rows[valid], minlength=len(offsets) - 1))
+
+        return new_offsets, order[positions[valid]]
+
+    def view(self):
+        raise TypeError("Array networks are read-only. Changes are made in a Scenario of the network.")
+
+    def create_KDTree(self, end_nodes=False):
+        """
+        Reads a K-D tree of the network's nodes from its network file,
+        or builds it if the file does not have one.
+        :param end_nodes: restrict K-D tree to nodes at the end of segments
+        :return [int]:    array of node keys
+        :return KDTree:   K-D Tree object
+        """
+        indices = np.arange(len(self.node_keys))
+        if end_nodes: indices = np.flatnonzero(self.get_end_node_flags())
+
+        kdtree = None
+        if self.path != None: kdtree = read_spatial_index(self.path, 'end_nodes' if end_nodes else 'nodes')
+        if kdtree == None or len(kdtree.data) != len(indices): kdtree = KDTree(self.node_coors[indices])
+
+        return self.node_keys[indices].tolist(), kdtree
+
+    def get_end_node_flags(self):
+        """
+        Finds which nodes are at the start or end of one of their attached
+        segments, as in Network.is_end_node(). Network files store these
+        flags, so they are only calculated for older files.
+        :return ndarray: boolean array, True for end nodes
+        """
+        if 'end_node_flags' in self.arrays: return np.asarray(self.arrays['end_node_flags'], dtype=bool)
+
+        nodes = np.repeat(np.arange(len(self.node_keys)), np.diff(self.node_segment_offsets))
+        segments = self.node_segments
+
+        # Segments without any nodes cannot have end nodes.
+        non_empty = np.diff(self.segment_node_offsets)[segments] > 0
+        nodes, segments = nodes[non_empty], segments[non_empty]
+
+        starts = self.segment_nodes[self.segment_node_offsets[segments]]
+        ends = self.segment_nodes[self.segment_node_offsets[segments+1] - 1]
+        is_end = (starts == nodes) | (ends == nodes)
+
+        return np.bincount(nodes[is_end], minlength=len(self.node_keys)) > 0
+
+    def get_segment_nodes(self, index):
+        """
+        Returns the node indices of one segment.
+        :param index:    segment index
+        :return ndarray: node indices
+        """
+        return self.segment_nodes[self.segment_node_offsets[index]:self.segment_node_offsets[index+1]]
+
+    def get_node_segments(self, index):
+        """
+        Returns the indices of the segments attached to one node.
+        :param index:    node index
+        :return ndarray: segment indices
+        """
+        return self.node_segments[self.node_segment_offsets[index]:self.node_segment_offsets[index+1]]
+
+    def get_flow_array(self, index):
+        """
+        Returns one flow measure for every segment and hour.
+        :param index:    flow data column, as used by Segment.get_flow_measures()
+        :return ndarray: array with shape (no. segments, no. hours)
+        """
+        return np.round(self.flow[:, :, index - 1].astype(np.float64), FLOW_DECIMALS)
+
+    def add_elements(self, *args, **kwargs):
+        raise TypeError("Array networks are read-only.")
+
+    def merge_with_network(self, *args, **kwargs):
+        raise TypeError("Array networks are read-only.")
+
+    def simplify(self):
+        raise TypeError("Array networks are read-only.")
+
+class SegmentMapping(Mapping):
+    def __init__(self, network):
+        """
+        Dictionary-like access to an array network's segments by key. Views
+        hold no data of their own, so one is created on every access.
+        :param network: array network
+        """
+        self.network = network
+
+    def __getitem__(self, key):
+        return SegmentView(self.network, self.network.segment_index[key])
+
+    def __iter__(self):
+        return iter(self.network.segment_index)
+
+    def __len__(self):
+        return len(self.network.segment_index)
+
+    def __contains__(self, key):
+        return key in self.network.segment_index
+
+class NodeMapping(Mapping):
+    def __init__(self, network):
+        """
+        Dictionary-like access to an array network's nodes by key.
+        :param network: array network
+        """
+        self.network = network
+
+    def __getitem__(self, key):
+        return NodeView(self.network, self.network.node_index[key])
+
+    def __iter__(self):
+        return iter(self.network.node_index)
+
+    def __len__(self):
+        return len(self.network.node_index)
+
+    def __contains__(self, key):
+        return key in self.network.node_index
+
+class SegmentView:
+    def __init__(self, network, index):
+        """
+        Provides the read-only Segment API for one segment of an array
+        network. The network is shared by every request, so its segments
+        cannot be changed. Changes are made in a Scenario of the network.
+        :param network: array network
+        :param index:   segment index
+        """
+        self.network = network
+        self.index = index
+
+    @property
+    def closed(self):
+        return bool(self.network.closed[self.index])
+
+    @closed.setter
+    def closed(self, closed):
+        raise TypeError("Array networks are read-only.")
+
+    def get_flow_measures(self, index):
+        """
+        Returns a specific column from the flow data, representing
+        that measure's values over the course of a day. Measures are read
+        from the network's flow array, without building the flow data.
+        """
+        if index == 0 or not self.network.has_flow[self.index]: return [i[index] for i in self.get_attributes()['flowData']]
+        return np.round(self.network.flow[self.index, :, index - 1].astype(np.float64), FLOW_DECIMALS).tolist()
+
+    def set_flow_measure(self, val, time_index, val_index):
+        raise TypeError("Array networks are read-only.")
+
+    def set_attribute(self, key, data):
+        raise TypeError("Array networks are read-only.")
+
+    def set_attributes(self, attributes):
+        raise TypeError("Array networks are read-only.")
+
+    def get_nodes(self):
+        return self.network.node_keys[self.network.get_segment_nodes(self.index)].tolist()
+
+    def get_coors(self):
+        return self.network.node_coors[self.network.get_segment_nodes(self.index)].tolist()
+
+    def get_attributes(self):
+        """
+        Builds the segment's attributes from the network's arrays. A new
+        dictionary is built on every call, so changing it does not change
+        the network.
+        :return dict: segment attributes
+        """
+        return self.network.columns.get_attributes(self.index)
+
+    def get_attribute(self, key):
+        """
+        Builds one of the segment's attributes from the network's arrays.
+        :param key: attribute name
+        :return:    attribute value
+        """
+        return self.network.columns.get_attribute(self.index, key)
+
+    def __str__(self):
+        return str(self.__class__) + ": name='" + self.get_attributes()['streetName']+"'"
+
+class NodeView:
+    def __init__(self, network, index):
+        """
+        Provides the Node API for one node of an array network.
+        :param network: array network
+        :param index:   node index
+        """
+        self.network = network
+        self.index = index
+
+    @property
+    def lat(self):
+        return float(self.network.node_coors[self.index, 0])
+
+    @property
+    def lon(self):
+        return float(self.network.node_coors[self.index, 1])
+
+    def get_attached(self):
+        return self.network.segment_keys[self.network.get_node_segments(self.index)].tolist()
+
+    def get_coors(self):
+        return [self.lat, self.lon]
+
+    def __str__(self):
+        return str(self.__class__) + ": coors=" + str(self.get_coors())
@@ -0,0 +1,59 @@
+class CoordinateIndex:
+    def __init__(self, resolution=1e-6):
+        """
+        Spatial index that snaps coordinates to a grid, so that points in
+        the same grid cell are treated as the same node. Each cell is given
+        a unique node key by packing its row and column into one integer,
+        so finding a point's node does not need a search.
+        :param resolution: grid cell size (degrees)
+        """
+        self.resolution = resolution
+        self.no_columns = int(round(360 / resolution)) + 1
+
+        self.cells = {}
+        self.no_points = 0
+        self.no_merged = 0
+
+    def get_key(self, lat, lon):
+        """
+        Returns the node key for the grid cell containing a point.
+        :param lat:  latitude (degrees)
+        :param lon:  longitude (degrees)
+        :return int: node key
+        """
+        row = int(round((lat + 90) / self.resolution))
+        column = int(round((lon + 180) / self.resolution))
+        return row * self.no_columns + column
+
+    def add(self, lat, lon):
+        """
+        Finds the node for a point, adding a new node if no other point
+        has been added in its grid cell.
+        :param lat:   latitude (degrees)
+        :param lon:   longitude (degrees)
+        :return int:  node key
+        :return bool: denotes whether the node is new
+        """
+        key = self.get_key(lat, lon)
+        self.no_points += 1
+
+        if key in self.cells:
+            # Points that are not exactly the same as the node's first point
+            # are counted as merged.
+            if self.cells[key] != (lat, lon): self.no_merged += 1
+            return key, False
+
+        self.cells[key] = (lat, lon)
+        return key, True
+
+    def get_statistics(self):
+        """
+        Returns the number of points added, the number of nodes they were
+        reduced to, and how many points were merged into a node with
+        different coordinates.
+        :return dict: index statistics
+        """
+        return {'points': self.no_points,
+                'nodes': len(self.cells),
+                'duplicates': self.no_points - len(self.cells) - self.no_merged,
+                'merged': self.no_merged}
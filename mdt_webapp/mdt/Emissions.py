@@ -1,9 +1,15 @@
-import csv, os.path, math
+import os, math, pickle, tempfile, functools, threading, weakref, sklearn
 import numpy as np
+import pandas as pd
 from sklearn.neighbors import KDTree
 
 from pollemission.copert import *
 
+from mdt_webapp.mdt.FactorTable import FactorTable, ExactFactors
+from mdt_webapp.mdt.EmissionsTensor import EmissionsTensor
+from mdt_webapp.mdt.EmissionsComponents import EmissionsComponents
+from mdt_webapp.mdt.Scenario import Scenario
+from mdt_webapp.mdt.Geodesy import cartesian_coordinates
 from mdt_project.settings import POL_DIR, CSV_DIR
 
 c = Copert(POL_DIR+"input/PC_parameter.csv",
@@ -47,54 +53,476 @@ petrol_eu_class_distribution = [0.013/0.651,  # Pre-Euro
 
 euro_class_distributions = [petrol_eu_class_distribution, diesel_eu_class_distribution]
 
+# Columns of the DfT count points dataset used for the vehicle proportions.
+# Each type's count is divided by the total count of motor vehicles.
+count_point_coordinates = ['latitude', 'longitude']
+count_point_types = ['two_wheeled_motor_vehicles', 'cars_and_taxis', 'buses_and_coaches', 'lgvs', 'all_hgvs']
+count_point_total = 'all_motor_vehicles'
+
+# The loaded count points are cached next to the CSV file as '<filename>.p',
+# and are only used if the file has not changed since they were cached.
+# Caches written in a different format are rebuilt.
+COUNT_POINTS_CACHE_EXTENSION = '.p'
+COUNT_POINTS_CACHE_FORMAT = 2
+
+def read_count_points(filename):
+    """
+    Reads the coordinates and vehicle type proportions of each count point.
+    :param filename: count points file
+    :return ndarray: [lat, lon] coordinates, with shape (no. count points, 2)
+    :return ndarray: vehicle type proportions, with shape (no. count points, 5)
+    """
+    data = pd.read_csv(filename, usecols=count_point_coordinates + count_point_types + [count_point_total])
+
+    coors = data[count_point_coordinates].to_numpy(dtype=np.float64)
+    counts = data[count_point_types].to_numpy(dtype=np.float64)
+    vehicle_data = counts / data[count_point_total].to_numpy(dtype=np.float64)[:, None]
+
+    return coors, vehicle_data
+
+def get_file_signature(filename):
+    """
+    Identifies a version of a file by its modification time and size.
+    :param filename: file path
+    :return list:    file signature
+    """
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size, sklearn.__version__]
+
 def build_vehicle_kdtree(filename):
     """
     Builds a K-D tree from the UKDT count points dataset for
-    finding the vehicle proportions.
+    finding the vehicle proportions. The tree is built on earth-centred
+    cartesian coordinates, so its distances are in metres. The tree and
+    proportions are cached, and rebuilt when the file changes.
     :param filename: count points file
+    :return KDTree:  K-D tree of count point cartesian coordinates (m)
+    :return ndarray: vehicle type proportions of each count point
     """
     if os.path.isfile(filename):
-        coors = []
-        vehicle_data = []
-        with open(filename) as csvfile:
-
-            readCSV = csv.reader(csvfile, delimiter=',')
-            
-            has_header = csv.Sniffer().has_header(filename)
-            if has_header:
-                next(readCSV)
-            for row in readCSV:
-                coors.append([float(row[12]), float(row[13])])
-                count_data = []
-                for type_index in range(19, 23):
-                    count_data.append(int(row[type_index])/int(row[30]))
-                count_data.append(int(row[29])/int(row[30]))
-                vehicle_data.append(count_data)
-        
-        kdt = KDTree(np.asarray(coors))
+        signature = get_file_signature(filename)
+        cache_filename = filename + COUNT_POINTS_CACHE_EXTENSION
+
+        # Unreadable caches, or caches of an older file, are ignored.
+        if os.path.isfile(cache_filename):
+            try:
+                with open(cache_filename, 'rb') as cache_file:
+                    cache = pickle.load(cache_file)
+                if cache.get('format') == COUNT_POINTS_CACHE_FORMAT and cache['signature'] == signature: return cache['kdtree'], cache['vehicle_data']
+            except Exception:
+                pass
+
+        coors, vehicle_data = read_count_points(filename)
+        kdt = KDTree(cartesian_coordinates(coors))
+
+        # The cache is written to a temporary file first, so it is never
+        # read while only partly written. Failing to write it is not an error.
+        try:
+            file, temp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+            with os.fdopen(file, 'wb') as cache_file:
+                pickle.dump({'format': COUNT_POINTS_CACHE_FORMAT, 'signature': signature, 'kdtree': kdt, 'vehicle_data': vehicle_data}, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, cache_filename)
+        except OSError:
+            pass
 
         return kdt, vehicle_data
 
     else:
         print("'{0}' does not exist.".format(filename))
 
-def calculate_net_emissions(network, vehicle_types=vehicle_types, engine_petrol_prop=0.635, temperature=9.0, type_modifiers=None):
+# Fleet composition of each vehicle type. Emission factors for passenger
+# cars are only available for petrol engines of 1.4-2 l, and classes other
+# than Euro 1 - Euro 3, which are weighted by the petrol class distribution.
+passenger_car_classes = [(copert_classes[i], petrol_eu_class_distribution[i]) for i in [0, 4, 5, 6]]
+
+# Bus class distribution.
+bus_classes = [(c.class_hdv_Euro_III, 448/791), (c.class_hdv_Euro_IV, 138/791), (c.class_hdv_Euro_VI, 173/791)]
+
+# According to the Updated Vehicle Emission Curves Use in the National
+# Transport Model (2009), the proportion of Euro classes for LGVs is the
+# same for diesel and petrol LGVs for Euro classes 2-6.
+lgv_classes = list(zip(copert_classes[2:], [0.002, 0.019, 0.150, 0.313, 0.516]))
+
+# Class distribution comes from the same report as for LGVs.
+hgv_classes = [(c.class_hdv_Euro_III, 0.008), (c.class_hdv_Euro_IV, 0.027), (c.class_hdv_Euro_V_EGR, 0.203), (c.class_hdv_Euro_VI, 0.761)]
+
+# Pollutants calculated for every segment, in the order of the emissions
+# tensor's pollutant axis. Copert has no CO2 formulas, so CO2 is derived from
+# fuel consumption (FC), and is only included for vehicle classes with FC
+# formulas. Copert has no FC formulas for petrol passenger cars, so their FC
+# and CO2 emissions are NaN, totals of FC and CO2 leave them out, and these
+# pollutants are labelled as excluding cars.
+pollutants = ['CO', 'NOx', 'HC', 'PM', 'FC', 'CO2']
+copert_pollutants = [c.pollutant_CO, c.pollutant_NOx, c.pollutant_HC, c.pollutant_PM, c.pollutant_FC]
+pollutant_labels = {'CO': 'CO', 'NOx': 'NO<sub>x</sub>', 'HC': 'HC', 'PM': 'PM', 'FC': 'Fuel Consumption (excl. Cars)', 'CO2': 'CO<sub>2</sub> (excl. Cars)'}
+default_pollutant = 'CO'
+
+# Vehicle types in the order of the emissions tensor's vehicle type axis.
+vehicle_type_names = ['two_wheeled_vehicles', 'passenger_cars', 'buses_coaches', 'lgvs', 'hgvs']
+missing_emissions = [('FC', 'passenger_cars'), ('CO2', 'passenger_cars')]
+
+# Emission components, as the index of their vehicle type and their engine
+# type. Emissions of each component are calculated as if every vehicle were
+# of that type, so the vehicle type proportions and petrol share are only
+# applied when the components are combined. Components without an engine
+# type do not depend on the petrol share.
+emission_components = [(0, None),
+                       (1, c.engine_type_gasoline),
+                       (2, None),
+                       (3, c.engine_type_gasoline), (3, c.engine_type_diesel),
+                       (4, None)]
+
+# Only passenger cars and LGVs have cold start emissions.
+cold_start_components = [emission_components.index((1, c.engine_type_gasoline)),
+                         emission_components.index((3, c.engine_type_gasoline)), emission_components.index((3, c.engine_type_diesel))]
+
+# Mass of CO2 emitted per mass of fuel consumed, assuming all of the fuel's
+# carbon is oxidised, from the fuels' hydrogen to carbon ratios in the
+# EMEP/EEA air pollutant emission inventory guidebook.
+fuel_hydrogen_carbon_ratios = {c.engine_type_gasoline: 1.80, c.engine_type_diesel: 1.86}
+co2_per_fuel = {engine_type: 44.011 / (12.011 + 1.008*ratio) for engine_type, ratio in fuel_hydrogen_carbon_ratios.items()}
+
+# Hot emission factors and cold start quotients are looked up in tables
+# sampled every 0.1 km/h, with at most this relative error. A tolerance
+# of None uses the exact Copert formulas instead.
+FACTOR_TABLE_STEP = 0.1
+FACTOR_TABLE_TOLERANCE = 1e-4
+
+def get_pollutant_function(function, fuel_to_co2):
+    """
+    Creates a function of an array of speeds that evaluates a Copert function
+    for every pollutant at once.
+    :param function:    function of a Copert pollutant and an array of speeds
+    :param fuel_to_co2: multiplier of the FC value that gives the CO2 value
+    :return function:   function returning values with shape (no. speeds, no. pollutants)
+    """
+    fc_index = copert_pollutants.index(c.pollutant_FC)
+
+    def pollutant_function(speeds):
+        values = np.stack([np.broadcast_to(function(pollutant, speeds), np.shape(speeds)) for pollutant in copert_pollutants], axis=-1)
+        return np.concatenate([values, values[..., fc_index, None] * fuel_to_co2], axis=-1)
+
+    return pollutant_function
+
+def get_hot_factor_functions():
+    """
+    Creates a function of an array of speeds for the hot emission factors of
+    each vehicle category in the fleet model, for every pollutant. The
+    functions return NaN where Copert has no formula.
+    :return dict: emission factor functions (g or g/km), keyed by category
+    """
+    functions = {'two_wheeled': get_pollutant_function(lambda pollutant, speeds:
+                                    c.EFMopedArray(pollutant, speeds, c.engine_type_moped_two_stroke_less_50, c.class_Euro_3)
+                                    + c.EFMotorcycleArray(pollutant, speeds, c.engine_type_moto_four_stroke_more_750, c.class_Euro_3),
+                                    co2_per_fuel[c.engine_type_gasoline])}
+
+    for copert_class, _ in passenger_car_classes:
+        functions[('passenger_car', copert_class)] = get_pollutant_function(lambda pollutant, speeds, copert_class=copert_class:
+            c.HEFGasolinePassengerCarArray(pollutant, speeds, copert_class, c.engine_capacity_1p4_to_2),
+            co2_per_fuel[c.engine_type_gasoline])
+
+    # Buses and HGVs are assumed to have diesel engines.
+    for bus_class, _ in bus_classes:
+        functions[('bus', bus_class)] = get_pollutant_function(lambda pollutant, speeds, bus_class=bus_class:
+            c.HEFHeavyDutyVehicleArray(speed=speeds, vehicle_category=c.vehicle_type_bus, hdv_type=c.bus_type_urban_more_18,
+                                       hdv_copert_class=bus_class, pollutant=pollutant, load=c.hdv_load_50, slope=0),
+            co2_per_fuel[c.engine_type_diesel])
+
+    for copert_class, _ in lgv_classes:
+        for engine_type in engine_types:
+            functions[('lgv', copert_class, engine_type)] = get_pollutant_function(lambda pollutant, speeds, copert_class=copert_class, engine_type=engine_type:
+                c.HEFLightCommercialVehicleArray(pollutant=pollutant, speed=speeds, engine_type=engine_type, copert_class=copert_class),
+                co2_per_fuel[engine_type])
+
+    for hgv_class, _ in hgv_classes:
+        functions[('hgv', hgv_class)] = get_pollutant_function(lambda pollutant, speeds, hgv_class=hgv_class:
+            c.HEFHeavyDutyVehicleArray(speed=speeds, vehicle_category=c.vehicle_type_heavy_duty_vehicle, hdv_type=c.hdv_type_rigid_14_20,
+                                       hdv_copert_class=hgv_class, pollutant=pollutant, load=c.hdv_load_50, slope=c.slope_0),
+            co2_per_fuel[c.engine_type_diesel])
+
+    return functions
+
+def get_cold_start_functions(temperature):
+    """
+    Creates a function of an array of speeds for the cold start emission
+    quotients of each vehicle category that has cold start emissions, for
+    every pollutant. CO2 uses the fuel consumption quotient.
+    :param temperature: ambient temperature
+    :return dict:       cold start quotient functions, keyed by category
+    """
+    functions = {}
+    for copert_class, _ in passenger_car_classes:
+        functions[('passenger_car', copert_class)] = get_pollutant_function(lambda pollutant, speeds, copert_class=copert_class:
+            c.ColdStartEmissionQuotientArray(c.vehicle_type_passenger_car, c.engine_type_gasoline, pollutant,
+                                             speeds, copert_class, c.engine_capacity_1p4_to_2, temperature), 1.0)
+
+    for copert_class, _ in lgv_classes:
+        for engine_type in engine_types:
+            functions[('lgv', copert_class, engine_type)] = get_pollutant_function(lambda pollutant, speeds, copert_class=copert_class, engine_type=engine_type:
+                c.ColdStartEmissionQuotientArray(c.vehicle_type_light_commercial_vehicle, engine_type, pollutant,
+                                                 speeds, copert_class, c.engine_capacity_1p4_to_2, temperature), 1.0)
+
+    return functions
+
+@functools.lru_cache(maxsize=None)
+def get_hot_factor_table(tolerance=FACTOR_TABLE_TOLERANCE):
+    """
+    Returns the hot emission factor table, which is built on first use.
+    :param tolerance:   maximum relative error, or None for exact values
+    :return FactorTable: hot emission factors
+    """
+    if tolerance == None: return ExactFactors(get_hot_factor_functions())
+    return FactorTable(get_hot_factor_functions(), 0.0, 130.0, FACTOR_TABLE_STEP, tolerance)
+
+@functools.lru_cache(maxsize=32)
+def get_cold_start_table(temperature, tolerance=FACTOR_TABLE_TOLERANCE):
     """
-    Calculates emissions for each segment on the network.
-    :param network:            network object
-    :param vehicle_types:      list of copert vehicle classes to use
-    :param engine_petrol_prop: proportion of petrol vehicles
-    :param temperature:        ambient temperature
-    :param type_modifiers:     vehicle type modifiers
+    Returns the cold start quotient table for an ambient temperature. Cold
+    start emissions are only added between 5 and 45 km/h, so the table only
+    covers those speeds.
+    :param temperature:  ambient temperature
+    :param tolerance:    maximum relative error, or None for exact values
+    :return FactorTable: cold start emission quotients
     """
+    if tolerance == None: return ExactFactors(get_cold_start_functions(temperature))
+    return FactorTable(get_cold_start_functions(temperature), 5.0, 45.0, FACTOR_TABLE_STEP, tolerance)
+
+def get_component_factors(speeds, temperature=None, tolerance=FACTOR_TABLE_TOLERANCE):
+    """
+    Calculates the emission factors of each emission component at each
+    speed, for every pollutant. Without a temperature these are the hot
+    emission factors, and otherwise the cold start emission factors that
+    are added to them. Vehicle classes that Copert has no formula for at a
+    speed add nothing to the factor at that speed.
+    :param speeds:      distinct average speeds (km/h)
+    :param temperature: ambient temperature, or None for hot emission factors
+    :param tolerance:   maximum relative error of table lookups, or None for exact values
+    :return ndarray:    emission factors, with shape (no. speeds, no. pollutants, no. components)
+    """
+    speeds = np.asarray(speeds, dtype=np.float64)
+    factors = np.zeros((len(speeds), len(pollutants), len(emission_components)))
+    cold_start = temperature != None
+
+    # Cold start emissions are only added between 5 and 45 km/h, and only
+    # for passenger cars and LGVs.
+    if cold_start and temperature <= -20: return factors
+    hot = get_hot_factor_table(tolerance)
+    if cold_start: quotients = get_cold_start_table(temperature, tolerance)
+
+    def add_class_factors(component, key, low, high, class_proportion=1.0):
+        # Speeds strictly inside the range that the vehicle type's formulas cover.
+        if cold_start: low, high = max(low, 5), min(high, 45)
+        indices = np.flatnonzero((speeds > low) & (speeds < high))
+        class_factors = np.nan_to_num(hot.lookup(key, speeds[indices]), nan=0.0)
+        if cold_start: class_factors *= np.nan_to_num(quotients.lookup(key, speeds[indices]), nan=0.0)
+        factors[indices, :, component] += class_factors * class_proportion
+
+    # ~ Two wheeled vehicles ~ #
+    if not cold_start: add_class_factors(emission_components.index((0, None)), 'two_wheeled', -np.inf, np.inf)
+
+    # ~ Passenger vehicles & taxis ~ #
+    # No formula for vehicles below 10kph (6.2mph) or above 130kph (80.8mph)
+    for copert_class, class_proportion in passenger_car_classes:
+        add_class_factors(emission_components.index((1, c.engine_type_gasoline)), ('passenger_car', copert_class), 10, 130, class_proportion)
+
+    # ~ Buses and coaches ~ #
+    # The input speed must be in the range of [11.0, 86.0] <- 6.8-53.4mph
+    # when calculating hot emission factors for heavy duty
+    # vehicles of type 'Urban Buses Standard 15 - 18 t' when
+    # the charge is 50% and the slope is 0%.
+    if not cold_start:
+        for bus_class, class_proportion in bus_classes:
+            add_class_factors(emission_components.index((2, None)), ('bus', bus_class), 11, 86, class_proportion)
+
+    # ~ Light commercial vehicles ~ #
+    # Cold and hot emissions are calculated seprately for LGVs.
+    for copert_class, class_proportion in lgv_classes:
+        for engine_type in engine_types:
+            add_class_factors(emission_components.index((3, engine_type)), ('lgv', copert_class, engine_type), 10, 120, class_proportion)
+
+    # ~ Heavy commercial vehicles ~ #
+    if not cold_start:
+        for hgv_class, class_proportion in hgv_classes:
+            add_class_factors(emission_components.index((4, None)), ('hgv', hgv_class), 12, 86, class_proportion)
+
+    return factors
+
+def get_component_weights(engine_type_distribution=[0.635, 0.365], engine_capacity_distribution=0.5):
+    """
+    Calculates the weight of each emission component in each vehicle type's
+    emissions.
+    :param engine_type_distribution:     petrol and diesel engine distributions
+    :param engine_capacity_distribution: distribution between engine capacities
+    :return ndarray:                     weights, with shape (no. components, 5)
+    """
+    weights = np.zeros((len(emission_components), len(vehicle_type_names)))
+    for component, (type_index, engine_type) in enumerate(emission_components):
+        if engine_type == None: weights[component, type_index] = 1.0
+        else: weights[component, type_index] = engine_type_distribution[engine_type]
+
+    # Passenger car factors are only available for one engine capacity.
+    weights[emission_components.index((1, c.engine_type_gasoline)), 1] *= engine_capacity_distribution
+
+    return weights
+
+def calculate_emission_components(speeds, flows, lengths, tolerance=FACTOR_TABLE_TOLERANCE):
+    """
+    Calculates the emission components of any number of segments at once.
+    Emission factors only depend on speed, so they are calculated and kept
+    once for each distinct speed, rather than for every segment and hour,
+    and every pollutant shares the same lookups. Cold start factors are
+    calculated when they are first needed for a temperature.
+    :param speeds:               average speeds (km/h), with shape (no. segments, no. hours)
+    :param flows:                sample sizes, with shape (no. segments, no. hours)
+    :param lengths:              segment lengths (km)
+    :param tolerance:            maximum relative error of emission factor lookups, or None for exact values
+    :return EmissionsComponents: emission components of each time slot
+    """
+    speeds = np.asarray(speeds, dtype=np.float64)
+    flows = np.asarray(flows, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+
+    # Only time slots with observed vehicles have emissions.
+    segments, hours = np.nonzero(flows > 0)
+    distinct_speeds, speed_index = np.unique(speeds[segments, hours], return_inverse=True)
+
+    # Passenger car factors are per km.
+    scale = np.repeat(flows[segments, hours, None], len(emission_components), axis=1)
+    scale[:, emission_components.index((1, c.engine_type_gasoline))] *= lengths[segments]
+
+    def calculate_cold_start_factors(temperature):
+        return get_component_factors(distinct_speeds, temperature, tolerance)[:, :, cold_start_components]
+
+    return EmissionsComponents(speeds.shape, segments, hours, speed_index.ravel(), scale, get_component_factors(distinct_speeds, tolerance=tolerance),
+                               calculate_cold_start_factors, cold_start_components)
+
+def calculate_emissions(speeds, flows, lengths, vehicle_type_props, engine_type_distribution=[0.635, 0.365], temperature=9.0, engine_capacity_distribution=0.5,
+                        tolerance=FACTOR_TABLE_TOLERANCE):
+    """
+    Calculates hourly emissions of every pollutant and vehicle type for any
+    number of segments at once.
+    :param speeds:                       average speeds (km/h), with shape (no. segments, no. hours)
+    :param flows:                        sample sizes, with shape (no. segments, no. hours)
+    :param lengths:                      segment lengths (km)
+    :param vehicle_type_props:           vehicle type proportions, with shape (no. segments, 5)
+    :param engine_type_distribution:     petrol and diesel engine distributions
+    :param temperature:                  ambient temperature
+    :param engine_capacity_distribution: distribution between engine capacities
+    :param tolerance:                    maximum relative error of emission factor lookups, or None for exact values
+    :return ndarray:                     emissions (g), with shape (no. segments, no. hours, no. pollutants, 5)
+    """
+    components = calculate_emission_components(speeds, flows, lengths, tolerance)
+    return components.combine(np.arange(components.shape[0]), vehicle_type_props,
+                              get_component_weights(engine_type_distribution, engine_capacity_distribution), temperature)
+
+def modify_vehicle_type_props(vehicle_type_props, type_modifiers):
+    """
+    Multiplies vehicle type proportions by the type modifiers, and calculates
+    the new values as a percent of their total.
+    :param vehicle_type_props: vehicle type proportions, with shape (no. segments, 5)
+    :param type_modifiers:     vehicle type modifier array
+    :return ndarray:           modified proportions
+    :return ndarray:           boolean array, True for segments whose proportions were rescaled
+    """
+    vehicle_type_props = np.asarray(vehicle_type_props, dtype=np.float64) * np.asarray(type_modifiers, dtype=np.float64)
+    totals = vehicle_type_props.sum(axis=1)
+
+    rescaled = totals != 0
+    vehicle_type_props[rescaled] /= totals[rescaled, None]
+
+    return vehicle_type_props, rescaled
+
+# Emission components of every segment of an array network, keyed by the
+# network and then by tolerance. They are calculated on first use and shared
+# by all of the network's scenarios, and are dropped with the network.
+network_components = weakref.WeakKeyDictionary()
+network_components_lock = threading.Lock()
+
+def get_network_components(network, tolerance=FACTOR_TABLE_TOLERANCE):
+    """
+    Returns the emission components of every segment of an array network,
+    calculating them from its flow data on first use. Unknown lengths add
+    no passenger car emissions.
+    :param network:              array network
+    :param tolerance:            maximum relative error of emission factor lookups, or None for exact values
+    :return EmissionsComponents: emission components of each time slot
+    """
+    with network_components_lock:
+        components = network_components.setdefault(network, {})
+
+        if tolerance not in components:
+            has_flow = network.has_flow[:, None]
+            if 'length' in network.arrays: lengths = np.nan_to_num(np.asarray(network.arrays['length'], dtype=np.float64))
+            else: lengths = np.zeros(len(network.segment_keys))
+
+            components[tolerance] = calculate_emission_components(np.where(has_flow, network.get_flow_array(1), 0.0),
+                                                                  np.where(has_flow, network.get_flow_array(3), 0.0), lengths, tolerance)
+
+        return components[tolerance]
+
+def calculate_net_emissions(network, vehicle_types=vehicle_types, engine_petrol_prop=0.635, temperature=9.0, type_modifiers=None, pollutant=default_pollutant):
+    """
+    Calculates emissions for each segment on the network. Scenarios whose
+    flow data has not been changed reuse their base network's emission
+    components, so only the modifiers are applied.
+    :param network:                network object
+    :param vehicle_types:          list of copert vehicle classes to use
+    :param engine_petrol_prop:     proportion of petrol vehicles
+    :param temperature:            ambient temperature
+    :param type_modifiers:         vehicle type modifiers
+    :param pollutant:              pollutant stored as each segment's emissions
+    :return EmissionsTensor:       emissions of every open segment, hour, pollutant and vehicle type
+    """
+    if isinstance(network, Scenario) and network.has_base_flow():
+        return calculate_scenario_emissions(network, np.flatnonzero(~network.closed), [engine_petrol_prop, 1 - engine_petrol_prop], temperature,
+                                            type_modifiers=type_modifiers, pollutant=pollutant)
+
     segments = network.get_network_segments()
+    open_keys = [key for key in segments.keys() if not network.is_closed(key)]
+    open_segments = [segments[key] for key in open_keys]
 
-    for key in segments.keys():
-        segment = segments[key]
-        if not network.is_closed(key):
-            calculate_seg_emissions(segment, segment.get_attributes()['vehicleProps'], vehicle_types, [engine_petrol_prop, 1 - engine_petrol_prop], temperature, type_modifiers=type_modifiers)
+    return calculate_segments_emissions(open_segments, [segment.get_attributes()['vehicleProps'] for segment in open_segments],
+                                        [engine_petrol_prop, 1 - engine_petrol_prop], temperature, type_modifiers=type_modifiers,
+                                        pollutant=pollutant, keys=open_keys)
 
-def calculate_seg_emissions(segment, vehicle_type_prop, vehicle_types=vehicle_types, engine_type_distribution=[0.635, 0.365], temperature=9.0, engine_capacity_distribution=0.5, type_modifiers=None):
+def calculate_scenario_emissions(scenario, indices, engine_type_distribution=[0.635, 0.365], temperature=9.0, engine_capacity_distribution=0.5, type_modifiers=None,
+                                 pollutant=default_pollutant):
+    """
+    Calculates emissions for segments of a scenario by combining the cached
+    emission components of its base network, and stores their hourly values
+    of one pollutant in the scenario. Unknown vehicle type proportions add
+    no emissions.
+    :param scenario:                     scenario of an array network
+    :param indices:                      segment indices
+    :param engine_type_distribution:     petrol and diesel engine distributions
+    :param temperature:                  ambient temperature
+    :param engine_capacity_distribution: distribution between engine capacities
+    :param type_modifiers:               vehicle type modifier array
+    :param pollutant:                    pollutant stored as each segment's emissions
+    :return EmissionsTensor:             emissions of every segment, hour, pollutant and vehicle type
+    """
+    base = scenario.base
+    indices = np.asarray(indices, dtype=np.int64)
+    vehicle_type_props = np.nan_to_num(scenario.get_vehicle_prop_array()[indices])
+
+    if type_modifiers != None and len(type_modifiers) == vehicle_type_props.shape[1]:
+        vehicle_type_props, rescaled = modify_vehicle_type_props(vehicle_type_props, type_modifiers)
+        scenario.set_vehicle_prop_array(indices[rescaled], vehicle_type_props[rescaled])
+
+    values = get_network_components(base).combine(indices, vehicle_type_props, get_component_weights(engine_type_distribution, engine_capacity_distribution), temperature)
+
+    # Segments without flow data have no time slots.
+    has_flow = np.asarray(base.has_flow[indices], dtype=bool)
+    emissions = EmissionsTensor(base.segment_keys[indices].tolist(), values, np.where(has_flow, len(base.hours), 0), pollutants, vehicle_type_names, missing_emissions)
+
+    scenario.set_emissions_array(indices[has_flow], emissions.get_totals(pollutant)[has_flow])
+    for key in base.segment_keys[indices[~has_flow]].tolist():
+        scenario.segments[key].set_attribute('emissions', [])
+
+    return emissions
+
+def calculate_seg_emissions(segment, vehicle_type_prop, vehicle_types=vehicle_types, engine_type_distribution=[0.635, 0.365], temperature=9.0, engine_capacity_distribution=0.5, type_modifiers=None,
+                            pollutant=default_pollutant, key=None):
     """
     Calculates emissions for one segment, and stores hourly
     values in their attributes dictionary.
@@ -104,171 +532,59 @@ def calculate_seg_emissions(segment, vehicle_type_prop, vehicle_types=vehicle_ty
     :param engine_capacity_distribution: distribution between engine types
     :param temperature: ambient temperature
     :param type_modifiers: vehicle type modifier array
+    :param pollutant: pollutant stored as the segment's emissions
+    :param key: segment key in the returned emissions, if not the segment's position
+    :return EmissionsTensor: emissions of every hour, pollutant and vehicle type
+    """
+    return calculate_segments_emissions([segment], [vehicle_type_prop], engine_type_distribution, temperature, engine_capacity_distribution, type_modifiers,
+                                        pollutant, None if key == None else [key])
+
+def calculate_segments_emissions(segments, vehicle_type_props, engine_type_distribution=[0.635, 0.365], temperature=9.0, engine_capacity_distribution=0.5, type_modifiers=None,
+                                 pollutant=default_pollutant, keys=None):
+    """
+    Calculates emissions for a list of segments together, and stores their
+    hourly values of one pollutant in their attributes dictionaries. The
+    emissions of every pollutant and vehicle type are returned.
+    :param segments:                     list of segment objects
+    :param vehicle_type_props:           vehicle type proportions of each segment
+    :param engine_type_distribution:     petrol and diesel engine distributions
+    :param temperature:                  ambient temperature
+    :param engine_capacity_distribution: distribution between engine capacities
+    :param type_modifiers:               vehicle type modifier array
+    :param pollutant:                    pollutant stored as each segment's emissions
+    :param keys:                         segment keys in the returned emissions, if not their positions
+    :return EmissionsTensor:             emissions of every segment, hour, pollutant and vehicle type
     """
+    if keys == None: keys = range(len(segments))
+    if len(segments) == 0: return EmissionsTensor(keys, np.zeros((0, 0, len(pollutants), len(vehicle_type_names))), [], pollutants, vehicle_type_names, missing_emissions)
+    vehicle_type_props = np.asarray(vehicle_type_props, dtype=np.float64)
+
+    # These new values are stored in the attributes dictionary so they
+    # can be displayed in the inspector panel.
+    if type_modifiers != None and len(type_modifiers) == vehicle_type_props.shape[1]:
+        vehicle_type_props, rescaled = modify_vehicle_type_props(vehicle_type_props, type_modifiers)
+        for i in np.flatnonzero(rescaled).tolist():
+            segments[i].set_attribute('vehicleProps', vehicle_type_props[i].tolist())
+
+    # Segments can have different numbers of time slots, so the flow data is
+    # padded with empty time slots, which have no emissions.
+    flow_data = [segment.get_attributes()['flowData'] for segment in segments]
+    no_slots = [len(time_slots) for time_slots in flow_data]
+    speeds = np.zeros((len(segments), max(no_slots)))
+    flows = np.zeros((len(segments), max(no_slots)))
+    for i, time_slots in enumerate(flow_data):
+        if no_slots[i] > 0:
+            time_slots = np.asarray(time_slots, dtype=np.float64)
+            speeds[i, :no_slots[i]] = time_slots[:, 1]
+            flows[i, :no_slots[i]] = time_slots[:, 3]
+
+    # Passenger car emissions depend on the segment's length, so it is only
+    # needed for segments that have observed vehicles.
+    lengths = np.array([segment.get_attributes()['length'] if (flows[i] > 0).any() else 0.0 for i, segment in enumerate(segments)])
+
+    emissions = EmissionsTensor(keys, calculate_emissions(speeds, flows, lengths, vehicle_type_props, engine_type_distribution, temperature, engine_capacity_distribution),
+                                no_slots, pollutants, vehicle_type_names, missing_emissions)
+    for segment, hourly_emissions, n in zip(segments, emissions.get_totals(pollutant).tolist(), no_slots):
+        segment.set_attribute('emissions', hourly_emissions[:n])
 
-    # Vehicle type proportions are multiplied by the type modifiers,
-    # and the new values are calculated as a percent of their total.
-    hot_emissions = []
-    if type_modifiers != None and len(type_modifiers) == len(vehicle_type_prop):
-        vehicle_type_prop = [a*b for a,b in zip(vehicle_type_prop,type_modifiers)]
-        if sum(vehicle_type_prop)/len(vehicle_type_prop) != 0:
-            total = sum(vehicle_type_prop)
-            new_proportions = []
-            for prop in vehicle_type_prop:
-                new_proportions.append(prop/total)
-            vehicle_type_prop = new_proportions
-
-            # These new values are stored in the attributes dictionary so they
-            # can be displayed in the inspector panel.
-            segment.set_attribute('vehicleProps', vehicle_type_prop)
-
-    for time_slot in segment.get_attributes()['flowData']:
-        time_slot_emissions = 0
-        if time_slot[3] > 0:
-
-            # ~ Two wheeled vehicles ~ #
-            if vehicle_type_prop[0] != 0:
-
-                # Emissions for mopeds.
-                two_wheeled_vehicle_emissions = c.EFMoped(c.pollutant_CO,
-                                                        time_slot[1],
-                                                        c.engine_type_moped_two_stroke_less_50,
-                                                        c.class_Euro_3)
-
-                # Emissions for motorcycles.
-                two_wheeled_vehicle_emissions += c.EFMotorcycle(c.pollutant_CO,
-                                                                time_slot[1],
-                                                                c.engine_type_moto_four_stroke_more_750,
-                                                                c.class_Euro_3)
-                
-                time_slot_emissions += (two_wheeled_vehicle_emissions * time_slot[3]) * vehicle_type_prop[0]
-            
-            # ~ Passenger vehicles & taxis ~ #
-            for engine_type in range(2): # For both petrol and diesel
-                for copert_class in range(len(copert_classes)): # For all European emissions classes
-                    for engine_capacity in engine_capacities: # Engine capacity is either 0.8-1.4l or 1.4-2l
-                        if (copert_classes[copert_class] != c.class_Improved_Conventional and copert_classes[copert_class] != c.class_Open_loop) or engine_capacity <= 2.0:
-                            
-                            # No formula available for diesel passenger cars whose
-                            # engine capacity is less than 1.4 l and the copert class
-                            # is Euro 1, Euro 2 or Euro 3.
-                            if engine_types[engine_type] != c.engine_type_diesel and engine_capacity != c.engine_capacity_0p8_to_1p4:
-                                if copert_classes[copert_class] not in [c.class_Euro_1, c.class_Euro_2, c.class_Euro_3]:
-                                    
-                                    # No formula for vehicles below 10kph (6.2mph) or above 130kph (80.8mph)
-                                    if time_slot[1] > 10 and time_slot[1] < 130:
-                                        
-                                        passenger_car_emissions = c.Emission(c.pollutant_CO,
-                                                                  time_slot[1],
-                                                                  segment.get_attributes()['length'],
-                                                                  c.vehicle_type_passenger_car,
-                                                                  engine_types[engine_type],
-                                                                  copert_classes[copert_class],
-                                                                  engine_capacity,
-                                                                  temperature)
-
-                                        if time_slot[1] > 5 and time_slot[1] < 45 and temperature > -20:
-                                            passenger_car_emissions += c.ColdStartEmissionQuotient(c.vehicle_type_passenger_car,
-                                                                                                   engine_types[engine_type],
-                                                                                                   c.pollutant_CO,
-                                                                                                   time_slot[1],
-                                                                                                   copert_classes[copert_class],
-                                                                                                   engine_capacity, temperature) * passenger_car_emissions
-                                        
-                                        # Multiply emissions by sample size (total number of cars)
-                                        passenger_car_emissions *= time_slot[3]
-                                        
-                                        # Multiply by proportion of engine type (petrol/diesel) & capacity (0.8-1.4l/1.4l-2)
-                                        # & proportion of european emissions standards class
-                                        passenger_car_emissions *= (engine_type_distribution[engine_types[engine_type]]
-                                                                    * engine_capacity_distribution
-                                                                    * euro_class_distributions[engine_type][copert_class])
-
-                                        # Multiply by proportion of passenger cars
-                                        time_slot_emissions += passenger_car_emissions * vehicle_type_prop[1]
-            
-            # ~ Buses and coaches ~ #
-            if vehicle_type_prop[2] != 0:
-                # The input speed must be in the range of [11.0, 86.0] <- 6.8-53.4mph
-                # when calculating hot emission factors for heavy duty 
-                # vehicles of type 'Urban Buses Standard 15 - 18 t' when 
-                # the charge is 50% and the slope is 0%.
-                if time_slot[1] > 11 and time_slot[1] < 86:
-                    bus_coach_emissions = 0
-                    bus_type_distribution = [448/791, 138/791, 173/791]
-                    bus_classes = [c.class_hdv_Euro_III, c.class_hdv_Euro_IV, c.class_hdv_Euro_VI]
-                    for bus_class in range(len(bus_classes)):
-                        bus_class_emissions = c.HEFHeavyDutyVehicle(speed = time_slot[1],
-                                                                    vehicle_category = c.vehicle_type_bus,
-                                                                    hdv_type = c.bus_type_urban_more_18,
-                                                                    hdv_copert_class = bus_classes[bus_class],
-                                                                    pollutant = c.pollutant_CO,
-                                                                    load = c.hdv_load_50,
-                                                                    slope = 0)
-                        
-                        bus_coach_emissions += (bus_class_emissions * bus_type_distribution[bus_class])
-                    
-                    time_slot_emissions += (bus_coach_emissions * time_slot[3]) * vehicle_type_prop[2]
-
-            # ~ Light commercial vehicles ~ #
-            if vehicle_type_prop[3] != 0:
-                # According to the Updated Vehicle Emission Curves Use
-                # in the National Transport Model (2009), the proportion
-                # of Euro classes for LGVs is:
-                lgv_class_distribution = [0.002, 0.019, 0.150, 0.313, 0.516]
-                # Class distribution is the same for diesel and petrol LGVs for Euro classes 2-6.
-                lgv_classes = copert_classes[2:]
-
-                lgv_emissions = 0
-                for copert_class in range(len(lgv_classes)):
-                    for engine_type in engine_types:
-                        if copert_class != c.class_Euro_1 and time_slot[1] > 10 and time_slot[1] < 120:
-                            # Cold and hot emissions are calculated seprately for LGVs.
-                            lgv_class_emissions = c.HEFLightCommercialVehicle(pollutant = c.pollutant_CO,
-                                                                              speed = time_slot[1],
-                                                                              engine_type = engine_type,
-                                                                              copert_class = lgv_classes[copert_class])
-                            if time_slot[1] > 5 and time_slot[1] < 45 and temperature > -20:
-                                            lgv_class_emissions += c.ColdStartEmissionQuotient(c.vehicle_type_light_commercial_vehicle,
-                                                                                                   engine_types[engine_type],
-                                                                                                   c.pollutant_CO,
-                                                                                                   time_slot[1],
-                                                                                                   lgv_classes[copert_class],
-                                                                                                   engine_capacity, temperature) * lgv_class_emissions
-                            lgv_emissions += (lgv_class_emissions
-                                              * engine_type_distribution[engine_types[engine_type]]
-                                              * lgv_class_distribution[copert_class])
-                
-                time_slot_emissions += (lgv_emissions * time_slot[3]) * vehicle_type_prop[3]
-                                                                      
-                    
-            # ~ Heavy commercial vehicles ~ #
-            if vehicle_type_prop[4] != 0:
-                # Class distribution comes from the same report as for
-                # LGVs, the Updated Vehicle Emission Curves Use
-                # in the National Transport Model (2009).
-                hgv_class_distribution = [0.008, 0.027, 0.203, 0.761]
-                hgv_classes = [c.class_hdv_Euro_III,
-                               c.class_hdv_Euro_IV,
-                               c.class_hdv_Euro_V_EGR,
-                               c.class_hdv_Euro_VI]
-
-                hgv_emissions = 0
-
-                for copert_class in range(len(hgv_classes)):
-                    if time_slot[1] > 12 and time_slot[1] < 86:
-                        hgv_class_emissions = c.HEFHeavyDutyVehicle(speed = time_slot[1],
-                                                                    vehicle_category = c.vehicle_type_heavy_duty_vehicle,
-                                                                    hdv_type = c.hdv_type_rigid_14_20,
-                                                                    hdv_copert_class = hgv_classes[copert_class],
-                                                                    pollutant = c.pollutant_CO,
-                                                                    load = c.hdv_load_50,
-                                                                    slope = c.slope_0)
-                        
-                        hgv_emissions += (hgv_class_emissions * hgv_class_distribution[copert_class])
-                
-                time_slot_emissions += (hgv_emissions * time_slot[3]) * vehicle_type_prop[4]
-
-        hot_emissions.append(time_slot_emissions)
-    
-    segment.set_attribute('emissions', hot_emissions)
+    return emissions
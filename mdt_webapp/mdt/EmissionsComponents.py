@@ -0,0 +1,92 @@
+import threading
+import numpy as np
+
+class EmissionsComponents:
+    def __init__(self, shape, segments, hours, speed_index, scale, hot, cold_start_function, cold_start_components, max_temperatures=8):
+        """
+        Stores what is needed to calculate the emissions of every time slot
+        with observed vehicles, split into components that do not depend on
+        the network modifiers. Each component is the emissions of one vehicle
+        type, or of one engine type of a vehicle type, as if every vehicle
+        were of that type. Modifier changes then only reweight and sum the
+        components. Emission factors are kept for each distinct speed, rather
+        than for each time slot, and only the components with cold start
+        emissions keep cold start factors.
+        :param shape:                 number of segments and hours
+        :param segments:              segment index of each time slot with observed vehicles
+        :param hours:                 hour index of each of those time slots
+        :param speed_index:           index of each of those time slots' speed in the distinct speeds
+        :param scale:                 multiplier of each component's emission factors in each time slot,
+                                      with shape (no. time slots, no. components)
+        :param hot:                   hot emission factors at each distinct speed, with shape
+                                      (no. speeds, no. pollutants, no. components)
+        :param cold_start_function:   function of the ambient temperature returning the cold start
+                                      emission factors at each distinct speed, with shape
+                                      (no. speeds, no. pollutants, no. cold start components)
+        :param cold_start_components: indices of the components with cold start emissions
+        :param max_temperatures:      number of temperatures whose cold start factors are kept
+        """
+        self.shape = tuple(shape)
+        self.segments = segments
+        self.hours = hours
+        self.speed_index = speed_index
+        self.scale = scale
+        self.hot = hot
+        self.cold_start_function = cold_start_function
+        self.cold_start_components = list(cold_start_components)
+        self.max_temperatures = max_temperatures
+
+        self.cold_start = {}
+        self.lock = threading.Lock()
+
+    def get_cold_start(self, temperature):
+        """
+        Returns the cold start emission factors at an ambient temperature,
+        calculating them if they are not kept. The oldest temperature is
+        dropped once more than the maximum number are kept.
+        :param temperature: ambient temperature
+        :return ndarray:    cold start emission factors at each distinct speed, with shape
+                            (no. speeds, no. pollutants, no. cold start components)
+        """
+        with self.lock:
+            if temperature not in self.cold_start:
+                if len(self.cold_start) >= self.max_temperatures:
+                    del self.cold_start[next(iter(self.cold_start))]
+                self.cold_start[temperature] = self.cold_start_function(temperature)
+
+            return self.cold_start[temperature]
+
+    def combine(self, indices, vehicle_type_props, weights, temperature):
+        """
+        Calculates the emissions of each vehicle type from the components.
+        :param indices:            indices of the segments returned
+        :param vehicle_type_props: vehicle type proportions of each segment returned,
+                                   with shape (no. segments, no. vehicle types)
+        :param weights:            weight of each component in each vehicle type's
+                                   emissions, with shape (no. components, no. vehicle types)
+        :param temperature:        ambient temperature
+        :return ndarray:           emissions (g), with shape (no. segments, no. hours,
+                                   no. pollutants, no. vehicle types)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        vehicle_type_props = np.asarray(vehicle_type_props, dtype=np.float64).reshape(len(indices), -1)
+
+        # Position of each segment in the returned array, or -1 if it is not
+        # returned.
+        positions = np.full(self.shape[0], -1, dtype=np.int64)
+        positions[indices] = np.arange(len(indices))
+        slots = np.flatnonzero(positions[self.segments] >= 0)
+        slot_positions = positions[self.segments[slots]]
+
+        emissions = np.zeros((len(indices), self.shape[1], self.hot.shape[1], vehicle_type_props.shape[1]))
+        if len(slots) == 0: return emissions
+
+        # Factors are gathered from the distinct speeds of the time slots.
+        speed_index = self.speed_index[slots]
+        factors = self.hot[speed_index]
+        factors[:, :, self.cold_start_components] += self.get_cold_start(temperature)[speed_index]
+
+        components = factors * self.scale[slots, None, :]
+        emissions[slot_positions, self.hours[slots]] = (components @ weights) * vehicle_type_props[slot_positions, None, :]
+
+        return emissions
@@ -0,0 +1,69 @@
+import numpy as np
+
+class EmissionsTensor:
+    def __init__(self, keys, values, no_slots, pollutants, vehicle_types, missing=()):
+        """
+        Stores the emissions calculated for a set of segments, for every hour,
+        pollutant and vehicle type. Totals for the map, inspector and export
+        are read from slices of it, rather than being recalculated. Emissions
+        that cannot be calculated are NaN, and are left out of the totals.
+        :param keys:          segment keys
+        :param values:        emissions (g), with shape (no. segments, no. hours, no. pollutants, no. vehicle types)
+        :param no_slots:      number of time slots of each segment, later hours are padding
+        :param pollutants:    pollutant names
+        :param vehicle_types: vehicle type names
+        :param missing:       (pollutant, vehicle type) pairs whose emissions cannot be calculated
+        """
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.values = values
+        self.no_slots = list(no_slots)
+        self.pollutants = list(pollutants)
+        self.vehicle_types = list(vehicle_types)
+
+        for pollutant, vehicle_type in missing:
+            self.values[:, :, self.pollutants.index(pollutant), self.vehicle_types.index(vehicle_type)] = np.nan
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_totals(self, pollutant):
+        """
+        Returns the emissions of one pollutant from all vehicle types whose
+        emissions can be calculated.
+        :param pollutant: pollutant name
+        :return ndarray:  emissions (g), with shape (no. segments, no. hours)
+        """
+        return np.nansum(self.values[:, :, self.pollutants.index(pollutant)], axis=2)
+
+    def get_segment_emissions(self, key, pollutant):
+        """
+        Returns a segment's hourly emissions of one pollutant, for each vehicle type.
+        :param key:       segment key
+        :param pollutant: pollutant name
+        :return ndarray:  emissions (g), with shape (no. time slots, no. vehicle types)
+        """
+        i = self.index[key]
+        return self.values[i, :self.no_slots[i], self.pollutants.index(pollutant)]
+
+    def get_segment_totals(self, key, pollutant):
+        """
+        Returns a segment's hourly emissions of one pollutant from all vehicle
+        types whose emissions can be calculated.
+        :param key:       segment key
+        :param pollutant: pollutant name
+        :return list:     hourly emissions (g)
+        """
+        return np.nansum(self.get_segment_emissions(key, pollutant), axis=1).tolist()
+
+    def get_segment_type_totals(self, key, pollutant):
+        """
+        Returns a segment's daily emissions of one pollutant from each vehicle type.
+        :param key:       segment key
+        :param pollutant: pollutant name
+        :return list:     emissions (g) of each vehicle type, NaN if they cannot be calculated
+        """
+        return self.get_segment_emissions(key, pollutant).sum(axis=0).tolist()
@@ -0,0 +1,94 @@
+import numpy as np
+
+class FactorTable:
+    def __init__(self, functions, min_speed=0.0, max_speed=130.0, step=0.1, tolerance=1e-4):
+        """
+        Samples functions of speed on a regular grid, so they can be looked up
+        for any number of speeds with linear interpolation. When the table is
+        built, the interpolated value at the middle of every grid cell is
+        compared with the exact value, and cells with a larger relative error
+        than the tolerance, or where the function is undefined, are looked up
+        with the exact function instead. Functions can return several values
+        for each speed, such as one per pollutant, which share the same lookup.
+        :param functions: functions of an array of speeds, with NaN where they
+                          are undefined, keyed by name
+        :param min_speed: first speed in the grid (km/h)
+        :param max_speed: last speed in the grid (km/h)
+        :param step:      grid spacing (km/h)
+        :param tolerance: maximum relative error of interpolated values
+        """
+        self.functions = functions
+        self.min_speed = min_speed
+        self.step = step
+        self.tolerance = tolerance
+        self.speeds = min_speed + step * np.arange(int(round((max_speed - min_speed) / step)) + 1)
+
+        self.values = {}
+        self.accurate = {}
+        midpoints = (self.speeds[:-1] + self.speeds[1:]) / 2
+
+        for name, function in functions.items():
+            values = self.sample(function, self.speeds)
+            exact = self.sample(function, midpoints)
+            interpolated = (values[:-1] + values[1:]) / 2
+
+            # Comparisons with NaN are False, so cells next to speeds where the
+            # function is undefined always use the exact function. Cells where
+            # it is undefined throughout are interpolated as NaN.
+            with np.errstate(invalid='ignore'):
+                accurate = np.abs(interpolated - exact) <= tolerance * np.abs(exact)
+            accurate |= np.isnan(values[:-1]) & np.isnan(values[1:]) & np.isnan(exact)
+            self.accurate[name] = accurate.reshape(len(accurate), -1).all(axis=1)
+            self.values[name] = values
+
+    @staticmethod
+    def sample(function, speeds):
+        """
+        Evaluates a function at every speed at once.
+        :param function: function of an array of speeds
+        :param speeds:   speeds (km/h)
+        :return ndarray: function values, with NaN where it is undefined, and
+                         with shape (no. speeds, ...)
+        """
+        values = np.asarray(function(speeds), dtype=np.float64)
+        return np.broadcast_to(values, speeds.shape + values.shape[speeds.ndim:]).copy()
+
+    def lookup(self, name, speeds):
+        """
+        Returns a function's values at each speed, interpolated from the table
+        where it is accurate, and otherwise calculated exactly.
+        :param name:     function name
+        :param speeds:   speeds (km/h)
+        :return ndarray: function values, with NaN where it is undefined
+        """
+        speeds = np.asarray(speeds, dtype=np.float64)
+        values = self.values[name]
+
+        position = (speeds - self.min_speed) / self.step
+        cells = np.clip(np.floor(position).astype(np.int64), 0, len(values) - 2)
+        fractions = (position - cells).reshape(speeds.shape + (1,) * (values.ndim - 1))
+
+        result = values[cells] * (1 - fractions) + values[cells+1] * fractions
+        exact = (position < 0) | (position > len(values) - 1) | ~self.accurate[name][cells]
+        if exact.any():
+            result[exact] = self.sample(self.functions[name], speeds[exact])
+
+        return result
+
+class ExactFactors:
+    def __init__(self, functions):
+        """
+        Provides the FactorTable interface, but calculates every value with
+        the exact function.
+        :param functions: functions of an array of speeds, keyed by name
+        """
+        self.functions = functions
+
+    def lookup(self, name, speeds):
+        """
+        Returns a function's exact values at each speed.
+        :param name:     function name
+        :param speeds:   speeds (km/h)
+        :return ndarray: function values, with NaN where it is undefined
+        """
+        return FactorTable.sample(self.functions[name], np.asarray(speeds, dtype=np.float64))
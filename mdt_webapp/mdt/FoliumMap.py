@@ -59,7 +59,7 @@ class FoliumMap():
         line = folium.vector_layers.PolyLine(coors, weight=weight, color=colour, popup=popup, tooltip=tooltip)
         line.add_to(self.layers[layer])
 
-    def draw_network(self, network, metric=None, weight=5, lower_bounds=0, upper_bounds=1, draw_zero_values=True, seg_limit=None, time_segments=12, verbose=False):
+    def draw_network(self, network, metric=None, weight=5, lower_bounds=0, upper_bounds=1, draw_zero_values=True, seg_limit=None, time_segments=12, colour_scale=1.0, verbose=False):
         """
         Draws all network segments onto folium map with an outline
         and all time slots on their respective layers.
@@ -71,6 +71,7 @@ class FoliumMap():
         :param draw_zero_values: segments with an average value of 0 are ignored
         :param seg_limit:        limits the amount of drawn segments
         :param time_segments:    amount of hours added to the map
+        :param colour_scale:     multiplies the values at either end of the metric's colour scale
         :param verbose:          print render progress
         """
         if verbose: print("Drawing '{0}' network:".format(metric))
@@ -98,6 +99,7 @@ class FoliumMap():
                 elif metric == 'emissions':
                     segment_data = attributes['emissions']
                     colour_params = [[0, 1000], [(0, 0, 255), (0, 255, 255), (0, 255, 0), (255, 255, 0), (255, 0, 0)]]
+                colour_params[0] = [value * colour_scale for value in colour_params[0]]
                 
                 # If the average value is outside the boundaries, or has a zero value (with draw_zero_values=True)
                 # the segment is ignored.
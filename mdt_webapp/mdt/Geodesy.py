@@ -0,0 +1,114 @@
+import numpy as np
+
+# WGS-84 ellipsoid, as used by geopy.distance.distance.
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+def vincenty_distance(lat1, lon1, lat2, lon2, tolerance=1e-12, max_iterations=200):
+    """
+    Calculates the distance between pairs of points on the WGS-84 ellipsoid
+    using Vincenty's inverse formula, for whole arrays of points at once.
+    Results agree with geopy.distance.distance (Karney's method) to within
+    1 mm, except for nearly antipodal points, which do not occur within a
+    road network.
+    :param lat1:           latitudes of the first points (degrees)
+    :param lon1:           longitudes of the first points (degrees)
+    :param lat2:           latitudes of the second points (degrees)
+    :param lon2:           longitudes of the second points (degrees)
+    :param tolerance:      convergence tolerance for the longitude difference (radians)
+    :param max_iterations: maximum number of iterations
+    :return ndarray:       distances (km)
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=np.float64)) for x in [lat1, lon1, lat2, lon2]]
+
+    L = lon2 - lon1
+    U1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    for i in range(max_iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_U2 * sin_lam)**2 + (cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)**2)
+        cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+
+        # Coincident points have no azimuth, and are given a distance of 0.
+        coincident = sin_sigma == 0
+        sin_alpha = np.where(coincident, 0, cos_U1 * cos_U2 * sin_lam / np.where(coincident, 1, sin_sigma))
+        cos2_alpha = 1 - sin_alpha**2
+
+        # Points on the equator have cos2_alpha = 0.
+        equatorial = cos2_alpha == 0
+        cos_2sigma_m = np.where(equatorial, 0, cos_sigma - 2 * sin_U1 * sin_U2 / np.where(equatorial, 1, cos2_alpha))
+
+        C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        previous_lam = lam
+        lam = L + (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2)))
+
+        if np.all(np.abs(lam - previous_lam) < tolerance): break
+
+    u2 = cos2_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                                   - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)))
+
+    return WGS84_B * A * (sigma - delta_sigma) / 1000
+
+def path_length(coors):
+    """
+    Calculates the length of a path of coordinates.
+    :param coors:  list of [lat, lon] coordinates
+    :return float: path length (km)
+    """
+    coors = np.asarray(coors, dtype=np.float64).reshape(-1, 2)
+    if len(coors) < 2: return 0.0
+    return float(vincenty_distance(coors[:-1, 0], coors[:-1, 1], coors[1:, 0], coors[1:, 1]).sum())
+
+def path_lengths(paths):
+    """
+    Calculates the lengths and centres of many paths in one call. All
+    coordinates are joined into one array, so the distances between
+    consecutive points of every path are calculated together.
+    :param paths:    list of paths, each a list of [lat, lon] coordinates
+    :return ndarray: path lengths (km)
+    :return ndarray: mean coordinates of each path, with shape (no. paths, 2)
+    """
+    if len(paths) == 0: return np.zeros(0), np.zeros((0, 2))
+
+    counts = np.array([len(path) for path in paths], dtype=np.int64)
+    coors = np.array([coor for path in paths for coor in path], dtype=np.float64).reshape(-1, 2)
+    point_index = np.repeat(np.arange(len(paths)), counts)
+
+    # Distances between the last point of one path and the first point
+    # of the next are left out of the sums.
+    distances = vincenty_distance(coors[:-1, 0], coors[:-1, 1], coors[1:, 0], coors[1:, 1])
+    within_path = point_index[:-1] == point_index[1:]
+    lengths = np.bincount(point_index[:-1][within_path], weights=distances[within_path], minlength=len(paths))
+
+    centres = np.zeros((len(paths), 2))
+    for axis in range(2):
+        centres[:, axis] = np.bincount(point_index, weights=coors[:, axis], minlength=len(paths))
+    centres /= np.maximum(counts, 1)[:, None]
+
+    return lengths, centres
+
+def cartesian_coordinates(coors):
+    """
+    Converts coordinates on the WGS-84 ellipsoid to earth-centred cartesian
+    coordinates. Straight line distances between these are within 1 mm of
+    the distances along the ellipsoid for points up to 10 km apart, so
+    nearby points can be found with a K-D tree in metres.
+    :param coors:    list of [lat, lon] coordinates
+    :return ndarray: [x, y, z] coordinates (m), with shape (no. coordinates, 3)
+    """
+    coors = np.radians(np.asarray(coors, dtype=np.float64).reshape(-1, 2))
+    sin_lat, cos_lat = np.sin(coors[:, 0]), np.cos(coors[:, 0])
+
+    e2 = WGS84_F * (2 - WGS84_F)
+    N = WGS84_A / np.sqrt(1 - e2 * sin_lat**2)
+
+    return np.column_stack((N * cos_lat * np.cos(coors[:, 1]), N * cos_lat * np.sin(coors[:, 1]), N * (1 - e2) * sin_lat))
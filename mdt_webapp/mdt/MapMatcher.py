@@ -0,0 +1,683 @@
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from mdt_webapp.mdt.Network import generate_progress_bar
+from mdt_webapp.mdt.NetworkFile import build_offsets
+from mdt_webapp.mdt.MatchTable import get_segment_hash, get_match_source
+from mdt_webapp.mdt.Geodesy import cartesian_coordinates
+
+def query_paths(kdtree, paths, k=1):
+    """
+    Queries a K-D tree for the nearest points to every coordinate of many
+    paths, in one batched query. The results for path i are rows
+    offsets[i]:offsets[i+1] of the returned arrays.
+    :param kdtree:   K-D tree to query
+    :param paths:    list of paths, each a list of [lat, lon] coordinates
+    :param k:        number of nearest points to find for each coordinate
+    :return ndarray: row offsets of each path
+    :return ndarray: distances, with shape (no. coordinates, k)
+    :return ndarray: indices of the nearest points, with shape (no. coordinates, k)
+    """
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(path) for path in paths])
+    coors = np.array([coor for path in paths for coor in path], dtype=np.float64).reshape(-1, 2)
+
+    if len(coors) == 0: return offsets, np.zeros((0, k)), np.zeros((0, k), dtype=np.int64)
+
+    distances, indices = kdtree.query(coors, k=k)
+    return offsets, distances, indices
+
+def encode_attached_segments(node_keys, nodes):
+    """
+    Gives every segment attached to the given nodes an integer index, in
+    the order they are first found, and lists the attached segment indices
+    of each node.
+    :param node_keys: keys of the nodes, in K-D tree order
+    :param nodes:     network nodes, keyed by node key
+    :return list:     segment keys, in index order
+    :return ndarray:  row offsets of each node
+    :return ndarray:  attached segment indices
+    """
+    segment_index = {}
+    rows = []
+    for key in node_keys:
+        rows.append([segment_index.setdefault(segment_id, len(segment_index)) for segment_id in nodes[key].get_attached()])
+
+    node_offsets, node_segments = build_offsets(rows)
+    return list(segment_index), node_offsets.astype(np.int64), node_segments.astype(np.int64)
+
+def rank_candidates(offsets, indices, distances, node_offsets, node_segments, weighted=False, epsilon=1e-9):
+    """
+    Ranks the candidate segments of many paths from the results of a K-D
+    tree query. Every node found for a path's coordinates gives one vote
+    to each of its attached segments, and each path's candidates are
+    ordered by their votes, then by where they were first found. The
+    votes of all paths are tallied together with one bincount, rather
+    than counting each candidate of each path separately.
+    :param offsets:       row offsets of each path in the query results
+    :param indices:       indices of the nodes found, with shape (no. coordinates, k)
+    :param distances:     distances to the nodes found, with shape (no. coordinates, k)
+    :param node_offsets:  row offsets of each node's attached segments
+    :param node_segments: attached segment indices
+    :param weighted:      weight votes by the inverse of the distance to the node
+    :param epsilon:       distance added before inverting, so coincident nodes have a finite weight
+    :return ndarray:      row offsets of each path's candidates
+    :return ndarray:      ranked candidate segment indices
+    :return ndarray:      votes of each candidate
+    """
+    no_paths = len(offsets) - 1
+    k = indices.shape[1] if indices.ndim == 2 else 1
+
+    # Each query result is repeated once for every segment attached to its node.
+    nodes = indices.ravel()
+    counts = node_offsets[nodes+1] - node_offsets[nodes]
+    paths = np.repeat(np.repeat(np.arange(no_paths), np.diff(offsets) * k), counts)
+    candidates = node_segments[expand_ranges(node_offsets[nodes], counts)]
+
+    if weighted: weights = np.repeat(1 / (distances.ravel() + epsilon), counts)
+    else: weights = None
+
+    # Each path and candidate pair is given a slot of a hash table, so the
+    # votes for every pair are counted with one bincount over the slots.
+    # Every path has its own part of the table, at least twice as long as
+    # its number of rows, so that its slots stay close together.
+    path_sizes = 2 << np.frexp(np.bincount(paths, minlength=no_paths))[1].astype(np.int64)
+    path_starts = np.zeros(no_paths + 1, dtype=np.int64)
+    path_starts[1:] = np.cumsum(path_sizes)
+    table, slots = encode_pairs(candidates, path_starts[paths], path_sizes[paths])
+
+    votes = np.bincount(slots, weights=weights, minlength=len(table)).astype(np.float64)
+    first = np.full(len(table), len(slots), dtype=np.int64)
+    np.minimum.at(first, slots, np.arange(len(slots)))
+
+    # The rows where each pair is first found list the pairs grouped by path,
+    # in the order they were found, so only their votes need to be sorted.
+    rows = np.flatnonzero(first[slots] == np.arange(len(slots)))
+    pair_paths = paths[rows]
+    order = rows[np.lexsort((-votes[slots[rows]], pair_paths))]
+
+    candidate_offsets = np.zeros(no_paths + 1, dtype=np.int64)
+    candidate_offsets[1:] = np.cumsum(np.bincount(pair_paths, minlength=no_paths))
+
+    return candidate_offsets, candidates[order], votes[slots[order]]
+
+def encode_pairs(keys, starts, sizes):
+    """
+    Gives every distinct key of each group a slot of an open addressing hash
+    table, in linear time. Each group has its own part of the table, and
+    colliding keys are moved to the next slot in their group's part, for all
+    keys at once, until each has a slot of its own.
+    :param keys:     non-negative integer keys
+    :param starts:   start of the table part of each key's group
+    :param sizes:    length of the table part of each key's group, a power of two
+                     greater than its number of distinct keys
+    :return ndarray: table, with the key in each used slot and -1 in the others
+    :return ndarray: slot of each key
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    table = np.full(int((starts + sizes).max()) if len(keys) > 0 else 0, -1, dtype=np.int64)
+    masks = sizes - 1
+
+    # Fibonacci hashing spreads consecutive keys over the group's part.
+    offsets = ((keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)).astype(np.int64) & masks
+
+    # Every slot is empty for the first insertion.
+    slots = starts + offsets
+    table[slots] = keys
+    pending = np.flatnonzero(table[slots] != keys)
+
+    while len(pending) > 0:
+        slots[pending] = starts[pending] + ((slots[pending] - starts[pending] + 1) & masks[pending])
+
+        empty = table[slots[pending]] == -1
+        table[slots[pending[empty]]] = keys[pending[empty]]
+        pending = pending[table[slots[pending]] != keys[pending]]
+
+    return table, slots
+
+# Coordinates are projected onto a plane for comparing shapes, which is
+# accurate enough over the size of a city.
+METRES_PER_DEGREE = 111320.0
+
+def project_coordinates(coors, origin_lat):
+    """
+    Projects coordinates onto a plane, in metres.
+    :param coors:      list of [lat, lon] coordinates
+    :param origin_lat: latitude at which the projection has no distortion (degrees)
+    :return ndarray:   [x, y] coordinates (m)
+    """
+    coors = np.asarray(coors, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack((coors[:, 1] * METRES_PER_DEGREE * np.cos(np.radians(origin_lat)), coors[:, 0] * METRES_PER_DEGREE))
+
+def expand_ranges(starts, counts):
+    """
+    Concatenates the ranges start to start+count, without a Python loop.
+    :param starts:   first value of each range
+    :param counts:   length of each range
+    :return ndarray: concatenated ranges
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+def point_segment_distance(points, starts, ends):
+    """
+    Calculates the distance from each point to the line segment in the
+    same row.
+    :param points:   points, with shape (n, 2)
+    :param starts:   start points of the line segments, with shape (n, 2)
+    :param ends:     end points of the line segments, with shape (n, 2)
+    :return ndarray: distances
+    """
+    directions = ends - starts
+    squared_lengths = (directions**2).sum(axis=1)
+
+    offsets = points - starts
+    t = np.clip((offsets * directions).sum(axis=1) / np.where(squared_lengths > 0, squared_lengths, 1), 0, 1)
+
+    return np.linalg.norm(offsets - t[:, None] * directions, axis=1)
+
+def get_unit_vectors(vectors):
+    lengths = np.linalg.norm(vectors, axis=1)
+    return vectors / np.where(lengths > 0, lengths, 1)[:, None]
+
+class PathArrays:
+    def __init__(self, points, point_counts):
+        """
+        Stores many projected paths as flat arrays of points and of the line
+        segments (edges) between them. Paths with one point are given one
+        edge of zero length. Every path must have at least one point.
+        :param points:       points of every path, with shape (n, 2)
+        :param point_counts: number of points in each path
+        """
+        self.point_counts = np.asarray(point_counts, dtype=np.int64)
+        self.point_offsets = np.concatenate(([0], np.cumsum(self.point_counts)[:-1])).astype(np.int64)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        # Bounding box of each path, as [min x, min y, max x, max y].
+        if len(self.point_counts) > 0:
+            self.bounds = np.hstack((np.minimum.reduceat(self.points, self.point_offsets), np.maximum.reduceat(self.points, self.point_offsets)))
+        else: self.bounds = np.zeros((0, 4))
+
+        self.edge_counts = np.maximum(self.point_counts - 1, 1)
+        self.edge_offsets = np.concatenate(([0], np.cumsum(self.edge_counts)[:-1])).astype(np.int64)
+        edge_points = expand_ranges(self.point_offsets, self.edge_counts)
+        single = np.repeat(self.point_counts < 2, self.edge_counts)
+        self.edge_starts = self.points[edge_points]
+        self.edge_ends = self.points[np.where(single, edge_points, edge_points + 1)]
+        self.edge_directions = get_unit_vectors(self.edge_ends - self.edge_starts)
+
+        # The direction of a path at each point is taken from its neighbouring points.
+        index = np.arange(len(self.points))
+        first = np.repeat(self.point_offsets, self.point_counts)
+        last = first + np.repeat(self.point_counts, self.point_counts) - 1
+        self.point_directions = get_unit_vectors(self.points[np.minimum(index + 1, last)] - self.points[np.maximum(index - 1, first)])
+
+    def get_geometries(self, indices):
+        """
+        Creates shapely line strings of some of the paths. Paths with one
+        point are given a line string of zero length.
+        :param indices:  path indices
+        :return ndarray: line strings
+        """
+        counts = np.maximum(self.point_counts[indices], 2)
+        starts = np.repeat(self.point_offsets[indices], counts)
+        points = np.minimum(expand_ranges(self.point_offsets[indices], counts), starts + np.repeat(self.point_counts[indices], counts) - 1)
+
+        return shapely.linestrings(self.points[points], indices=np.repeat(np.arange(len(indices)), counts))
+
+    def get_arrays(self, prefix):
+        """
+        Returns the paths' arrays, so they can be shared with other processes.
+        :param prefix: prefix added to each array's name
+        :return dict:  arrays, keyed by name
+        """
+        return {prefix+name: array for name, array in vars(self).items()}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """
+        Recreates paths from the arrays returned by get_arrays().
+        :param arrays:      arrays, keyed by name
+        :param prefix:      prefix of the paths' array names
+        :return PathArrays: paths
+        """
+        paths = cls.__new__(cls)
+        for name, array in arrays.items():
+            if name.startswith(prefix): setattr(paths, name[len(prefix):], array)
+        return paths
+
+def directed_distances(paths, other_paths, path_indices, other_indices):
+    """
+    Calculates the directed Hausdorff distance from paths to other paths,
+    for many pairs at once, and how well their directions agree. Bearing
+    agreement is the average of |cos| of the angle between the path at
+    each of its points and the nearest edge of the other path, so the
+    direction a road was drawn in does not matter.
+    :param paths:         PathArrays of the first paths
+    :param other_paths:   PathArrays of the other paths
+    :param path_indices:  first path of each pair
+    :param other_indices: other path of each pair
+    :return ndarray:      distance from each first path to the other path
+    :return ndarray:      bearing agreement of each pair, between 0 and 1
+    """
+    # Every point of each first path is compared with every edge of the other path.
+    row_counts = paths.point_counts[path_indices]
+    row_points = expand_ranges(paths.point_offsets[path_indices], row_counts)
+    edge_counts = np.repeat(other_paths.edge_counts[other_indices], row_counts)
+    edges = expand_ranges(np.repeat(other_paths.edge_offsets[other_indices], row_counts), edge_counts)
+    points = np.repeat(row_points, edge_counts)
+
+    distances = point_segment_distance(paths.points[points], other_paths.edge_starts[edges], other_paths.edge_ends[edges])
+    row_starts = np.cumsum(edge_counts) - edge_counts
+    nearest = np.minimum.reduceat(distances, row_starts)
+    pair_starts = np.cumsum(row_counts) - row_counts
+
+    alignment = np.abs((paths.point_directions[points] * other_paths.edge_directions[edges]).sum(axis=1))
+    on_nearest = distances <= np.repeat(nearest, edge_counts)
+    agreement = np.add.reduceat(np.maximum.reduceat(np.where(on_nearest, alignment, 0), row_starts), pair_starts) / row_counts
+
+    # Single points have no direction, so agree with any path.
+    agreement[row_counts < 2] = 1
+
+    return np.maximum.reduceat(nearest, pair_starts), agreement
+
+def score_pairs(paths, other_paths, path_indices, other_indices):
+    """
+    Compares pairs of paths. The shape distance is the smaller of the two
+    directed Hausdorff distances, so a path can match another that only
+    covers part of it, or that it only covers part of.
+    :param paths:         PathArrays of the first paths
+    :param other_paths:   PathArrays of the other paths
+    :param path_indices:  first path of each pair
+    :param other_indices: other path of each pair
+    :return ndarray:      shape distance of each pair
+    :return ndarray:      bearing agreement of each pair, between 0 and 1
+    """
+    if len(path_indices) == 0: return np.zeros(0), np.zeros(0)
+
+    distances, agreement = directed_distances(paths, other_paths, path_indices, other_indices)
+    reverse_distances, _ = directed_distances(other_paths, paths, other_indices, path_indices)
+
+    return np.minimum(distances, reverse_distances), agreement
+
+def get_centre_coordinate(coors):
+    """
+    Returns the coordinate in the middle of a segment's coordinates.
+    :param coors:  list of [lat, lon] coordinates
+    :return list:  centre coordinate
+    """
+    centre_index = float(len(coors))/2
+    if centre_index % 2 != 0:
+        return coors[int(centre_index - .5)]
+    else:
+        return coors[int(centre_index) - 1]
+
+def match_by_votes(osm_coors, osm_names, tt_network, k=3, weighted=False):
+    """
+    Matches OSM segments to TOMTOM segments by voting. Each OSM coordinate
+    votes for the segments attached to its k closest TOMTOM nodes, and the
+    most voted segment with the same street name and non-zero flow data
+    is chosen.
+    :param osm_coors: coordinates of each OSM segment
+    :param osm_names: street name of each OSM segment
+    :param tt_network: TOMTOM network
+    :param k:          number of TOMTOM nodes found for each OSM coordinate
+    :param weighted:   weight votes by the inverse of the distance to each TOMTOM node
+    :return list:      matched TOMTOM segment key of each OSM segment
+    :return ndarray:   confidence of each match, the matched segment's share of the votes
+    """
+    tt_keys, tt_kdt = tt_network.build_KDTree()
+    tt_segments = tt_network.get_network_segments()
+
+    # Every OSM coordinate is queried for the closest k TOMTOM nodes at once,
+    # and the segments attached to these nodes are ranked for each OSM segment.
+    offsets, distances, indices = query_paths(tt_kdt, osm_coors, k=min(k, len(tt_keys)))
+    candidate_keys, node_offsets, node_segments = encode_attached_segments(tt_keys, tt_network.get_network_nodes())
+    candidate_offsets, candidates, votes = rank_candidates(offsets, indices, distances, node_offsets, node_segments, weighted=weighted)
+
+    matches = []
+    confidence = np.zeros(len(osm_coors))
+
+    for i, street_name in enumerate(osm_names):
+        common_keys = [candidate_keys[index] for index in candidates[candidate_offsets[i]:candidate_offsets[i+1]].tolist()]
+        segment_votes = votes[candidate_offsets[i]:candidate_offsets[i+1]]
+        match = None
+
+        # The candidate TOMTOM segments are iterated through, starting with the most voted.
+        for j, tt_key in enumerate(common_keys):
+            try:
+                seg_attributes = tt_segments[tt_key].get_attributes()
+
+                # Segments are matched if they share the same street name and have non-zero flow data.
+                if not any(0 in sl for sl in seg_attributes['flowData']):
+                    if seg_attributes['streetName'] == street_name:
+                        match = tt_key
+                        confidence[i] = segment_votes[j] / segment_votes.sum()
+                        break
+            except KeyError:
+                continue
+
+        # If no match was found, the most voted segment is used.
+        matches.append(match if match != None else common_keys[0])
+
+    return matches, confidence
+
+class SharedArrays:
+    def __init__(self, arrays):
+        """
+        Copies arrays into shared memory, so that worker processes can read
+        them without each receiving their own copy.
+        :param arrays: arrays, keyed by name
+        """
+        self.blocks = []
+        self.specs = {}
+
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """
+        Frees the shared memory.
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def attach_shared_arrays(specs):
+    """
+    Opens arrays created by SharedArrays in another process.
+    :param specs:  SharedArrays.specs
+    :return dict:  arrays, keyed by name
+    :return list:  shared memory blocks, which must be kept open while the arrays are used
+    """
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in specs.items():
+        block = SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        blocks.append(block)
+
+    return arrays, blocks
+
+# Arrays shared with each matching worker process, opened once when the
+# process starts.
+worker_arrays = None
+worker_blocks = None
+
+def init_match_worker(specs):
+    global worker_arrays, worker_blocks
+    worker_arrays, worker_blocks = attach_shared_arrays(specs)
+
+def match_worker_tile(tile, parameters):
+    return match_tile(worker_arrays, tile, **parameters)
+
+def match_tile(arrays, tile, max_distance, distance_scale, bearing_weight, name_weight):
+    """
+    Matches the OSM segments in one tile. The tile's TOMTOM segments, those
+    with flow data whose bounding boxes are within max_distance of the
+    tile's OSM segments, are stored in an STRtree, which shortlists them by
+    their envelopes, buffered by max_distance. Shortlisted segments are
+    kept if they are within max_distance, as the shape distance cannot be
+    any less. The candidates are then scored by their shape distance,
+    bearing agreement and street name, and the lowest cost is chosen.
+    :param arrays:         OSM and TOMTOM path arrays, tiles and street name codes
+    :param tile:           tile index
+    :param max_distance:   maximum shape distance of a match (m)
+    :param distance_scale: shape distance that adds 1 to a candidate's cost (m)
+    :param bearing_weight: cost of a candidate at right angles to the segment
+    :param name_weight:    cost of a candidate with a different street name
+    :return ndarray:       matched OSM segment indices
+    :return ndarray:       TOMTOM segment index of each match
+    :return ndarray:       confidence of each match
+    """
+    osm_paths = PathArrays.from_arrays(arrays, 'osm_')
+    tt_paths = PathArrays.from_arrays(arrays, 'tt_')
+    segments = arrays['tile_segments'][arrays['tile_offsets'][tile]:arrays['tile_offsets'][tile+1]]
+    near = np.sort(arrays['tile_candidates'][arrays['tile_candidate_offsets'][tile]:arrays['tile_candidate_offsets'][tile+1]])
+
+    if len(near) == 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    tree = STRtree(tt_paths.get_geometries(near))
+    osm_indices, tt_indices = tree.query(osm_paths.get_geometries(segments), predicate='dwithin', distance=max_distance)
+
+    # Bounding boxes can be close while the segments are not, such as at the
+    # corner of an L shaped road, so there may be no pairs at all.
+    if len(osm_indices) == 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Pairs are sorted so that ties are always broken the same way.
+    pair_osm, pair_tt = segments[osm_indices], near[tt_indices]
+    order = np.lexsort((pair_tt, pair_osm))
+    pair_osm, pair_tt = pair_osm[order], pair_tt[order]
+
+    distances, agreement = score_pairs(osm_paths, tt_paths, pair_osm, pair_tt)
+    different_names = arrays['name_osm'][pair_osm] != arrays['name_tt'][pair_tt]
+    cost = distances / distance_scale + bearing_weight * (1 - agreement) + name_weight * different_names
+    cost[distances > max_distance] = np.inf
+
+    # The cheapest candidate of each OSM segment is found by sorting the
+    # pairs by segment, then cost.
+    order = np.lexsort((cost, pair_osm))
+    first = order[np.flatnonzero(np.r_[True, pair_osm[order][1:] != pair_osm[order][:-1]])]
+    first = first[np.isfinite(cost[first])]
+
+    return pair_osm[first], pair_tt[first], np.exp(-cost[first])
+
+def match_by_geometry(osm_coors, osm_names, tt_network, max_distance=25, distance_scale=10, bearing_weight=2, name_weight=1, tile_size=1000, workers=1):
+    """
+    Matches OSM segments to TOMTOM segments by their shape. OSM segments
+    are matched in square tiles, as in match_tile(). With more than one
+    worker, the tiles are shared between worker processes, which read the
+    projected coordinates from shared memory rather than each receiving
+    the TOMTOM network. The results do not depend on the number of workers.
+    :param osm_coors:      coordinates of each OSM segment
+    :param osm_names:      street name of each OSM segment
+    :param tt_network:     TOMTOM network
+    :param max_distance:   maximum shape distance of a match (m)
+    :param distance_scale: shape distance that adds 1 to a candidate's cost (m)
+    :param bearing_weight: cost of a candidate at right angles to the segment
+    :param name_weight:    cost of a candidate with a different street name
+    :param tile_size:      width of the tiles OSM segments are matched in (m)
+    :param workers:        number of worker processes, 1 to match all tiles in this process
+    :return list:          matched TOMTOM segment key of each OSM segment
+    :return ndarray:       confidence of each match, exp(-cost), or 0 if no candidate was close enough
+    """
+    tt_segments = tt_network.get_network_segments()
+    tt_keys = [key for key, segment in tt_segments.items() if len(segment.get_coors()) > 0]
+    tt_coors = [tt_segments[key].get_coors() for key in tt_keys]
+
+    # All coordinates are projected at once, about the TOMTOM network's
+    # centre, so that each segment's match does not depend on which other
+    # OSM segments are matched with it.
+    origin_lat = np.mean([coors[0][0] for coors in tt_coors]) if len(tt_coors) > 0 else 0
+    osm_paths = PathArrays(project_coordinates([coor for coors in osm_coors for coor in coors], origin_lat), [len(coors) for coors in osm_coors])
+    tt_paths = PathArrays(project_coordinates([coor for coors in tt_coors for coor in coors], origin_lat), [len(coors) for coors in tt_coors])
+
+    # Street names are given integer codes, so they can be compared in
+    # shared memory.
+    name_codes = {}
+    name_tt = np.array([name_codes.setdefault(str(tt_segments[key].get_attributes().get('streetName')), len(name_codes)) for key in tt_keys], dtype=np.int64)
+    name_osm = np.array([name_codes.setdefault(str(name), len(name_codes)) for name in osm_names], dtype=np.int64)
+    tt_valid = np.array([not any(0 in sl for sl in tt_segments[key].get_attributes().get('flowData', [[0]])) for key in tt_keys], dtype=bool)
+
+    # OSM segments are grouped by the tile containing their first point.
+    _, tiles = np.unique(np.floor(osm_paths.points[osm_paths.point_offsets] / tile_size).astype(np.int64), axis=0, return_inverse=True)
+    tiles = tiles.ravel()
+    no_tiles = int(tiles.max()) + 1 if len(tiles) > 0 else 0
+    tile_segments = np.argsort(tiles, kind='stable')
+    tile_offsets = np.searchsorted(tiles[tile_segments], np.arange(no_tiles + 1))
+
+    # Each tile's TOMTOM segments are found by querying a tree of the
+    # bounding boxes of the TOMTOM segments with flow data.
+    valid = np.flatnonzero(tt_valid)
+    tile_bounds = np.hstack((np.minimum.reduceat(osm_paths.bounds[tile_segments, :2], tile_offsets[:-1]) - max_distance,
+                             np.maximum.reduceat(osm_paths.bounds[tile_segments, 2:], tile_offsets[:-1]) + max_distance)) if no_tiles > 0 else np.zeros((0, 4))
+    bounds_tree = STRtree(shapely.box(*tt_paths.bounds[valid].T))
+    candidate_tiles, candidates = bounds_tree.query(shapely.box(*tile_bounds.T))
+    tile_candidate_offsets = np.searchsorted(candidate_tiles, np.arange(no_tiles + 1))
+
+    arrays = {'tile_segments': tile_segments, 'tile_offsets': tile_offsets, 'tile_candidates': valid[candidates],
+              'tile_candidate_offsets': tile_candidate_offsets, 'name_osm': name_osm, 'name_tt': name_tt}
+    arrays.update(osm_paths.get_arrays('osm_'))
+    arrays.update(tt_paths.get_arrays('tt_'))
+    parameters = {'max_distance': max_distance, 'distance_scale': distance_scale, 'bearing_weight': bearing_weight, 'name_weight': name_weight}
+
+    if workers > 1 and no_tiles > 1:
+        with SharedArrays(arrays) as shared_arrays:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_match_worker, initargs=(shared_arrays.specs,)) as executor:
+                results = list(executor.map(match_worker_tile, range(no_tiles), [parameters]*no_tiles))
+    else:
+        results = [match_tile(arrays, tile, **parameters) for tile in range(no_tiles)]
+
+    matches = np.full(len(osm_coors), -1, dtype=np.int64)
+    confidence = np.zeros(len(osm_coors))
+    for matched_osm, matched_tt, matched_confidence in results:
+        matches[matched_osm] = matched_tt
+        confidence[matched_osm] = matched_confidence
+
+    # Segments without a close enough candidate are given the nearest TOMTOM segment.
+    unmatched = np.flatnonzero(matches < 0)
+    if len(unmatched) > 0:
+        tree = STRtree(tt_paths.get_geometries(np.arange(len(tt_keys))))
+        matches[unmatched] = tree.nearest(osm_paths.get_geometries(unmatched))
+
+    return [tt_keys[index] for index in matches.tolist()], confidence
+
+def estimate_vehicle_props(vehicle_kdtree, vehicle_data, centres, k=4, radius=2000.0, power=2.0):
+    """
+    Estimates the vehicle proportions at each centre coordinate by inverse
+    distance weighting of the k nearest count points within a radius. The
+    nearest count point is always used, so centres with no count points
+    in the radius are given its proportions.
+    :param vehicle_kdtree: K-D tree of count point cartesian coordinates (m), from build_vehicle_kdtree()
+    :param vehicle_data:   vehicle proportions of each count point
+    :param centres:        list of [lat, lon] coordinates
+    :param k:              number of count points used for each centre
+    :param radius:         distance beyond which count points are not used (m)
+    :param power:          power of the distance in the weights
+    :return ndarray:       vehicle proportions, with shape (no. centres, no. vehicle types)
+    :return ndarray:       distance to the nearest count point (m)
+    """
+    vehicle_data = np.asarray(vehicle_data, dtype=np.float64)
+    centres = np.asarray(centres, dtype=np.float64).reshape(-1, 2)
+    if len(centres) == 0: return np.zeros((0, vehicle_data.shape[1])), np.zeros(0)
+
+    # The tree is built on cartesian coordinates in metres, so the nearest
+    # count points and their distances are found in one query, nearest first.
+    distances, ind = vehicle_kdtree.query(cartesian_coordinates(centres), k=min(k, len(vehicle_data)))
+
+    # Distances are limited to 1 m, so a count point at a centre does not
+    # give an infinite weight.
+    weights = np.maximum(distances, 1.0) ** -power
+    weights[:, 1:][distances[:, 1:] > radius] = 0
+
+    vehicle_props = np.einsum('ij,ijk->ik', weights, vehicle_data[ind]) / weights.sum(axis=1)[:, None]
+
+    return vehicle_props, distances[:, 0]
+
+def match_networks(osm_network, tt_network, vehicle_kdtree, vehicle_data, method='geometry', k=3, weighted_votes=False, workers=1, match_table=None,
+                   vehicle_k=4, vehicle_radius=2000.0, verbose=False):
+    """
+    Gives every segment in the OSM network the flow data of the TOMTOM
+    segment that best matches it, the confidence of that match, and vehicle
+    proportions estimated from the nearest count points. If a match table is given, segments that have
+    not changed since the table was saved reuse their stored matches, and
+    the table is updated with the new matches.
+    :param osm_network:    OSM network, which is changed in place
+    :param tt_network:     TOMTOM network
+    :param vehicle_kdtree: K-D tree of count point coordinates
+    :param vehicle_data:   vehicle proportions of each count point
+    :param method:         'geometry' to match by shape, or 'votes' to match by closest nodes
+    :param k:              number of TOMTOM nodes found for each OSM coordinate, when voting
+    :param weighted_votes: weight candidate votes by the inverse of the distance to each TOMTOM node
+    :param workers:        number of worker processes used to match by geometry
+    :param match_table:    MatchTable of previous matches, or None to match every segment
+    :param vehicle_k:      number of count points used for each segment's vehicle proportions
+    :param vehicle_radius: distance beyond which count points are not used (m)
+    :param verbose:        print merging progress
+    :return dict:          match confidence of each OSM segment, between 0 and 1
+    """
+    tt_segments = tt_network.get_network_segments()
+
+    osm_keys = list(osm_network.get_network_segments().keys())
+    osm_segments = [osm_network.get_network_segments()[key] for key in osm_keys]
+    osm_coors = [segment.get_coors() for segment in osm_segments]
+    osm_names = [segment.get_attributes()['streetName'] for segment in osm_segments]
+
+    no_segments = len(osm_segments)
+    matches = [None] * no_segments
+    confidence = np.zeros(no_segments)
+
+    # Stored matches are used for segments that have not changed.
+    if match_table != None:
+        segment_hashes = [get_segment_hash(coors, name) for coors, name in zip(osm_coors, osm_names)]
+        source = get_match_source(tt_network, {'method': method, 'k': k, 'weighted_votes': weighted_votes})
+
+        for i in range(no_segments):
+            entry = match_table.get(source, osm_keys[i], segment_hashes[i])
+            if entry != None: matches[i], confidence[i] = entry
+
+    unmatched = [i for i in range(no_segments) if matches[i] == None]
+    if verbose and match_table != None: print('   ... Reusing {0} of {1} matches.'.format(no_segments - len(unmatched), no_segments))
+
+    if len(unmatched) > 0:
+        unmatched_coors = [osm_coors[i] for i in unmatched]
+        unmatched_names = [osm_names[i] for i in unmatched]
+
+        if verbose: print('   ... Matching {0} segments by {1}.'.format(len(unmatched), method))
+        if method == 'geometry': new_matches, new_confidence = match_by_geometry(unmatched_coors, unmatched_names, tt_network, workers=workers)
+        elif method == 'votes': new_matches, new_confidence = match_by_votes(unmatched_coors, unmatched_names, tt_network, k, weighted_votes)
+        else: raise ValueError("Unknown matching method '{0}'.".format(method))
+
+        for i, match, match_confidence in zip(unmatched, new_matches, new_confidence.tolist()):
+            matches[i] = match
+            confidence[i] = match_confidence
+
+    centres = []
+    centre_segments = []
+
+    for i, segment in enumerate(osm_segments):
+        count = i + 1
+        if verbose: generate_progress_bar(count, no_segments, "{0} of {1} ({2}%)".format(count, no_segments, round(count*100/no_segments, 1)), prefix='   ... Merging segments: ')
+        segment.set_attribute('flowData', tt_segments[matches[i]].get_attributes()['flowData'])
+        segment.set_attribute('matchConfidence', confidence[i].item())
+
+        # Segments with observed vehicles are given vehicle proportions
+        # estimated at their centre, which are found together once all
+        # segments have been matched.
+        if sum(segment.get_flow_measures(3)) / len(segment.get_flow_measures(3)) != 0:
+            centres.append(get_centre_coordinate(osm_coors[i]))
+            centre_segments.append(i)
+
+        # If there are no observed vehicles, the segment is given 0 values as their
+        # proportions.
+        else: segment.set_attribute('vehicleProps', [0, 0, 0, 0, 0])
+
+    # The distance to the nearest count point is also stored, as a measure
+    # of how well the proportions are covered by the count points.
+    vehicle_props, count_point_distances = estimate_vehicle_props(vehicle_kdtree, vehicle_data, centres, vehicle_k, vehicle_radius)
+    for i, props, distance in zip(centre_segments, vehicle_props.tolist(), count_point_distances.tolist()):
+        osm_segments[i].set_attribute('vehicleProps', props)
+        osm_segments[i].set_attribute('countPointDistance', distance)
+
+    if match_table != None:
+        match_table.update(source, {osm_keys[i]: (segment_hashes[i], matches[i], confidence[i].item()) for i in range(no_segments)})
+        match_table.save()
+
+    if verbose: print('\n   ... Matched {0} of {1} segments.'.format(int(np.count_nonzero(confidence)), no_segments))
+
+    return dict(zip(osm_keys, confidence.tolist()))
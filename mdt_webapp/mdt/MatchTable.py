@@ -0,0 +1,98 @@
+import os, json, hashlib, tempfile
+import numpy as np
+
+# Tables written in a different format are ignored, and replaced when saved.
+TABLE_FORMAT = 2
+
+def get_segment_hash(coors, street_name):
+    """
+    Creates a hash of the parts of an OSM segment that its match depends on.
+    :param coors:       list of [lat, lon] coordinates
+    :param street_name: street name
+    :return str:        segment hash
+    """
+    segment_hash = hashlib.sha256(str(street_name).encode('utf-8'))
+    segment_hash.update(np.asarray(coors, dtype=np.float64).tobytes())
+    return segment_hash.hexdigest()[:32]
+
+def get_match_source(tt_network, parameters):
+    """
+    Creates a hash of everything, other than the OSM segments, that matches
+    depend on. Matches made with a different TOMTOM network or matching
+    parameters are not reused.
+    :param tt_network: TOMTOM network
+    :param parameters: matching parameters
+    :return str:       source hash
+    """
+    source_hash = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+
+    # Only the geometry, names and whether segments have flow data affect
+    # matching, so flow data can change without invalidating matches.
+    for key, segment in tt_network.get_network_segments().items():
+        attributes = segment.get_attributes()
+        has_flow = not any(0 in sl for sl in attributes.get('flowData', [[0]]))
+        source_hash.update(repr((key, str(attributes.get('streetName')), has_flow)).encode('utf-8'))
+        source_hash.update(np.asarray(segment.get_coors(), dtype=np.float64).tobytes())
+
+    return source_hash.hexdigest()
+
+class MatchTable:
+    def __init__(self, filename):
+        """
+        Stores the TOMTOM segment matched to each OSM segment, so that a
+        rebuild only needs to match segments that have changed. Entries are
+        keyed by OSM segment key, and are only used if the segment's hash
+        and the table's source hash are unchanged.
+        :param filename: match table file path
+        """
+        self.filename = filename
+        self.source = None
+        self.entries = {}
+
+        if os.path.isfile(filename):
+            with open(filename) as table_file:
+                table = json.load(table_file)
+
+            if table.get('format') == TABLE_FORMAT:
+                self.source = table['source']
+                for osm_key, segment_hash, tt_key, confidence in table['entries']:
+                    self.entries[osm_key] = (segment_hash, tt_key, confidence)
+
+    def get(self, source, osm_key, segment_hash):
+        """
+        Returns a stored match.
+        :param source:       source hash, from get_match_source()
+        :param osm_key:      OSM segment key
+        :param segment_hash: segment hash, from get_segment_hash()
+        :return tuple:       TOMTOM segment key and confidence,
+                             or None if the segment has not been matched with the same source
+        """
+        if source != self.source or osm_key not in self.entries: return None
+
+        entry = self.entries[osm_key]
+        if entry[0] != segment_hash: return None
+        return entry[1:]
+
+    def update(self, source, entries):
+        """
+        Replaces the table's matches.
+        :param source:  source hash, from get_match_source()
+        :param entries: (segment hash, TOMTOM segment key, confidence) tuples,
+                        keyed by OSM segment key
+        """
+        self.source = source
+        self.entries = entries
+
+    def save(self):
+        """
+        Writes the table to its file.
+        """
+        table = {'format': TABLE_FORMAT,
+                 'source': self.source,
+                 'entries': [[osm_key] + list(entry) for osm_key, entry in self.entries.items()]}
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        file, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(file, 'w') as table_file:
+            json.dump(table, table_file)
+        os.replace(temp_filename, self.filename)
@@ -1,82 +1,94 @@
-import os, sys, json, math, random, overpy
+import os, sys, copy, math, random, pickle, overpy
 import numpy as np
 from time import sleep
 from sklearn.neighbors import KDTree
-from geopy.distance import distance
 from os.path import basename
 from zipfile import ZipFile
-
+from collections import deque
+from collections.abc import MutableMapping
+
+from mdt_webapp.mdt.TomTomReader import TomTomReader
+from mdt_webapp.mdt.Geodesy import path_length, path_lengths
+from mdt_webapp.mdt.CoordinateIndex import CoordinateIndex
+from mdt_webapp.mdt.OverpassCache import CachedOverpass
+from mdt_webapp.mdt.NetworkFile import network_to_arrays, write_network_file, read_network_file, is_network_file, SegmentColumns
 from mdt_project.settings import CSV_DIR,ZIP_DIR
 
 class Network:
-    def __init__(self, filename=None, query=None, verbose=False):
+    def __init__(self, filename=None, query=None, verbose=False, overpass_url=None, overpass_cache=None, node_resolution=1e-6):
         """
         Create network from either JSON file or OSM query.
-        :param filename: TOMTOM data file_path
-        :param query:    Single OSM query
-        :param verbose:  Print network creation progress
+        :param filename:        TOMTOM data file_path
+        :param query:           Single OSM query
+        :param verbose:         Print network creation progress
+        :param overpass_url:    Overpass API url, if not the public API
+        :param overpass_cache:  OverpassCache for API responses
+        :param node_resolution: grid size (degrees) within which TOMTOM points are merged into one node
         """
 
         self.nodes = {}
         self.segments = {}
+
+        # K-D trees of the network's nodes, built when first needed
+        # and cleared whenever the network changes.
+        self.spatial_indexes = {}
         
         # Networks are either created exclusively from
         # an OSM query or TOMTOM json file.
         if filename != None and query == None:
             print("Building from '{0}':".format(filename))
-            self.build_from_file(filename, verbose)
+            self.build_from_file(filename, verbose, node_resolution)
 
         elif query != None and filename == None:
-            self.build_from_query(query, verbose)
+            self.build_from_query(query, verbose, overpass_url, overpass_cache)
 
-    def build_from_file(self, filename, verbose):
+    def build_from_file(self, filename, verbose, node_resolution=1e-6):
         """
         Builds network with TOMTOM data, downloaded in JSON format.
-        :param filename: JSON file path
-        :param verbose:  Print network creation progress
+        :param filename:        JSON file path
+        :param verbose:         Print network creation progress
+        :param node_resolution: grid size (degrees) within which points are merged into one node
         """
-        with open(filename) as json_file:
-            data = json.load(json_file)
-
-        if verbose: print('JSON File successfully loaded.')
+        # Segments are read from the file one at a time, as TOMTOM
+        # exports can be too large to load at once.
+        reader = TomTomReader(filename)
+        coordinate_index = CoordinateIndex(node_resolution)
 
         count = 1
 
-        for segment in data['network']['segmentResults']:
-            if verbose: generate_progress_bar(count, 6903, "{0} of {1} ({2}%)".format(count, 6903, round(count*100/6903, 1)))
+        for segment in reader:
+            if verbose:
+                progress = reader.bytes_read / max(reader.file_size, 1)
+                generate_progress_bar(progress, 1, "{0} segments ({1}%)".format(count, round(progress*100, 1)))
 
-            self.add_elements(tt_segment=segment)
+            self.add_elements(tt_segment=segment, coordinate_index=coordinate_index)
             count += 1
 
+        if verbose:
+            statistics = coordinate_index.get_statistics()
+            print("\n   ... Reduced {0} points to {1} nodes ({2} duplicates, {3} merged).".format(statistics['points'], statistics['nodes'], statistics['duplicates'], statistics['merged']))
+
         # The TOMTOM network is more complex than the OpenStreetMap
         # data, so degree 2 nodes are removed.
         self.simplify()
 
-    def build_from_query(self, query, verbose):
+    def build_from_query(self, query, verbose, overpass_url=None, overpass_cache=None):
         """
         Builds network with data from OpenStreetMap, using a query
         to Overpass API.
-        :param query:   Overpass API query
-        :param verbose: Print network creation progress
+        :param query:          Overpass API query
+        :param verbose:        Print network creation progress
+        :param overpass_url:   Overpass API url, if not the public API
+        :param overpass_cache: OverpassCache for API responses
         """
 
-        overpy_api = overpy.Overpass()
-        result = ""
-
-        while result == "":
-            try:
-                if verbose: print("   ... Querying Overpass API.")
-                result = overpy_api.query(query)
+        # Cached responses are used where possible, so rebuilding a network
+        # from an unchanged query does not need the Overpass API.
+        if overpass_cache != None: overpy_api = CachedOverpass(overpass_cache, url=overpass_url)
+        else: overpy_api = overpy.Overpass(url=overpass_url)
 
-            # If the Overpass API server is overloaded or has received
-            # too many requests, the program times out before retrying.
-            except overpy.exception.OverpassTooManyRequests:
-                if verbose: print("         ↳ Too many requests, sleeping for 10s...")
-                sleep(10)
-
-            except overpy.exception.OverpassGatewayTimeout:
-                if verbose: print("         ↳ Server overloaded, sleeping for 20s...")
-                sleep(20)
+        if verbose: print("   ... Querying Overpass API.")
+        result = query_overpass(overpy_api, query, verbose)
 
         segments = result.get_ways()
         nodes = result.get_nodes()
@@ -84,42 +96,78 @@ class Network:
 
         if verbose: print('   ... Query successful: Returned {0} ways, {1} nodes.'.format(no_segments, len(nodes)))
 
+        # Nodes missing from the result are fetched before any segments are
+        # added, so adding segments does not make any further requests.
+        self.resolve_missing_nodes(overpy_api, result, verbose)
+
         count = 1
 
         for segment in segments:
-            added = False
-            while added == False:
-                try:
-                    if verbose: generate_progress_bar(count, no_segments, "{0} of {1} ({2}%)".format(count, no_segments, round(count*100/no_segments, 1)))
-
-                    # Each segment is added with the add_elements function.
-                    self.add_elements(osm_segment=segment)
-                    added = True
-                    count += 1
-
-                # The details of each  node has to be fetched from Overpass API,
-                # so the same timeout rules are applied here as well.
-                except overpy.exception.OverpassTooManyRequests:
-                    if verbose: generate_progress_bar(count, no_segments, 'Sleeping for 10s...    ')
-                    sleep(10)
-                    
-                except overpy.exception.OverpassGatewayTimeout:
-                    if verbose: generate_progress_bar(count, no_segments, 'Sleeping for 20s...    ')
-                    sleep(20)
-                
-    def add_elements(self, osm_segment=None, tt_segment=None):
+            if verbose: generate_progress_bar(count, no_segments, "{0} of {1} ({2}%)".format(count, no_segments, round(count*100/no_segments, 1)))
+
+            # Each segment is added with the add_elements function. Ways with nodes
+            # that no longer exist cannot be drawn, and are skipped.
+            try: self.add_elements(osm_segment=segment, calculate_length=False)
+            except overpy.exception.DataIncomplete:
+                if verbose: print("\n         ↳ Skipping way {0}, which has missing nodes.".format(segment.id))
+
+            count += 1
+
+        # Segment lengths are calculated together once all segments are added.
+        self.calculate_lengths()
+
+    def calculate_lengths(self):
+        """
+        Calculates the length and centre of every segment in the network
+        in one batch.
+        """
+        segments = list(self.segments.values())
+        lengths, centres = path_lengths([segment.get_coors() for segment in segments])
+
+        for segment, length, centre in zip(segments, lengths.tolist(), centres.tolist()):
+            segment.set_attribute('length', length)
+            segment.set_attribute('centre', centre)
+
+    def resolve_missing_nodes(self, overpy_api, result, verbose=False, batch_size=500):
+        """
+        Finds the ways in a query result with nodes that are not in the
+        result, and adds their nodes to it using a few batched queries
+        rather than one query per way.
+        :param overpy_api: Overpass API object
+        :param result:     Overpass query result
+        :param verbose:    Print network creation progress
+        :param batch_size: maximum number of ways whose nodes are fetched per query
+        """
+        incomplete = []
+        for way in result.get_ways():
+            try: way.get_nodes()
+            except overpy.exception.DataIncomplete: incomplete.append(way.id)
+
+        # Way IDs are sorted so the same ways always give the same queries.
+        incomplete.sort()
+        if len(incomplete) == 0: return
+
+        if verbose: print("   ... Fetching the nodes of {0} ways.".format(len(incomplete)))
+        for i in range(0, len(incomplete), batch_size):
+            batch = ','.join(str(way_id) for way_id in incomplete[i:i+batch_size])
+            result.expand(query_overpass(overpy_api, "[out:json];way(id:{0});node(w);out body;".format(batch), verbose))
+
+    def add_elements(self, osm_segment=None, tt_segment=None, calculate_length=True, coordinate_index=None):
         """
         Adds segments to the current network object, as well as
         any of its connecting nodes.
-        :param osm_segment: Overpy way object from query result
-        :param tt_segment:  TOMTOM data segment
+        :param osm_segment:      Overpy way object from query result
+        :param tt_segment:       TOMTOM data segment
+        :param calculate_length: calculate the length of OSM segments as they are added
+        :param coordinate_index: CoordinateIndex used to find TOMTOM nodes
         """
+        self.invalidate_spatial_indexes()
 
         # Both the OSM and TT networks use the same function for
         # creating nodes and segments.
         if osm_segment != None and tt_segment == None:
         
-            segment_nodes = osm_segment.get_nodes(resolve_missing=True)
+            segment_nodes = osm_segment.get_nodes()
 
             # The coordinates and keys of all of a segment's nodes are
             # stored, for drawing and finding connected segments respectively.
@@ -141,10 +189,11 @@ class Network:
                 # such as the street name, speed limit, number of lanes etc.
                 data = format_osm_data(osm_segment)
                 self.segments[osm_segment.id] = Segment(nodes_arr, coors_arr, attributes=data)
-                self.segments[osm_segment.id].calculate_length()
+                if calculate_length: self.segments[osm_segment.id].calculate_length()
 
         elif osm_segment == None and tt_segment != None:
             tt_segment_id = abs(int(tt_segment['segmentId']))
+            if coordinate_index == None: coordinate_index = CoordinateIndex()
 
             nodes_arr = []
             coors_arr = []
@@ -152,9 +201,13 @@ class Network:
 
                 # The TOMTOM network does not contain node objects, instead solely using
                 # the coordinates associated with each segment, and so do not have keys. So,
-                # for the nodes dictionary, a unique key is generated by multiplying the 
-                # longitude and latitude values for each node.
-                node_id = int(abs(coor['latitude']*coor['longitude'])*(10**12))
+                # for the nodes dictionary, the key of the grid cell containing the point is
+                # used, which also merges points that are almost the same.
+                node_id = coordinate_index.add(coor['latitude'], coor['longitude'])[0]
+
+                # Consecutive points in the same cell are only added once.
+                if len(nodes_arr) > 0 and nodes_arr[-1] == node_id: continue
+
                 if node_id not in self.nodes:
                     node_obj = Node(float(coor['latitude']), float(coor['longitude']))
                     self.nodes[node_id] = node_obj
@@ -173,98 +226,142 @@ class Network:
     def simplify(self):
         """
         Joins together all segments where one road consists of
-        multiple segments by removing degree 2 nodes.
+        multiple segments by removing degree 2 nodes. Nodes are kept on a
+        work list, and the ends of each joined segment are checked again,
+        so joining continues until no more segments can be joined.
         """
-        for node_id in self.nodes:
+        # Lengths are calculated for all segments at once, so joined
+        # segments only need to add them together.
+        self.calculate_lengths()
+
+        work_list = deque(self.nodes.keys())
+        queued = set(work_list)
+
+        while len(work_list) > 0:
+            node_id = work_list.popleft()
+            queued.discard(node_id)
+
             segments = self.nodes[node_id].get_attached()
-            if len(segments) == 2:
-                
-                segment0 = self.segments[segments[0]]
-                segment1 = self.segments[segments[1]]
+            if len(segments) != 2 or segments[0] == segments[1]: continue
+            if segments[0] not in self.segments or segments[1] not in self.segments: continue
 
-                # Segments are only joined if they share a degree 2 node at either end, and
-                # they have the same street name.
-                if segment0.get_attributes()['streetName'] == segment1.get_attributes()['streetName']:
-                    new_attributes = merge_flow_data(segment0, segment1)
-                    if node_id == segment0.get_nodes()[-1] and node_id == segment1.get_nodes()[0]:
+            segment0 = self.segments[segments[0]]
+            segment1 = self.segments[segments[1]]
 
-                        new_segment = segment0.join_segment(segment1, new_attributes)
-                        self.replace_segments(segments[0], segments[1], new_segment)
+            # Segments are only joined if they share a degree 2 node at either end, and
+            # they have the same street name.
+            if segment0.get_attributes()['streetName'] != segment1.get_attributes()['streetName']: continue
 
-                    if node_id == segment0.get_nodes()[0] and node_id == segment1.get_nodes()[-1]:
-                        new_segment = segment1.join_segment(segment0, new_attributes)
-                        self.replace_segments(segments[0], segments[1], new_segment)
+            if node_id == segment0.get_nodes()[-1] and node_id == segment1.get_nodes()[0]:
+                new_segment = segment0.join_segment(segment1, merge_flow_data(segment0, segment1))
+            elif node_id == segment0.get_nodes()[0] and node_id == segment1.get_nodes()[-1]:
+                new_segment = segment1.join_segment(segment0, merge_flow_data(segment0, segment1))
+            else: continue
+
+            self.replace_segments(segments[0], segments[1], new_segment)
+
+            for end_node in [new_segment.get_nodes()[0], new_segment.get_nodes()[-1]]:
+                if end_node not in queued:
+                    work_list.append(end_node)
+                    queued.add(end_node)
 
     def replace_segments(self, id1, id2, replacement=None):
         """
-        Replaces one segment in the network with one new segment.
+        Replaces two segments in the network with one new segment. Only
+        the nodes of the two segments are updated.
         :param id1:         ID of first segment to replace
         :param id2:         ID of second segment to replace
         :param replacement: New segment.
+        :return int:        ID of the new segment
         """
+        self.invalidate_spatial_indexes()
+        segment1 = self.segments.pop(id1, None)
+        segment2 = self.segments.pop(id2, None)
 
-        # A unique ID is created for the new segment by adding together
-        # the original segments' IDs.
+        # A unique ID is created for the new segment from its first two
+        # coordinates, and is incremented if another segment already has it.
         replacement_id = int(abs(sum(replacement.get_coors()[0])) + abs(sum(replacement.get_coors()[1]))*(10**5))
-        new_segment_dict = self.segments.copy()
-
-        # The segment dictionary is iterated through, and the original
-        # segments are deleted once a match is found.
-        deleted1 = False
-        deleted2 = False
-        for segment_id in new_segment_dict:
-            if not deleted1 and segment_id == id1:
-                self.segments.pop(id1)
-                deleted1 = True
-            if not deleted2 and segment_id == id2:
-                self.segments.pop(id2)
-                deleted2 = True
-            if deleted1 and deleted2:
-                break
-
-        # The new replacement segment's ID is added to the attached_segments
-        # of all of its nodes.
-        if replacement_id != None:
-            for node in self.nodes.values():
-                attached = node.get_attached()
-                if id1 in attached:
-                    node.set_attached([replacement_id if x==id1 else x for x in attached])
-                    replaced1 = True
-                if id2 in attached:
-                    node.set_attached([replacement_id if x==id2 else x for x in attached])
-                    replaced2 = True
-        
+        while replacement_id in self.segments:
+            replacement_id += 1
+
+        # The original segments' IDs are replaced with the new segment's ID
+        # for all of their nodes, which are the only nodes they are attached to.
+        nodes = set()
+        for segment in [segment1, segment2]:
+            if segment != None: nodes.update(segment.get_nodes())
+
+        for node_id in nodes:
+            attached = self.nodes[node_id].get_attached()
+            if id1 in attached or id2 in attached:
+                self.nodes[node_id].set_attached(list(dict.fromkeys(replacement_id if x==id1 or x==id2 else x for x in attached)))
+
         self.segments[replacement_id] = replacement
+
+        return replacement_id
     
     def build_KDTree(self, end_nodes=False):
         """
-        Builds K-D tree of all the network's nodes.
+        Returns a K-D tree of all the network's nodes. The tree is built
+        the first time it is needed, and then reused until the network
+        changes. The returned keys are shared, so must not be changed.
         :param end_nodes: restrict K-D tree to nodes at the end of segments
         :return [int]:    array of node keys
         :return KDTree:   K-D Tree object
         """
-        node_keys = []
-        node_coors = []
-        for key in self.nodes.keys():
-            if end_nodes:
-                if self.is_end_node(key) == False:
-                    continue
-            node_keys.append(key)
-            node_coors.append(self.nodes[key].get_coors())
-
-        node_coors = np.asarray(node_coors)
-
-        kdt = KDTree(node_coors)
+        name = 'end_nodes' if end_nodes else 'nodes'
+        if name not in self.spatial_indexes:
+            self.spatial_indexes[name] = self.create_KDTree(end_nodes)
 
         # Returns an ordered list of node keys so the data can be
         # fetched with the node's indices.
-        return node_keys, kdt
+        return self.spatial_indexes[name]
+
+    def create_KDTree(self, end_nodes=False):
+        """
+        Builds a new K-D tree of the network's nodes.
+        :param end_nodes: restrict K-D tree to nodes at the end of segments
+        :return [int]:    array of node keys
+        :return KDTree:   K-D Tree object
+        """
+        node_keys = list(self.nodes.keys())
+        node_coors = np.array([node.get_coors() for node in self.nodes.values()], dtype=np.float64).reshape(-1, 2)
+
+        if end_nodes:
+            flags = self.get_end_node_flags()
+            node_keys = [key for key, flag in zip(node_keys, flags) if flag]
+            node_coors = node_coors[flags]
+
+        return node_keys, KDTree(node_coors)
+
+    def get_end_node_flags(self):
+        """
+        Finds which nodes are at the start or end of one of their attached
+        segments, in the order of the network's nodes, by visiting the ends
+        of every segment once.
+        :return ndarray: boolean array, True for end nodes
+        """
+        end_nodes = set()
+        for key, segment in self.segments.items():
+            nodes = segment.get_nodes()
+            if len(nodes) == 0: continue
+            for node_id in [nodes[0], nodes[-1]]:
+                if key in self.nodes[node_id].get_attached(): end_nodes.add(node_id)
+
+        return np.fromiter((key in end_nodes for key in self.nodes.keys()), dtype=bool, count=len(self.nodes))
+
+    def invalidate_spatial_indexes(self):
+        """
+        Clears the network's K-D trees, so they are rebuilt with the
+        network's current nodes when next needed.
+        """
+        self.spatial_indexes = {}
 
     def merge_with_network(self, network):
         """
         Merges the current network with another.
         :param network: network to merge with
         """
+        self.invalidate_spatial_indexes()
 
         # Any segments shared by the two networks are only represented once.
         for key in network.get_network_segments().keys():
@@ -275,6 +372,70 @@ class Network:
             if key not in self.nodes:
                 self.nodes[key] = network.get_network_nodes()[key]
 
+    def view(self):
+        """
+        Creates a lightweight copy of the network. Nodes and segment geometry
+        are shared with the original, but each segment gets its own copy of
+        its attributes, so emissions and modifiers can be applied to the view
+        without changing the original network.
+        :return Network: network view
+        """
+        network = Network()
+        network.nodes = self.nodes
+        network.segments = {key: segment.view() for key, segment in self.segments.items()}
+        network.spatial_indexes = self.spatial_indexes
+
+        return network
+
+    def save(self, path):
+        """
+        Saves the network to a network file, a directory of arrays
+        that can be memory mapped when loaded. The network's K-D trees are
+        saved with it, so they do not need building when it is loaded.
+        :param path: network file path
+        """
+        arrays, hours, extras = network_to_arrays(self)
+        indexes = {'nodes': self.build_KDTree()[1], 'end_nodes': self.build_KDTree(end_nodes=True)[1]}
+        write_network_file(path, arrays, hours, extras, indexes)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a network from a network file, as editable Node and Segment
+        objects. Every value is copied into them, so the arrays are read
+        into memory rather than memory mapped. Networks that are only read
+        should be opened with ArrayNetwork.load() instead.
+        :param path:     network file path
+        :return Network: loaded network
+        """
+        arrays, hours, extras = read_network_file(path, mmap_mode=None)
+        network = cls()
+
+        node_ids = arrays['node_ids'].tolist()
+        node_coors = arrays['node_coors'].tolist()
+        attached_offsets = arrays['node_segment_offsets'].tolist()
+        attached_ids = arrays['node_segment_ids'].tolist()
+
+        for i in range(len(node_ids)):
+            node = Node(node_coors[i][0], node_coors[i][1])
+            node.set_attached(attached_ids[attached_offsets[i]:attached_offsets[i+1]])
+            network.nodes[node_ids[i]] = node
+
+        columns = SegmentColumns(arrays, hours, extras)
+        segment_offsets = arrays['segment_node_offsets'].tolist()
+        segment_nodes = arrays['segment_nodes'].tolist()
+        closed = arrays['segment_closed'].tolist()
+
+        # Segment coordinates are not stored, as they are the
+        # coordinates of the segment's nodes.
+        for i, key in enumerate(arrays['segment_ids'].tolist()):
+            indices = segment_nodes[segment_offsets[i]:segment_offsets[i+1]]
+            segment = Segment([node_ids[j] for j in indices], [node_coors[j] for j in indices], attributes=columns.get_attributes(i))
+            segment.closed = closed[i]
+            network.segments[key] = segment
+
+        return network
+
     def calculate_factors(self, get_highest_speed=False, get_highest_emissions=False):
         """
         Calculates average network speed, emissions and average flow rate.
@@ -349,7 +510,8 @@ class Network:
             return most_congested, worst_emitter
 
 
-    def export_network(self, segment_output="segments.csv", node_output="nodes.csv", flow_output="flow.csv", emissions_output="emissions.csv", zip_output="network.zip"):
+    def export_network(self, segment_output="segments.csv", node_output="nodes.csv", flow_output="flow.csv", emissions_output="emissions.csv", zip_output="network.zip",
+                       emissions=None, pollutant_output="pollutant_emissions.csv"):
         """
         Exports the network data as a zip file.
         :param segment_output:   segment output filename
@@ -357,12 +519,14 @@ class Network:
         :param flow_output:      flow data output filename
         :param emissions_output: emissions data output filename
         :param zip_output:       final zip filename
+        :param emissions:        emissions tensor from the emissions calculation, exported by pollutant and vehicle type
+        :param pollutant_output: pollutant emissions output filename
         """
         segment_file = open(CSV_DIR+segment_output, 'w')
         flow_file = open(CSV_DIR+flow_output, 'w')
         emissions_file = open(CSV_DIR+emissions_output, 'w')
 
-        segment_file.write('segment_key,start_node,end_node,street_name,road_type,no_lanes,speed_limit,oneway,width,two_wheeled_vehicles,passenger_cars,buses_coaches,lgvs,hgvs')
+        segment_file.write('segment_key,start_node,end_node,street_name,road_type,no_lanes,speed_limit,oneway,width,two_wheeled_vehicles,passenger_cars,buses_coaches,lgvs,hgvs,match_confidence')
         flow_header = ""
         emissions_header = ""
 
@@ -382,7 +546,7 @@ class Network:
 
             # All of a segment's attributes dictionary is printed to the final file
             # so it can be reconstructed later.
-            segment_file.write('\n{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10},{11},{12},{13}'.format(key, start_node, end_node,
+            segment_file.write('\n{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10},{11},{12},{13},{14}'.format(key, start_node, end_node,
                                                                                                         attributes['streetName'],
                                                                                                         attributes['roadType'],
                                                                                                         attributes['noLanes'],
@@ -393,7 +557,8 @@ class Network:
                                                                                                         attributes['vehicleProps'][1],
                                                                                                         attributes['vehicleProps'][2],
                                                                                                         attributes['vehicleProps'][3],
-                                                                                                        attributes['vehicleProps'][4]))
+                                                                                                        attributes['vehicleProps'][4],
+                                                                                                        attributes.get('matchConfidence', '')))
 
             if 'flowData' in attributes:
                 flow_str = "\n"
@@ -415,14 +580,37 @@ class Network:
                 node = self.nodes[key]
                 node_file.write('\n{0},{1},{2}'.format(key, node.get_coors()[0], node.get_coors()[1]))
 
+        output_files = [segment_output, node_output, flow_output, emissions_output]
+        if emissions != None:
+            self.export_pollutant_emissions(emissions, pollutant_output)
+            output_files.append(pollutant_output)
+
         with ZipFile(ZIP_DIR+zip_output, 'w') as zip_file:
             for folder_name, _, _ in os.walk(CSV_DIR):
-                for output_file in [segment_output, node_output, flow_output, emissions_output]:
+                for output_file in output_files:
                     file_path = os.path.join(folder_name, output_file)
                     zip_file.write(file_path, basename(file_path))
 
         return ZIP_DIR+zip_output
 
+    def export_pollutant_emissions(self, emissions, pollutant_output="pollutant_emissions.csv"):
+        """
+        Writes the emissions of every segment, hour and pollutant, with one
+        column for each vehicle type.
+        :param emissions:        emissions tensor from the emissions calculation
+        :param pollutant_output: output filename
+        """
+        with open(CSV_DIR+pollutant_output, 'w') as pollutant_file:
+            pollutant_file.write('segment_key,hour,pollutant,'+','.join(emissions.vehicle_types))
+
+            for key in self.segments.keys():
+                if key not in emissions: continue
+
+                # Hours are numbered as in the flow and emissions files.
+                for pollutant in emissions.pollutants:
+                    for hour, type_emissions in zip(range(6, 18), emissions.get_segment_emissions(key, pollutant).tolist()):
+                        pollutant_file.write('\n{0},{1},{2},'.format(key, hour, pollutant)+','.join(str(x) for x in type_emissions))
+
     def is_end_node(self, key):
         """
         Finds whether or not the node is an end node.
@@ -464,7 +652,21 @@ class Network:
     def get_av_vph(self):
         return self.av_vph
 
+    def __getstate__(self):
+        # K-D trees are not pickled, as they can be rebuilt.
+        state = self.__dict__.copy()
+        state.pop('spatial_indexes', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.spatial_indexes = {}
+
 class Node:
+    # Networks hold thousands of nodes, so slots are used
+    # rather than a __dict__ per node.
+    __slots__ = ('lat', 'lon', 'attached_segments')
+
     def __init__(self, lat, lon):
         self.lat = lat
         self.lon = lon
@@ -487,15 +689,57 @@ class Node:
     def get_coors(self):
         return [self.lat, self.lon]
 
+    def __getstate__(self):
+        return (None, {'lat': self.lat, 'lon': self.lon, 'attached_segments': self.attached_segments})
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled node. Nodes pickled before slots were used
+        store their fields in a dictionary, which is converted here.
+        :param state: pickled node state
+        """
+        if isinstance(state, tuple): state = state[1]
+        self.lat = state['lat']
+        self.lon = state['lon']
+        self.attached_segments = state.get('attached_segments', [])
+
     def __str__(self):
         return str(self.__class__) + ": coors=" + str(self.get_coors())
 
+# Known segment attributes are stored in their own slots, rather than in
+# a dictionary per segment with repeated string keys:
+#   streetName, roadType, speedLimit, oneway, width, popup, tooltip: str
+#   noLanes: int, length: float (km), centre: [lat, lon]
+#   flowData: [[hour, avg. speed, median speed, sample size]]
+#   vehicleProps: [5 vehicle type proportions], emissions: [float per hour]
+#   countPointDistance: distance to the nearest count point (m)
+#   matchConfidence: confidence of the segment's TOMTOM match, between 0 and 1
+# Any other attributes are kept in a separate dictionary.
+attribute_fields = {'streetName':         'street_name',
+                    'roadType':           'road_type',
+                    'noLanes':            'no_lanes',
+                    'speedLimit':         'speed_limit',
+                    'oneway':             'oneway',
+                    'width':              'width',
+                    'popup':              'popup',
+                    'tooltip':            'tooltip',
+                    'length':             'length',
+                    'centre':             'centre',
+                    'flowData':           'flow_data',
+                    'vehicleProps':       'vehicle_props',
+                    'emissions':          'emissions',
+                    'countPointDistance': 'count_point_distance',
+                    'matchConfidence':    'match_confidence'}
+
 class Segment:
+    __slots__ = ('nodes', 'coors', 'closed', 'extra_attributes') + tuple(attribute_fields.values())
+
     def __init__(self, nodes, coors, attributes=None):
         self.nodes = nodes
         self.coors = coors
         self.closed = False
-        self.attributes = attributes
+        self.extra_attributes = None
+        if attributes != None: self.set_attributes(attributes)
 
     def join_segment(self, joining_segment, attributes):
         """
@@ -507,30 +751,47 @@ class Segment:
         new_nodes = self.nodes + joining_segment.get_nodes()[1:]
         new_coors = self.coors + joining_segment.get_coors()[1:]
 
+        # The joined segments share a node, so the new length is the
+        # sum of their lengths.
         new_segment = Segment(new_nodes, new_coors, attributes=attributes)
-        new_segment.calculate_length()
+        new_segment.calculate_length(self.get_length() + joining_segment.get_length())
 
         return new_segment
 
-    def calculate_length(self):
+    def view(self):
+        """
+        Creates a copy of the segment that shares its nodes and coordinates,
+        but has separate attributes. Nested attributes, such as the flow data
+        and vehicle proportions, are copied too, so changing them in place
+        does not change the original.
+        :return Segment: segment view
+        """
+        segment = Segment(self.nodes, self.coors, attributes=copy.deepcopy(dict(self.get_attributes())))
+        segment.closed = self.closed
+
+        return segment
+
+    def calculate_length(self, length=None):
         """
         Calculates the length of a segment and stores the result
         in its attribute dictionary.
+        :param length: known segment length (km), if it does not need calculating
         """
-        length = 0
-        for i in range(len(self.coors) - 1):
-            length += distance(self.coors[i], self.coors[i+1]).km
-        self.attributes['length'] = length
+        if length == None: length = path_length(self.coors)
+        self.length = length
 
-        long_av = 0
-        lat_av = 0
-        for coor in self.coors:
-            long_av += coor[0]
-            lat_av += coor[1]
-        
         # The coordinates of the segment's centre is also
         # calculated and stored.
-        self.attributes['centre'] = [long_av / len(self.coors), lat_av / len(self.coors)]
+        self.centre = np.mean(self.coors, axis=0).tolist()
+
+    def get_length(self):
+        """
+        Returns the segment's length, calculating it if it has not
+        been stored.
+        :return float: segment length (km)
+        """
+        if hasattr(self, 'length'): return self.length
+        return path_length(self.coors)
 
     def get_flow_measures(self, index):
         """
@@ -540,13 +801,29 @@ class Segment:
         return [i[index] for i in self.get_attributes()['flowData']]
 
     def set_flow_measure(self, val, time_index, val_index):
-        self.attributes['flowData'][time_index][val_index] = val
+        self.get_attributes()['flowData'][time_index][val_index] = val
 
     def set_attribute(self, key, data):
-        self.attributes[key] = data
+        if key in attribute_fields: setattr(self, attribute_fields[key], data)
+        else:
+            if self.extra_attributes == None: self.extra_attributes = {}
+            self.extra_attributes[key] = data
                 
     def set_attributes(self, attributes):
-        self.attributes = attributes
+        """
+        Replaces all of the segment's attributes.
+        :param attributes: dictionary of attributes
+        """
+        # The attributes may be this segment's own, so they are copied
+        # before its fields are cleared.
+        attributes = dict(attributes)
+
+        for field in attribute_fields.values():
+            if hasattr(self, field): delattr(self, field)
+        self.extra_attributes = None
+
+        for key, data in attributes.items():
+            self.set_attribute(key, data)
 
     def get_nodes(self):
         return self.nodes
@@ -555,10 +832,153 @@ class Segment:
         return self.coors
 
     def get_attributes(self):
-        return self.attributes
+        """
+        Returns a dictionary-like object for reading and changing the
+        segment's attributes, stored in the segment itself.
+        :return SegmentAttributes: segment attributes
+        """
+        return SegmentAttributes(self)
+
+    def __getstate__(self):
+        state = {field: getattr(self, field) for field in self.__slots__ if hasattr(self, field)}
+        return (None, state)
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled segment. Segments pickled before slots were
+        used store their fields in a dictionary, with an attributes
+        dictionary, which are converted to slots here.
+        :param state: pickled segment state
+        """
+        self.extra_attributes = None
+        if isinstance(state, tuple):
+            for field, value in state[1].items():
+                setattr(self, field, value)
+
+        else:
+            self.nodes = state['nodes']
+            self.coors = state['coors']
+            self.closed = state.get('closed', False)
+            if state.get('attributes') != None: self.set_attributes(state['attributes'])
 
     def __str__(self):
-        return str(self.__class__) + ": name='" + self.attributes['streetName']+"'"
+        return str(self.__class__) + ": name='" + self.get_attributes()['streetName']+"'"
+
+class SegmentAttributes(MutableMapping):
+    __slots__ = ('segment',)
+
+    def __init__(self, segment):
+        """
+        Dictionary interface to a segment's attributes, so code written for
+        attribute dictionaries works with the segment's typed fields.
+        :param segment: segment object
+        """
+        self.segment = segment
+
+    def __getitem__(self, key):
+        try:
+            if key in attribute_fields: return getattr(self.segment, attribute_fields[key])
+        except AttributeError: raise KeyError(key)
+
+        if self.segment.extra_attributes == None: raise KeyError(key)
+        return self.segment.extra_attributes[key]
+
+    def __setitem__(self, key, data):
+        self.segment.set_attribute(key, data)
+
+    def __delitem__(self, key):
+        try:
+            if key in attribute_fields: return delattr(self.segment, attribute_fields[key])
+        except AttributeError: raise KeyError(key)
+
+        if self.segment.extra_attributes == None: raise KeyError(key)
+        del self.segment.extra_attributes[key]
+
+    def __iter__(self):
+        for key, field in attribute_fields.items():
+            if hasattr(self.segment, field): yield key
+        if self.segment.extra_attributes != None:
+            yield from list(self.segment.extra_attributes)
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+def query_overpass(overpy_api, query, verbose=False):
+    """
+    Queries the Overpass API, waiting and retrying whenever the server is
+    overloaded or has received too many requests.
+    :param overpy_api: Overpass API object
+    :param query:      Overpass API query
+    :param verbose:    Print retries
+    :return Result:    query result
+    """
+    while True:
+        try:
+            return overpy_api.query(query)
+
+        except overpy.exception.OverpassTooManyRequests:
+            if verbose: print("         ↳ Too many requests, sleeping for 10s...")
+            sleep(10)
+
+        except overpy.exception.OverpassGatewayTimeout:
+            if verbose: print("         ↳ Server overloaded, sleeping for 20s...")
+            sleep(20)
+
+def merge_networks(networks):
+    """
+    Merges any number of networks into one new network. Where networks share
+    a segment or node, the first network's is kept, as when merging them one
+    at a time with merge_with_network.
+    :param networks: list of networks to merge
+    :return Network: merged network
+    """
+    merged = Network()
+    for network in networks:
+        for key, segment in network.get_network_segments().items():
+            merged.segments.setdefault(key, segment)
+        for key, node in network.get_network_nodes().items():
+            merged.nodes.setdefault(key, node)
+
+    return merged
+
+def load_network(path):
+    """
+    Loads a network from a network file. Networks created before network
+    files were introduced are loaded from their pickle, '<path>.p'.
+    :param path:     network file path
+    :return Network: loaded network
+    """
+    if is_network_file(path):
+        return Network.load(path)
+
+    with open(path+'.p', 'rb') as network_file:
+        return pickle.load(network_file)
+
+def network_exists(path):
+    """
+    Finds whether a network has been saved at the given path, either as
+    a network file or a pickle.
+    :param path:  network file path
+    :return bool: denotes whether the network exists
+    """
+    return is_network_file(path) or os.path.isfile(path+'.p')
+
+def migrate_pickle(path):
+    """
+    Rewrites a pickled network, '<path>.p', so its nodes and segments are
+    stored with slots. Older pickles still load without migrating, but
+    are converted every time they are loaded.
+    :param path: network file path, without the '.p' extension
+    """
+    with open(path+'.p', 'rb') as network_file:
+        network = pickle.load(network_file)
+
+    with open(path+'.p.tmp', 'wb') as network_file:
+        pickle.dump(network, network_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path+'.p.tmp', path+'.p')
 
 def format_tt_data(segment):
     """
@@ -1,19 +1,49 @@
-import sys, pickle, os.path
-import numpy as np
 from time import time
-from collections import Counter
-from sklearn.neighbors import KDTree
+from concurrent.futures import ThreadPoolExecutor
 
 from mdt_webapp.mdt.Emissions import build_vehicle_kdtree
-from mdt_webapp.mdt.Network import Network, Segment, Node, generate_progress_bar
+from mdt_webapp.mdt.MapMatcher import match_networks
+from mdt_webapp.mdt.MatchTable import MatchTable
+from mdt_webapp.mdt.OverpassCache import OverpassCache
+from mdt_webapp.mdt.Network import Network, Segment, Node, load_network, network_exists, merge_networks
 
 from mdt_project.settings import TXT_DIR, JSON_DIR, CSV_DIR, OBJ_DIR
 
 class Creator:
-    def __init__(self, osm_path='osm_network.p', tt_path='tt_network.p', mdt_path='mdt_network.p'):
+    def __init__(self, osm_path='osm_network', tt_path='tt_network', mdt_path='mdt_network', osm_workers=4, overpass_url=None,
+                 cache_path='overpass_cache', cache_ttl=30*24*60*60, cache_size=512*2**20, match_method='geometry',
+                 match_workers=1, match_table_path='match_table.json', vehicle_k=4, vehicle_radius=2000.0):
+        """
+        Creates a network creator.
+        :param osm_path:         OSM network file name
+        :param tt_path:          TOMTOM network file name
+        :param mdt_path:         MDT network file name
+        :param osm_workers:      maximum number of OSM queries run at once
+        :param overpass_url:     Overpass API url, if not the public API
+        :param cache_path:       Overpass response cache directory name, or None to disable caching
+        :param cache_ttl:        lifetime of cached responses in seconds, or None to keep them forever
+        :param cache_size:       maximum size of the response cache in bytes, or None for no limit
+        :param match_method:     'geometry' or 'votes', how OSM segments are matched to TOMTOM segments
+        :param match_workers:    number of processes used to match segments by geometry, 1 or None to match in this process
+        :param match_table_path: OSM to TOMTOM match table file name, or None to match every segment on each build
+        :param vehicle_k:        number of count points used to estimate each segment's vehicle proportions
+        :param vehicle_radius:   distance beyond which count points are not used (m)
+        """
         self.osm_file = OBJ_DIR+osm_path
         self.tt_file = OBJ_DIR+tt_path
         self.mdt_file = OBJ_DIR+mdt_path
+        self.osm_workers = osm_workers
+        self.overpass_url = overpass_url
+        self.match_method = match_method
+        self.match_workers = match_workers or 1
+        self.vehicle_k = vehicle_k
+        self.vehicle_radius = vehicle_radius
+
+        if match_table_path != None: self.match_table_file = OBJ_DIR+match_table_path
+        else: self.match_table_file = None
+
+        if cache_path != None: self.overpass_cache = OverpassCache(OBJ_DIR+cache_path, ttl=cache_ttl, max_size=cache_size)
+        else: self.overpass_cache = None
 
     def create_networks(self, osm=None, tt=None, mdt=False, verbose=False):
         """
@@ -27,32 +57,26 @@ class Creator:
         creating_osm = False
         if osm != None:
             creating_osm = True
-            networks = []
+            queries = []
 
             if verbose: print("Building network from queries:\n   {0}".format(osm))
 
-            # Queries are read from the osm array, and their resulting networks
-            # are stored in the networks array.
+            # Queries are read from the osm array.
             for i in range(len(osm)):
                 filename = TXT_DIR+osm[i]+".txt"
                 file = open(filename)
 
                 query = file.read().replace("\n", " ").replace("  ", "")
                 file.close()
-                    
-                start_time = time()
-                if verbose: print("Building OSM network {0} of {1}:".format(i + 1, len(osm)))
-                networks.append(Network(query=query, verbose=verbose))
-                end_time = time()
-                if verbose: print('\n   ... Built network in {0}s'.format(round(end_time-start_time, 2)))
-                    
-            # All networks in the networks array are then merged together.
-            if len(networks) > 1:
-                for i in range(len(networks[1:])):
-                    networks[0].merge_with_network(networks[i+1])
-
-            # The final OpenStreetMaps network is saved to an object file.
-            pickle.dump( networks[0], open( self.osm_file, "wb" ) )
+                queries.append(query)
+
+            start_time = time()
+            osm_network = self.build_osm_networks(queries, verbose)
+            end_time = time()
+            if verbose: print('\n   ... Built {0} network(s) in {1}s'.format(len(queries), round(end_time-start_time, 2)))
+
+            # The final OpenStreetMaps network is saved to a network file.
+            osm_network.save(self.osm_file)
             if verbose: print('OSM network saved to: {0}'.format(self.osm_file))
 
         if tt != None:
@@ -63,95 +87,55 @@ class Creator:
             end_time = time()
             if verbose: print('\n   ... Built network in {0}s'.format(round(end_time-start_time, 2)))
 
-            pickle.dump(tt_network, open( self.tt_file, "wb" ))
+            tt_network.save(self.tt_file)
             if verbose: print('TOMTOM network saved to: {0}'.format(self.tt_file))
 
         if mdt:
-            if os.path.isfile(self.osm_file) and os.path.isfile(self.tt_file):
+            if network_exists(self.osm_file) and network_exists(self.tt_file):
 
                 if verbose: print('Building MDT network:')
-                osm_network = pickle.load( open( self.osm_file, "rb" ) )
-                tt_network = pickle.load( open( self.tt_file, "rb" ) )
+                osm_network = load_network(self.osm_file)
+                tt_network = load_network(self.tt_file)
 
-                # A KD tree is build for the UKDT count points and nodes in
-                # the TOMTOM network.
-                tt_keys, tt_kdt = tt_network.build_KDTree()
+                # A KD tree is built for the UKDT count points, which is used to
+                # estimate the vehicle proportions of every OSM segment.
                 vehicle_kdtree, vehicle_data = build_vehicle_kdtree(CSV_DIR+'count_points.csv')
-                    
-                osm_segments = osm_network.get_network_segments()
-                tt_segments = tt_network.get_network_segments()
-
-                count = 1
-                no_segments = len(osm_segments)
-
-                # All segments in the OSM network are iterated through.
-                for key in osm_segments.keys():
-                    if verbose: generate_progress_bar(count, no_segments, "{0} of {1} ({2}%)".format(count, no_segments, round(count*100/no_segments, 1)), prefix='   ... Merging segments: ')
-                    segment = osm_segments[key]
-                    coors = segment.get_coors()
-                    street_name = segment.get_attributes()['streetName']
-
-                    # An closest_segments array is initialised.
-                    closest_segments = []
-                    for coor in coors:
-
-                        # For each coordinate in the OSM segment, the TOMTOM's KD tree is queried
-                        # for the closest 3 nodes.
-                        dist, ind = tt_kdt.query(np.array([[coor[0], coor[1]]]), k=3) 
-                        for index in ind[0]:
-
-                            # The segments attached to each of these 3 TOMTOM nodes are added to the
-                            # closest_segments array.
-                            attached = tt_network.get_network_nodes()[tt_keys[index]].get_attached()
-                            closest_segments += attached
-
-                    # All segments in the closest_segments array are ordered by how frequently they appear.
-                    closest = max(set(closest_segments), key=closest_segments.count)
-                    common_keys = list(dict.fromkeys([item for items, c in Counter(closest_segments).most_common() for item in [items] * c]))
-                    best_fit_found = False
-
-                    # These are then iterated through, starting with the most common.
-                    for tt_key in common_keys:
-                        try:
-                            seg_attributes = tt_segments[tt_key].get_attributes()
-
-                            # Segments are matched if they share the same street name and have non-zero flow data.
-                            if not any(0 in sl for sl in seg_attributes['flowData']):
-                                if seg_attributes['streetName'] == street_name:
-                                    segment.set_attribute('flowData', tt_segments[tt_key].get_attributes()['flowData'])
-                                    best_fit_found = True
-                                    break
-                        except KeyError:
-                            continue
-
-                    # If no match was found, the segment is given empty flow data.
-                    if not best_fit_found: segment.set_attribute('flowData', tt_segments[common_keys[0]].get_attributes()['flowData'])
-
-                    if sum(segment.get_flow_measures(3)) / len(segment.get_flow_measures(3)) != 0:
-
-                        # The coordinates of the centre of each segment is found.
-                        centre_index = float(len(coors))/2
-                        if centre_index % 2 != 0:
-                            centre = coors[int(centre_index - .5)]
-                        else:
-                            centre = coors[int(centre_index) - 1]
-
-                        # The centre is used to query the UKDT count points data to get the
-                        # vehicle proportions.
-                        dist, ind = vehicle_kdtree.query(np.array([[centre[0], centre[1]]]), k=1)
-                        vehicle_types_prop = vehicle_data[ind[0][0]]
-                        segment.set_attribute('vehicleProps', vehicle_types_prop)
-                    
-                    # If there are no observed vehicles, the segment is given 0 values as their
-                    # proportions.
-                    else: segment.set_attribute('vehicleProps', [0, 0, 0, 0, 0])
-                    count += 1
-                
-                # The final MDT network is then stored as an object file.
+                # Segments that are unchanged since the last build reuse their matches.
+                match_table = MatchTable(self.match_table_file) if self.match_table_file != None else None
+                match_networks(osm_network, tt_network, vehicle_kdtree, vehicle_data, method=self.match_method, workers=self.match_workers,
+                               match_table=match_table, vehicle_k=self.vehicle_k, vehicle_radius=self.vehicle_radius, verbose=verbose)
+
+                # The final MDT network is then stored as a network file.
                 if verbose: print('\n   ... Built network.')
-                pickle.dump( osm_network, open( self.mdt_file, "wb" ) )
+                osm_network.save(self.mdt_file)
                 if verbose: print('MDT network saved to: {0}'.format(self.mdt_file))
 
             else: print("Could not find '{0}' and/or '{1}'".format(self.osm_file, self.tt_file))
 
-        return creating_osm, tt, mdt
\ No newline at end of file
+        return creating_osm, tt, mdt
+
+    def build_osm_networks(self, queries, verbose=False):
+        """
+        Builds one network from several OSM queries. Building a network mostly
+        waits on the Overpass API, so the queries are run in a pool of
+        threads. Progress bars are only shown when the networks are built
+        one at a time.
+        :param queries:  Overpass API queries
+        :param verbose:  print network creation progress
+        :return Network: merged network
+        """
+        no_workers = max(1, min(self.osm_workers, len(queries)))
+        with ThreadPoolExecutor(max_workers=no_workers) as executor:
+            networks = list(executor.map(lambda query: self.build_osm_network(query, verbose and no_workers == 1), queries))
+
+        # All networks are then merged together at once.
+        return merge_networks(networks)
+
+    def build_osm_network(self, query, verbose=False):
+        """
+        Builds a network from one OSM query.
+        :param query:    Overpass API query
+        :param verbose:  print network creation progress
+        :return Network: resulting network
+        """
+        return Network(query=query, verbose=verbose, overpass_url=self.overpass_url, overpass_cache=self.overpass_cache)
\ No newline at end of file
@@ -0,0 +1,377 @@
+import os, copy, json, time, shutil, pickle, sklearn
+import numpy as np
+
+# Network files are directories of raw .npy arrays, described by a JSON
+# manifest. Raw arrays (unlike .npz archives) can be opened with
+# mmap_mode='r', so every worker process shares the same pages of the
+# OS page cache rather than holding its own copy of the network.
+FILE_FORMAT = 'mdt-network'
+FILE_VERSION = 1
+MANIFEST = 'manifest.json'
+EXTRAS = 'extras.json'
+
+# Each version of a network file is written to its own subdirectory, and
+# the CURRENT file names the version in use. It is replaced atomically, so
+# readers always find either the previous or the new version. The previous
+# version is kept for readers that opened it before it was replaced. Network
+# files written before versions were introduced have no CURRENT file, and
+# their files are in the network directory itself.
+CURRENT = 'CURRENT'
+KEEP_VERSIONS = 2
+
+# Spatial indexes are stored as pickled K-D trees, '<name>.kdtree'. They
+# are only read by the scikit-learn version that wrote them, and are
+# otherwise rebuilt.
+INDEX_EXTENSION = '.kdtree'
+
+# Attributes with a known type are stored as columns, all other
+# attributes are stored in the extras file. Columns that no segment
+# has a value for are left out of the file.
+string_attributes = {'streetName': 'street_name',
+                     'roadType':   'road_type',
+                     'speedLimit': 'speed_limit',
+                     'oneway':     'oneway',
+                     'width':      'width',
+                     'popup':      'popup',
+                     'tooltip':    'tooltip'}
+column_attributes = ['noLanes', 'length', 'centre', 'flowData', 'vehicleProps', 'emissions', 'countPointDistance', 'matchConfidence']
+optional_columns = ['no_lanes', 'length', 'centre', 'flow', 'vehicle_props', 'emissions', 'count_point_distance', 'match_confidence'] + list(string_attributes.values())
+
+# Flow data is recorded to 2 decimal places, so it is stored in single
+# precision and rounded when read.
+FLOW_DECIMALS = 2
+
+def network_to_arrays(network):
+    """
+    Converts a network into the contiguous arrays stored in a network file.
+    :param network: network object
+    :return dict:   arrays, keyed by name
+    :return list:   hours covered by the flow data
+    :return dict:   extra attributes, keyed by segment index
+    """
+    nodes = network.get_network_nodes()
+    segments = network.get_network_segments()
+
+    node_ids = np.fromiter(nodes.keys(), dtype=np.int64, count=len(nodes))
+    node_index = {key: i for i, key in enumerate(nodes.keys())}
+
+    # All hours that appear in any segment's flow data are given a column.
+    hours = sorted({time_slot[0] for segment in segments.values() for time_slot in segment.get_attributes().get('flowData', [])})
+    hour_index = {hour: i for i, hour in enumerate(hours)}
+
+    no_segments = len(segments)
+    arrays = {'node_ids':             node_ids,
+              'node_coors':           np.array([node.get_coors() for node in nodes.values()], dtype=np.float64).reshape(-1, 2),
+              'segment_ids':          np.fromiter(segments.keys(), dtype=np.int64, count=no_segments),
+              'segment_closed':       np.array([segment.closed for segment in segments.values()], dtype=bool),
+              'no_lanes':             np.full(no_segments, -1, dtype=np.int64),
+              'length':               np.full(no_segments, np.nan),
+              'centre':               np.full((no_segments, 2), np.nan),
+              'has_flow':             np.zeros(no_segments, dtype=bool),
+              'flow':                 np.zeros((no_segments, len(hours), 3), dtype=np.float32),
+              'vehicle_props':        np.full((no_segments, 5), np.nan),
+              'emissions':            np.full((no_segments, len(hours)), np.nan),
+              'count_point_distance': np.full(no_segments, np.nan),
+              'match_confidence':     np.full(no_segments, np.nan)}
+
+    # Node to segment adjacency is stored with segment IDs, as nodes may
+    # still reference segments that have been replaced.
+    arrays['node_segment_offsets'], arrays['node_segment_ids'] = build_offsets([node.get_attached() for node in nodes.values()])
+    arrays['end_node_flags'] = np.asarray(network.get_end_node_flags(), dtype=bool)
+    arrays['segment_node_offsets'], arrays['segment_nodes'] = build_offsets([[node_index[key] for key in segment.get_nodes()] for segment in segments.values()])
+
+    strings = StringTableBuilder()
+    string_columns = {column: np.full(no_segments, -1, dtype=np.int32) for column in string_attributes.values()}
+    extras = {}
+
+    for i, segment in enumerate(segments.values()):
+        attributes = segment.get_attributes()
+
+        for key, value in attributes.items():
+            if key in string_attributes:
+                string_columns[string_attributes[key]][i] = strings.add(value)
+            elif key not in column_attributes:
+                extras.setdefault(str(i), {})[key] = value
+
+        if 'noLanes' in attributes: arrays['no_lanes'][i] = attributes['noLanes']
+        if 'length' in attributes: arrays['length'][i] = attributes['length']
+        if 'centre' in attributes: arrays['centre'][i] = attributes['centre']
+        if 'vehicleProps' in attributes: arrays['vehicle_props'][i] = attributes['vehicleProps']
+        if 'countPointDistance' in attributes: arrays['count_point_distance'][i] = attributes['countPointDistance']
+        if 'matchConfidence' in attributes: arrays['match_confidence'][i] = attributes['matchConfidence']
+
+        # Time slots are placed in the column for their hour, so segments
+        # with missing time slots keep their remaining slots aligned.
+        if 'flowData' in attributes:
+            arrays['has_flow'][i] = True
+            for time_slot in attributes['flowData']:
+                arrays['flow'][i, hour_index[time_slot[0]]] = time_slot[1:4]
+
+        if 'emissions' in attributes and len(attributes['emissions']) == len(hours):
+            arrays['emissions'][i] = attributes['emissions']
+
+    arrays.update(string_columns)
+    arrays['strings_offsets'], arrays['strings_data'] = strings.to_arrays()
+
+    if not arrays['has_flow'].any(): arrays.pop('has_flow')
+    for column in optional_columns:
+        if column == 'flow': missing = 'has_flow' not in arrays
+        elif arrays[column].dtype.kind == 'f': missing = np.isnan(arrays[column]).all()
+        else: missing = (arrays[column] < 0).all()
+        if missing: arrays.pop(column)
+
+    return arrays, hours, extras
+
+def write_network_file(path, arrays, hours, extras=None, indexes=None):
+    """
+    Writes network arrays to a new version of a network file. The version is
+    written in full before the CURRENT file is replaced to point to it, so
+    readers never see a partially written or missing network.
+    :param path:    network file (directory) path
+    :param arrays:  arrays keyed by name
+    :param hours:   hours covered by the flow data
+    :param extras:  extra attributes, keyed by segment index
+    :param indexes: K-D trees of the network's nodes, keyed by name
+    """
+    os.makedirs(path, exist_ok=True)
+
+    # Version names sort in the order they were written.
+    version = 'v{0:020d}'.format(time.time_ns())
+    version_path = os.path.join(path, version)
+    temp_path = version_path+'.tmp'
+    os.makedirs(temp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_path, name+'.npy'), np.ascontiguousarray(array))
+
+    with open(os.path.join(temp_path, EXTRAS), 'w') as extras_file:
+        json.dump(extras or {}, extras_file)
+
+    indexes = indexes or {}
+    for name, kdtree in indexes.items():
+        with open(os.path.join(temp_path, name+INDEX_EXTENSION), 'wb') as index_file:
+            pickle.dump(kdtree, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # The manifest is written last, as readers use it to detect changes.
+    manifest = {'format': FILE_FORMAT,
+                'version': FILE_VERSION,
+                'hours': [int(hour) for hour in hours],
+                'arrays': sorted(arrays.keys()),
+                'indexes': sorted(indexes.keys()),
+                'index_version': sklearn.__version__}
+
+    with open(os.path.join(temp_path, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    os.rename(temp_path, version_path)
+
+    current_temp = os.path.join(path, CURRENT+'.tmp')
+    with open(current_temp, 'w') as current_file:
+        current_file.write(version)
+    os.replace(current_temp, os.path.join(path, CURRENT))
+
+    # Older versions, and the files of an unversioned network file, are
+    # removed. Open memory maps of them stay valid after their files are
+    # removed.
+    versions = sorted(entry.name for entry in os.scandir(path) if entry.is_dir() and entry.name.startswith('v') and not entry.name.endswith('.tmp'))
+    for old_version in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(path, old_version), ignore_errors=True)
+
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name != CURRENT:
+            os.remove(entry.path)
+
+def get_version_path(path):
+    """
+    Returns the directory holding the current version of a network file.
+    :param path: network file (directory) path
+    :return str: current version's directory path
+    """
+    try:
+        with open(os.path.join(path, CURRENT)) as current_file:
+            return os.path.join(path, current_file.read().strip())
+    except FileNotFoundError:
+        return path
+
+def read_network_file(path, mmap_mode='r'):
+    """
+    Opens the arrays stored in a network file.
+    :param path:      network file (directory) path
+    :param mmap_mode: numpy memory map mode, or None to read into memory
+    :return dict:     arrays, keyed by name
+    :return list:     hours covered by the flow data
+    :return dict:     extra attributes, keyed by segment index
+    """
+    path = get_version_path(path)
+    with open(os.path.join(path, MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest.get('format') != FILE_FORMAT or manifest.get('version') != FILE_VERSION:
+        raise ValueError("'{0}' is not a version {1} network file.".format(path, FILE_VERSION))
+
+    arrays = {}
+    for name in manifest['arrays']:
+        arrays[name] = np.load(os.path.join(path, name+'.npy'), mmap_mode=mmap_mode)
+
+    with open(os.path.join(path, EXTRAS)) as extras_file:
+        extras = json.load(extras_file)
+
+    return arrays, manifest['hours'], extras
+
+def read_spatial_index(path, name):
+    """
+    Reads a K-D tree stored in a network file.
+    :param path:    network file (directory) path
+    :param name:    index name
+    :return KDTree: stored K-D tree, or None if it was not stored, was
+                    written by another version of scikit-learn, or its
+                    version of the file has since been removed
+    """
+    path = get_version_path(path)
+    try:
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        if name not in manifest.get('indexes', []) or manifest.get('index_version') != sklearn.__version__:
+            return None
+
+        with open(os.path.join(path, name+INDEX_EXTENSION), 'rb') as index_file:
+            return pickle.load(index_file)
+    except FileNotFoundError:
+        return None
+
+class SegmentColumns:
+    def __init__(self, arrays, hours, extras):
+        """
+        Rebuilds segment attribute dictionaries from network file arrays.
+        :param arrays: arrays keyed by name
+        :param hours:  hours covered by the flow data
+        :param extras: extra attributes, keyed by segment index
+        """
+        self.arrays = arrays
+        self.hours = hours
+        self.extras = extras
+        self.strings = decode_strings(arrays['strings_offsets'], arrays['strings_data'])
+
+    def get_attributes(self, index):
+        """
+        Creates the attributes dictionary for one segment. Every value is
+        built from the arrays, or copied from the extras, so nothing in the
+        dictionary is shared with the network.
+        :param index: segment index
+        :return dict: segment attributes
+        """
+        attributes = {}
+        for key in list(string_attributes) + column_attributes + list(self.extras.get(str(index), {})):
+            try: attributes[key] = self.get_attribute(index, key)
+            except KeyError: pass
+
+        return attributes
+
+    def get_attribute(self, index, key):
+        """
+        Creates one attribute of a segment, without creating the others.
+        :param index: segment index
+        :param key:   attribute name
+        :return:      attribute value
+        """
+        arrays = self.arrays
+
+        if key in string_attributes:
+            column = string_attributes[key]
+            if column in arrays and arrays[column][index] >= 0: return self.strings[arrays[column][index]]
+
+        elif key == 'noLanes':
+            if 'no_lanes' in arrays and arrays['no_lanes'][index] >= 0: return int(arrays['no_lanes'][index])
+        elif key == 'length':
+            if 'length' in arrays and not np.isnan(arrays['length'][index]): return float(arrays['length'][index])
+        elif key == 'centre':
+            if 'centre' in arrays and not np.isnan(arrays['centre'][index][0]): return arrays['centre'][index].tolist()
+        elif key == 'flowData':
+            if 'has_flow' in arrays and arrays['has_flow'][index]:
+                flow = np.round(arrays['flow'][index].astype(np.float64), FLOW_DECIMALS).tolist()
+                return [[hour] + time_slot for hour, time_slot in zip(self.hours, flow)]
+        elif key == 'vehicleProps':
+            if 'vehicle_props' in arrays and not np.isnan(arrays['vehicle_props'][index][0]): return arrays['vehicle_props'][index].tolist()
+        elif key == 'emissions':
+            if 'emissions' in arrays and not np.isnan(arrays['emissions'][index]).all(): return arrays['emissions'][index].tolist()
+        elif key == 'countPointDistance':
+            if 'count_point_distance' in arrays and not np.isnan(arrays['count_point_distance'][index]): return float(arrays['count_point_distance'][index])
+        elif key == 'matchConfidence':
+            if 'match_confidence' in arrays and not np.isnan(arrays['match_confidence'][index]): return float(arrays['match_confidence'][index])
+
+        else:
+            extras = self.extras.get(str(index), {})
+            if key in extras: return copy.deepcopy(extras[key])
+
+        raise KeyError(key)
+
+def is_network_file(path):
+    """
+    Finds whether a path is a network file, rather than a pickled network.
+    :param path:  file path
+    :return bool: denotes whether the path is a network file
+    """
+    return os.path.isfile(os.path.join(get_version_path(path), MANIFEST))
+
+def build_offsets(rows):
+    """
+    Flattens a list of lists into compressed sparse row arrays.
+    :param rows:      list of integer lists
+    :return ndarray:  row offsets, where row i is values[offsets[i]:offsets[i+1]]
+    :return ndarray:  concatenated row values
+    """
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    values = np.fromiter((value for row in rows for value in row), dtype=np.int64, count=offsets[-1])
+
+    # Offsets and values that fit are stored in 32 bits.
+    if offsets[-1] < 2**31: offsets = offsets.astype(np.int32)
+    if len(values) == 0 or (values.min() >= -2**31 and values.max() < 2**31): values = values.astype(np.int32)
+
+    return offsets, values
+
+def decode_strings(offsets, data):
+    """
+    Decodes a string table stored as UTF-8 bytes and offsets.
+    :param offsets: byte offsets of each string
+    :param data:    UTF-8 encoded string data
+    :return [str]:  decoded strings
+    """
+    data = bytes(data)
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+class StringTableBuilder:
+    def __init__(self):
+        """
+        Builds a table of unique strings, so repeated values such as
+        road types are only stored once.
+        """
+        self.strings = []
+        self.codes = {}
+
+    def add(self, string):
+        """
+        Adds a string to the table.
+        :param string: string to add
+        :return int:   index of the string in the table
+        """
+        string = str(string)
+        if string not in self.codes:
+            self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return self.codes[string]
+
+    def to_arrays(self):
+        """
+        Encodes the table as UTF-8 bytes and offsets.
+        :return ndarray: byte offsets of each string
+        :return ndarray: UTF-8 encoded string data
+        """
+        encoded = [string.encode('utf-8') for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        return offsets, data
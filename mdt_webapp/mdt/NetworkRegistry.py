@@ -0,0 +1,73 @@
+import os, threading
+
+from mdt_webapp.mdt.Network import load_network
+from mdt_webapp.mdt.ArrayNetwork import ArrayNetwork
+from mdt_webapp.mdt.Scenario import Scenario
+from mdt_webapp.mdt.NetworkFile import is_network_file, get_version_path, MANIFEST
+
+registries = {}
+registries_lock = threading.Lock()
+
+class NetworkRegistry:
+    def __init__(self, filename):
+        """
+        Keeps one loaded copy of a network file per worker process,
+        reloading it whenever the file is rewritten. If no network file
+        exists, a pickled network at the same path with a '.p' extension
+        is used instead.
+        :param filename: network file path
+        """
+        self.filename = filename
+        self.network = None
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def get_network(self):
+        """
+        Returns a new scenario of the cached network. Scenarios share the
+        network, but closures, emissions and other changes made in them
+        are not seen by other requests.
+        :return Scenario: per-request scenario
+        """
+        return Scenario(self.get_base_network())
+
+    def get_base_network(self):
+        """
+        Returns the cached network, loading it from the network file if it
+        has not been loaded yet or if the file has changed on disk.
+        :return ArrayNetwork: shared network
+        """
+        signature = get_file_signature(self.filename)
+
+        with self.lock:
+            if self.network == None or signature != self.signature:
+                if is_network_file(self.filename): self.network = ArrayNetwork.load(self.filename)
+                else: self.network = ArrayNetwork.from_network(load_network(self.filename))
+                self.signature = signature
+
+            return self.network
+
+def get_registry(filename):
+    """
+    Returns the process-wide registry for a network object file,
+    creating it on first use.
+    :param filename:         network object file path
+    :return NetworkRegistry: registry for the file
+    """
+    with registries_lock:
+        if filename not in registries:
+            registries[filename] = NetworkRegistry(filename)
+        return registries[filename]
+
+def get_file_signature(filename):
+    """
+    Returns a value that changes whenever a network file is rewritten.
+    Network files are directories, so the manifest of their current
+    version is checked.
+    :param filename: network file path
+    :return tuple:   path, modification time and size of the file
+    """
+    if is_network_file(filename): path = os.path.join(get_version_path(filename), MANIFEST)
+    else: path = filename+'.p'
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,133 @@
+import os, hashlib, tempfile, overpy
+from time import time
+
+def normalise_query(query):
+    """
+    Normalises an Overpass query so that queries that only differ in
+    their whitespace are treated as the same query.
+    :param query: Overpass query, as a string or bytes
+    :return str:  normalised query
+    """
+    if isinstance(query, bytes): query = query.decode('utf-8')
+    return ' '.join(query.split())
+
+def get_query_key(query, url=None):
+    """
+    Creates a key for an Overpass query, used to name its stored response.
+    Servers can hold different data, so the same query sent to different
+    servers has different keys.
+    :param query: Overpass query
+    :param url:   Overpass API url the query is sent to
+    :return str:  SHA-256 hash of the url and normalised query
+    """
+    key = normalise_query(query)
+    if url != None: key = url+'\n'+key
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class OverpassCache:
+    def __init__(self, cache_dir, ttl=None, max_size=None):
+        """
+        On-disk cache of Overpass API responses, stored as
+        '<cache_dir>/<query key>.json', keyed by query and server. Entries older than the TTL are
+        ignored and removed, and the least recently used entries are removed
+        once the cache is larger than its maximum size.
+        :param cache_dir: cache directory
+        :param ttl:       entry lifetime in seconds, or None to keep entries forever
+        :param max_size:  maximum total size in bytes, or None for no limit
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_filename(self, query, url=None):
+        return os.path.join(self.cache_dir, get_query_key(query, url)+'.json')
+
+    def get(self, query, url=None):
+        """
+        Returns the cached response to a query.
+        :param query:  Overpass query
+        :param url:    Overpass API url the query is sent to
+        :return bytes: JSON response, or None if it is not cached or has expired
+        """
+        filename = self.get_filename(query, url)
+
+        try:
+            # Entries expire based on when they were written, their
+            # modification time.
+            if self.ttl != None and time() - os.stat(filename).st_mtime > self.ttl:
+                os.remove(filename)
+                return None
+
+            with open(filename, 'rb') as response_file:
+                response = response_file.read()
+
+        except FileNotFoundError: return None
+
+        # The access time is used to find the least recently used entries.
+        try: os.utime(filename, (time(), os.stat(filename).st_mtime))
+        except FileNotFoundError: pass
+
+        return response
+
+    def put(self, query, response, url=None):
+        """
+        Stores a query's response, then removes entries until the cache
+        is within its maximum size.
+        :param query:    Overpass query
+        :param response: JSON response
+        :param url:      Overpass API url the query was sent to
+        """
+        file, temp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(file, 'wb') as response_file:
+            response_file.write(response)
+        os.replace(temp_filename, self.get_filename(query, url))
+
+        if self.max_size != None: self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is within
+        its maximum size.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                try: stat = entry.stat()
+                except FileNotFoundError: continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+
+        total_size = sum(entry[1] for entry in entries)
+        for atime, size, path in sorted(entries):
+            if total_size <= self.max_size: break
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            total_size -= size
+
+class CachedOverpass(overpy.Overpass):
+    def __init__(self, cache, **kwargs):
+        """
+        Overpass API that reads JSON responses from a cache, and only
+        queries the API for responses that are not cached.
+        :param cache:  OverpassCache object
+        :param kwargs: arguments for overpy.Overpass
+        """
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.pending_query = None
+
+    def query(self, query):
+        response = self.cache.get(query, self.url)
+        if response != None: return super().parse_json(response)
+
+        # The raw response is only available to parse_json, so the
+        # query is kept until the response has been parsed.
+        self.pending_query = query
+        try: return super().query(query)
+        finally: self.pending_query = None
+
+    def parse_json(self, data, encoding='utf-8'):
+        result = super().parse_json(data, encoding=encoding)
+        if self.pending_query != None: self.cache.put(self.pending_query, data, self.url)
+        return result
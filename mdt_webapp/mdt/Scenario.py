@@ -0,0 +1,234 @@
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+
+from mdt_webapp.mdt.Network import Network
+from mdt_webapp.mdt.ArrayNetwork import SegmentView
+
+class Scenario(Network):
+    def __init__(self, base):
+        """
+        Creates a scenario on top of an array network. Road closures, modified
+        vehicle proportions and calculated emissions are stored in the
+        scenario's own arrays, keyed by segment index, and everything else is
+        read from the base network, which is never changed. Any number of
+        scenarios can share the same base network.
+        :param base: array network
+        """
+        self.base = base
+        self.nodes = base.nodes
+        self.hours = base.hours
+
+        no_segments = len(base.segment_keys)
+        self.closed = base.closed.copy()
+        self.vehicle_props = np.zeros((no_segments, 5))
+        self.has_vehicle_props = np.zeros(no_segments, dtype=bool)
+        self.emissions = np.zeros((no_segments, len(base.hours)))
+        self.has_emissions = np.zeros(no_segments, dtype=bool)
+
+        # Any other changed attributes, keyed by segment index.
+        self.attributes = {}
+
+        self.segments = ScenarioSegments(self)
+
+    def view(self):
+        """
+        Creates a copy of the scenario, sharing the same base network.
+        :return Scenario: scenario copy
+        """
+        scenario = Scenario(self.base)
+        scenario.closed = self.closed.copy()
+        scenario.vehicle_props = self.vehicle_props.copy()
+        scenario.has_vehicle_props = self.has_vehicle_props.copy()
+        scenario.emissions = self.emissions.copy()
+        scenario.has_emissions = self.has_emissions.copy()
+        scenario.attributes = {index: dict(attributes) for index, attributes in self.attributes.items()}
+
+        return scenario
+
+    def build_KDTree(self, end_nodes=False):
+        return self.base.build_KDTree(end_nodes)
+
+    def get_end_node_flags(self):
+        return self.base.get_end_node_flags()
+
+    def get_base_attributes(self, index):
+        """
+        Returns a copy of a segment's attributes in the base network.
+        :param index: segment index
+        :return dict: base segment attributes
+        """
+        return self.base.columns.get_attributes(index)
+
+    def get_base_attribute(self, index, key):
+        """
+        Returns a copy of one of a segment's attributes in the base network.
+        :param index: segment index
+        :param key:   attribute name
+        :return:      base attribute value
+        """
+        return self.base.columns.get_attribute(index, key)
+
+    def get_vehicle_prop_array(self):
+        """
+        Returns the vehicle type proportions of every segment, with any
+        changes made in the scenario.
+        :return ndarray: proportions, with shape (no. segments, 5) and NaN where they are unknown
+        """
+        if 'vehicle_props' in self.base.arrays: vehicle_props = np.array(self.base.arrays['vehicle_props'], dtype=np.float64)
+        else: vehicle_props = np.full(self.vehicle_props.shape, np.nan)
+
+        vehicle_props[self.has_vehicle_props] = self.vehicle_props[self.has_vehicle_props]
+        return vehicle_props
+
+    def set_vehicle_prop_array(self, indices, vehicle_props):
+        """
+        Sets the vehicle type proportions of several segments at once.
+        :param indices:       segment indices
+        :param vehicle_props: proportions, with shape (no. indices, 5)
+        """
+        self.vehicle_props[indices] = vehicle_props
+        self.has_vehicle_props[indices] = True
+
+    def set_emissions_array(self, indices, emissions):
+        """
+        Sets the hourly emissions of several segments at once.
+        :param indices:   segment indices
+        :param emissions: emissions, with shape (no. indices, no. hours)
+        """
+        self.emissions[indices] = emissions
+        self.has_emissions[indices] = True
+
+    def has_base_flow(self):
+        """
+        Finds whether every segment's flow data and length are those of the
+        base network.
+        :return bool: denotes whether none have been changed in the scenario
+        """
+        return not any('flowData' in attributes or 'length' in attributes for attributes in self.attributes.values())
+
+    def add_elements(self, *args, **kwargs):
+        raise TypeError("Scenario networks are read-only.")
+
+    def merge_with_network(self, *args, **kwargs):
+        raise TypeError("Scenario networks are read-only.")
+
+    def simplify(self):
+        raise TypeError("Scenario networks are read-only.")
+
+class ScenarioSegments(Mapping):
+    def __init__(self, scenario):
+        """
+        Dictionary-like access to a scenario's segments by key.
+        :param scenario: scenario
+        """
+        self.scenario = scenario
+        self.views = {}
+
+    def __getitem__(self, key):
+        if key not in self.views:
+            self.views[key] = ScenarioSegment(self.scenario, self.scenario.base.segment_index[key])
+        return self.views[key]
+
+    def __iter__(self):
+        return iter(self.scenario.base.segment_index)
+
+    def __len__(self):
+        return len(self.scenario.base.segment_index)
+
+    def __contains__(self, key):
+        return key in self.scenario.base.segment_index
+
+class ScenarioSegment(SegmentView):
+    def __init__(self, scenario, index):
+        """
+        Provides the Segment API for one segment of a scenario. Changes are
+        written to the scenario, rather than the base network.
+        :param scenario: scenario
+        :param index:    segment index
+        """
+        super().__init__(scenario.base, index)
+        self.scenario = scenario
+
+    @property
+    def closed(self):
+        return bool(self.scenario.closed[self.index])
+
+    @closed.setter
+    def closed(self, closed):
+        self.scenario.closed[self.index] = closed
+
+    def get_flow_measures(self, index):
+        changed = self.scenario.attributes.get(self.index)
+        if changed != None and 'flowData' in changed: return [i[index] for i in changed['flowData']]
+        return super().get_flow_measures(index)
+
+    def set_flow_measure(self, val, time_index, val_index):
+        # The base flow data is copied before it is changed.
+        flow_data = [list(time_slot) for time_slot in self.get_attributes()['flowData']]
+        flow_data[time_index][val_index] = val
+        self.set_attribute('flowData', flow_data)
+
+    def set_attribute(self, key, data):
+        scenario = self.scenario
+
+        if key == 'vehicleProps' and len(data) == scenario.vehicle_props.shape[1]:
+            scenario.vehicle_props[self.index] = data
+            scenario.has_vehicle_props[self.index] = True
+        elif key == 'emissions' and len(data) == scenario.emissions.shape[1]:
+            scenario.emissions[self.index] = data
+            scenario.has_emissions[self.index] = True
+        else:
+            scenario.attributes.setdefault(self.index, {})[key] = data
+
+    def set_attributes(self, attributes):
+        raise TypeError("Scenario segment attributes can only be changed individually.")
+
+    def get_attributes(self):
+        """
+        Returns the segment's attributes, with any changes made in the
+        scenario in place of the base network's values.
+        :return ScenarioAttributes: segment attributes
+        """
+        return ScenarioAttributes(self)
+
+class ScenarioAttributes(MutableMapping):
+    __slots__ = ('segment', 'scenario', 'index')
+
+    def __init__(self, segment):
+        """
+        Dictionary interface to a segment's attributes in a scenario.
+        :param segment: scenario segment
+        """
+        self.segment = segment
+        self.scenario = segment.scenario
+        self.index = segment.index
+
+    def __getitem__(self, key):
+        scenario = self.scenario
+        changed = scenario.attributes.get(self.index)
+
+        if changed != None and key in changed: return changed[key]
+        if key == 'vehicleProps' and scenario.has_vehicle_props[self.index]: return scenario.vehicle_props[self.index].tolist()
+        if key == 'emissions' and scenario.has_emissions[self.index]: return scenario.emissions[self.index].tolist()
+
+        return scenario.get_base_attribute(self.index, key)
+
+    def __setitem__(self, key, data):
+        self.segment.set_attribute(key, data)
+
+    def __delitem__(self, key):
+        raise TypeError("Scenario segment attributes cannot be removed.")
+
+    def __iter__(self):
+        keys = list(self.scenario.get_base_attributes(self.index))
+        if self.scenario.has_vehicle_props[self.index]: keys.append('vehicleProps')
+        if self.scenario.has_emissions[self.index]: keys.append('emissions')
+        keys += list(self.scenario.attributes.get(self.index, {}))
+
+        return iter(dict.fromkeys(keys))
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
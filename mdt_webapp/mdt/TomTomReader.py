@@ -0,0 +1,137 @@
+import os, json, codecs
+
+class TomTomReader:
+    def __init__(self, filename, chunk_size=2**20, path=('network', 'segmentResults')):
+        """
+        Reads the segment results from a TOMTOM JSON export one at a time,
+        without loading the whole file. Only the current segment and one
+        chunk of the file are held in memory.
+        :param filename:   JSON file path
+        :param chunk_size: number of bytes read from the file at a time
+        :param path:       keys of the objects containing the segment array
+        """
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.path = list(path)
+
+        self.file_size = os.path.getsize(filename)
+        self.bytes_read = 0
+
+        self.decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        """
+        Yields each segment result in the file, in order.
+        :return dict: TOMTOM segment
+        """
+        with open(self.filename, 'rb') as json_file:
+            self.file = json_file
+            self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+            self.text = ''
+            self.pos = 0
+            self.eof = False
+            self.bytes_read = 0
+
+            self.find_array()
+            yield from self.read_array()
+
+    def fill(self):
+        """
+        Reads the next chunk of the file into the buffer. Text that has
+        already been parsed is discarded first.
+        :return bool: denotes whether any more data was read
+        """
+        if self.eof: return False
+
+        chunk = self.file.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if len(chunk) == 0: self.eof = True
+
+        self.text = self.text[self.pos:] + self.text_decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+
+        return not self.eof
+
+    def next_char(self):
+        """
+        Returns the character at the current position, reading more of the
+        file if needed.
+        :return str: next character, or None at the end of the file
+        """
+        while self.pos >= len(self.text):
+            if not self.fill(): return None
+        return self.text[self.pos]
+
+    def find_array(self):
+        """
+        Scans the file until the start of the segment array, tracking the
+        key of each enclosing object. Values before the array are skipped
+        without being decoded.
+        """
+        # Each open object stores its current key, arrays store None.
+        keys = []
+        expecting_key = False
+
+        while True:
+            char = self.next_char()
+            if char == None:
+                raise ValueError("'{0}' has no '{1}' array.".format(self.filename, '.'.join(self.path)))
+
+            if char == '"':
+                string, end = self.read_string()
+                if expecting_key:
+                    keys[-1] = string
+                    expecting_key = False
+                self.pos = end
+                continue
+
+            if char == '[' and keys == self.path:
+                self.pos += 1
+                return
+
+            if char == '{':
+                keys.append('')
+                expecting_key = True
+            elif char == '[':
+                keys.append(None)
+            elif char in '}]':
+                keys.pop()
+            elif char == ',':
+                expecting_key = len(keys) > 0 and keys[-1] != None
+
+            self.pos += 1
+
+    def read_string(self):
+        """
+        Decodes the JSON string starting at the current position.
+        :return str: decoded string
+        :return int: position after the string
+        """
+        while True:
+            try: return json.decoder.scanstring(self.text, self.pos + 1)
+            except json.JSONDecodeError:
+                if not self.fill(): raise
+
+    def read_array(self):
+        """
+        Decodes each value of the segment array, reading more of the
+        file whenever a value is incomplete.
+        :return dict: TOMTOM segment
+        """
+        while True:
+            char = self.next_char()
+            while char != None and (char.isspace() or char == ','):
+                self.pos += 1
+                char = self.next_char()
+
+            if char == None:
+                raise ValueError("'{0}' ended before the end of the '{1}' array.".format(self.filename, '.'.join(self.path)))
+            if char == ']': return
+
+            try: value, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(): raise
+                continue
+
+            self.pos = end
+            yield value
@@ -157,8 +157,8 @@ class Copert:
     linear = lambda self, a, b, x : a * x + b
     quadratic = lambda self, a, b, c, x : a * x**2 + b * x + c
     power = lambda self, a, b, x : a * x**b
-    exponential = lambda self, a, b, x : a * math.exp(b * x)
-    logarithm = lambda self, a, b, x : a + b * math.log(x)
+    exponential = lambda self, a, b, x : a * numpy.exp(b * x)
+    logarithm = lambda self, a, b, x : a + b * numpy.log(x)
 
     # Generic functions to calculate hot emissions factors for gasoline and
     # diesel passengers cars (ref. EEA emission inventory guidebook 2013, part
@@ -174,7 +174,7 @@ class Copert:
     EF_30 = lambda self, a, b, c, d, e, f, V: \
             (a + c * V + e * V**2) / (1 + b * V + d * V**2) + f / V
     EF_31 = lambda self, a, b, c, d, e, f, V : \
-            a + (b / (1 + math.exp((-1*c) + d * math.log(V) + e * V)))
+            a + (b / (1 + numpy.exp((-1*c) + d * numpy.log(V) + e * V)))
 
     # Generic function to calculate cold-start emission quotient (ref. EEA
     # emission inventory guidebook 2013, part 1.A.3.b, Road transportation,
@@ -189,19 +189,19 @@ class Copert:
            ((a + c * V + e * V**2 + f / V) / (1 + b * V + d * V**2)) \
            * (1-rf) + 0. * (g + h)
     Eq_2 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-           ((a * V**2) + (b * V) + c + (d * math.log(V)) \
-            + (e * math.exp(f * V)) +(g * (V**h))) * (1 - rf)
+           ((a * V**2) + (b * V) + c + (d * numpy.log(V)) \
+            + (e * numpy.exp(f * V)) +(g * (V**h))) * (1 - rf)
     Eq_3 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-           (a + b * (1 + math.exp( - (V + c) / d ))**-1 ) * (1 - rf) \
+           (a + b * (1 + numpy.exp( - (V + c) / d ))**-1 ) * (1 - rf) \
            + 0. * (e + f + g + h)
     Eq_4 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
            (a * V**b ) * (1- rf) + 0. * (c + d + e + f + g + h)
     Eq_5 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-           (((a * V**2) + (b * V) + c + (d * math.log(V)) \
-             + (e * math.exp(f * V)) + (g * (V**h))) * (1 - rf)) / 1000
+           (((a * V**2) + (b * V) + c + (d * numpy.log(V)) \
+             + (e * numpy.exp(f * V)) + (g * (V**h))) * (1 - rf)) / 1000
     Eq_6 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-           (a + b / (1 + math.exp((-1 * c \
-                                     + d * math.log(V)) + e * V))) * (1 - rf)\
+           (a + b / (1 + numpy.exp((-1 * c \
+                                     + d * numpy.log(V)) + e * V))) * (1 - rf)\
            + 0. * (f + g + h)
     Eq_7 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
            ((a * V**3 + b * V**2) + c * V + d)* (1 - rf) + 0.* (e + f + g + h)
@@ -216,15 +216,15 @@ class Copert:
     Eq_12 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
             (1 / (c * V**2 + b * V + a)) * (1 - rf) + 0. * (d + e + f + g + h)
     Eq_13 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-            math.exp((a + b / V) + (c * math.log(V))) * (1 - rf) \
+            numpy.exp((a + b / V) + (c * numpy.log(V))) * (1 - rf) \
             + 0. * (d + e + f + g + h)
     Eq_14 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-            (e + a * math.exp(-1 * b * V) \
-              + c * math.exp(-1 * d * V)) * (1 - rf) + 0. * (f + g + h)
+            (e + a * numpy.exp(-1 * b * V) \
+              + c * numpy.exp(-1 * d * V)) * (1 - rf) + 0. * (f + g + h)
     Eq_15 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
             (a * V**2 + b * V + c) * (1 - rf) + 0. * (d + e + f + g + h)
     Eq_16 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
-            (a - b * math.exp(-1 * c * V**d)) * (1 - rf) + 0.* (e + f + g + h)
+            (a - b * numpy.exp(-1 * c * V**d)) * (1 - rf) + 0.* (e + f + g + h)
     Eq_17 = lambda self, a, b, c, d, e, f, g, h, rf, V : \
             (a * V**5 + b * V**4 + c * V**3 + d * V**2 + e * V + f) \
             * (1 - rf) + 0. * (g + h)
@@ -247,11 +247,11 @@ class Copert:
                (a + (b * x))**((-1) / c) + 0. * (d + e + f + g)
     Eq_hdv_3 = lambda self, a, b, c, d, e, f, g, x: \
                (a + (b * x)) \
-               + (((c - b) * (1 - math.exp(((-1) * d) * x))) / d) \
+               + (((c - b) * (1 - numpy.exp(((-1) * d) * x))) / d) \
                + 0. * (e + f + g)
     Eq_hdv_4 = lambda self, a, b, c, d, e, f, g, x: \
-               (e + (a * math.exp(((-1) * b) * x))) \
-               + (c * math.exp(((-1) * d) * x)) \
+               (e + (a * numpy.exp(((-1) * b) * x))) \
+               + (c * numpy.exp(((-1) * d) * x)) \
                + 0. * (f + g)
     Eq_hdv_5 = lambda self, a, b, c, d, e, f, g, x: \
                1 / (((c * (x**2)) + (b * x)) + a)  + 0. * (d + e + f + g)
@@ -260,18 +260,18 @@ class Copert:
     Eq_hdv_7 = lambda self, a, b, c, d, e, f, g, x: \
                1 / (a + (b * x)) + 0. * (c + d + e + f + g)
     Eq_hdv_8 = lambda self, a, b, c, d, e, f, g, x: \
-               a - (b * math.exp(((-1) * c) * (x**d))) + 0. * (e + f + g)
+               a - (b * numpy.exp(((-1) * c) * (x**d))) + 0. * (e + f + g)
     Eq_hdv_9 = lambda self, a, b, c, d, e, f, g, x: \
-               a / (1 + (b * math.exp(((-1) * c) * x))) + 0. * (d + e + f + g)
+               a / (1 + (b * numpy.exp(((-1) * c) * x))) + 0. * (d + e + f + g)
     Eq_hdv_10 = lambda self, a, b, c, d, e, f, g, x: \
-                a + (b / (1 + math.exp(((-1 * c) + (d * math.log(x))) + (e * x))))\
+                a + (b / (1 + numpy.exp(((-1 * c) + (d * numpy.log(x))) + (e * x))))\
                 + 0. * (f + g)
     Eq_hdv_11 = lambda self, a, b, c, d, e, f, g, x: \
-                c + (a * math.exp(((-1) * b) * x)) + 0. * (d + e + f + g)
+                c + (a * numpy.exp(((-1) * b) * x)) + 0. * (d + e + f + g)
     Eq_hdv_12 = lambda self, a, b, c, d, e, f, g, x: \
-                c + (a * math.exp(b * x)) + 0. * (d + e + f + g)
+                c + (a * numpy.exp(b * x)) + 0. * (d + e + f + g)
     Eq_hdv_13 = lambda self, a, b, c, d, e, f, g, x: \
-                math.exp((a + (b / x)) + (c * math.log(x))) \
+                numpy.exp((a + (b / x)) + (c * numpy.log(x))) \
                 + 0. * (d + e + f + g)
     Eq_hdv_14 = lambda self, a, b, c, d, e, f, g, x: \
                 ((a * (x**3)) + (b * (x**2)) + (c * x)) + d + 0. * (e + f + g)
@@ -1728,3 +1728,511 @@ NAN     NAN      NAN        NAN        NAN
             raise Exception("Only formulas for motorcycles with emission " \
                 "standard of Conventional, Euro 1 - Euro 3 are available, " \
                 "and there is no formula for the pollutant VOC.")
+
+
+    # Vectorized interface. The methods below take arrays of speeds (and of
+    # ambient temperatures for cold-start quotients), and return arrays of
+    # the same shape. Instead of raising an exception where there is no
+    # formula, they return NaN at those speeds, so that a whole network can be
+    # evaluated in one call. The validity mask is numpy.isfinite(result).
+
+    def _full_nan(self, V):
+        return numpy.full(numpy.shape(V), numpy.nan)
+
+    def _in_range(self, values, V, Vmin, Vmax):
+        """Keeps values where Vmin <= V <= Vmax, and NaN elsewhere.
+        """
+        return numpy.where((V >= Vmin) & (V <= Vmax), values, numpy.nan)
+
+    def _piecewise(self, V, breakpoint, below, above):
+        """Evaluates 'below' where V < breakpoint and 'above' elsewhere.
+        """
+        return numpy.where(V < breakpoint, below(V), above(V))
+
+
+    def EmissionArray(self, pollutant, speed, distance, vehicle_type,
+                      engine_type, copert_class, engine_capacity,
+                      ambient_temperature, **kwargs):
+        """Computes the emissions in g, as Emission(), for arrays of speeds
+        and distances.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        if vehicle_type == self.vehicle_type_passenger_car:
+            if engine_type == self.engine_type_gasoline:
+                return distance \
+                    * self.HEFGasolinePassengerCarArray(pollutant, V,
+                                                        copert_class,
+                                                        engine_capacity)
+            elif engine_type == self.engine_type_diesel:
+                return distance \
+                    * self.HEFDieselPassengerCarArray(pollutant, V,
+                                                      copert_class,
+                                                      engine_capacity)
+        return self._full_nan(V * distance)
+
+
+    def HEFGasolinePassengerCarArray(self, pollutant, speed, copert_class,
+                                     engine_capacity, **kwargs):
+        """Computes the hot emissions factor in g/km for gasoline passenger
+        cars, as HEFGasolinePassengerCar(), for an array of speeds.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        with numpy.errstate(all = 'ignore'):
+            if copert_class <= self.class_Euro_4:
+                if copert_class <= self.class_Open_loop:
+                    emission_factor \
+                        = self._PreEuroGasolinePassengerCarArray(pollutant, V,
+                                                                 copert_class,
+                                                                 engine_capacity)
+                elif pollutant == self.pollutant_PM:
+                    if copert_class <= self.class_Euro_2:
+                        values = (3.22e-3, 1.84e-3, 1.90e-3)
+                    elif copert_class == self.class_Euro_3_GDI:
+                        values = (6.6e-3, 2.96e-3, 6.95e-3)
+                    else:
+                        values = (1.28e-3, 8.36e-4, 1.19e-3)
+                    emission_factor \
+                        = numpy.where(V <= self.speed_type_urban, values[0],
+                                      numpy.where(V <= self.speed_type_rural,
+                                                  values[1], values[2]))
+                elif copert_class == self.class_Euro_3_GDI \
+                     or pollutant >= len(self.efc_gasoline_passenger_car):
+                    emission_factor = self._full_nan(V)
+                else:
+                    global_class_index \
+                        = [self.class_Euro_1, self.class_Euro_2,
+                           self.class_Euro_3, self.class_Euro_4]
+                    copert_index = global_class_index.index(copert_class)
+                    a, b, c, d, e, f \
+                        = self.efc_gasoline_passenger_car[pollutant][copert_index]
+                    emission_factor = self.EF_25(a, b, c, d, e, f, V)
+                emission_factor = self._in_range(emission_factor, V, 10., 130.)
+            else:
+                if pollutant == self.pollutant_VOC \
+                   or pollutant == self.pollutant_FC:
+                    emission_factor = self._full_nan(V)
+                else:
+                    emission_factor \
+                        = self._Euro5PassengerCarArray(pollutant, V,
+                                                       engine_capacity,
+                                                       copert_class)
+            return numpy.where(V == 0.0, 0.0, emission_factor)
+
+
+    def _PreEuroGasolinePassengerCarArray(self, pollutant, V, copert_class,
+                                          engine_capacity):
+        """Hot emission factors of pre-Euro gasoline passenger cars, without
+        the speed range.
+        """
+        if engine_capacity == self.engine_capacity_less_0p8 \
+           or (copert_class >= self.class_Improved_Conventional
+               and engine_capacity == self.engine_capacity_more_2):
+            return self._full_nan(V)
+        small = engine_capacity == self.engine_capacity_0p8_to_1p4
+        medium = engine_capacity == self.engine_capacity_1p4_to_2
+
+        if copert_class <= self.class_ECE_15_00_or_01:
+            if pollutant == self.pollutant_NOx:
+                if small:
+                    return self.quadratic(-0.00014, 0.0225, 1.173, V)
+                elif medium:
+                    return self.quadratic(-0.00004, 0.0217, 1.360, V)
+                else:
+                    return self.quadratic(0.0001, 0.03, 1.5, V)
+            if copert_class == self.class_PRE_ECE:
+                if pollutant == self.pollutant_CO:
+                    return self._piecewise(V, 100.,
+                        lambda V: self.power(281., -0.63, V),
+                        lambda V: self.linear(0.112, 4.32, V))
+                elif pollutant == self.pollutant_VOC:
+                    return self._piecewise(V, 100.,
+                        lambda V: self.power(30.34, -0.693, V),
+                        lambda V: self.constant(1.247) + 0. * V)
+            else:
+                if pollutant == self.pollutant_CO:
+                    return self._piecewise(V, 50.,
+                        lambda V: self.power(313., -0.76, V),
+                        lambda V: self.quadratic(0.0032, -0.406, 27.22, V))
+                elif pollutant == self.pollutant_VOC:
+                    return self._piecewise(V, 50.,
+                        lambda V: self.power(24.99, -0.704, V),
+                        lambda V: self.power(4.85, -0.318, V))
+        elif copert_class <= self.class_ECE_15_03:
+            if pollutant == self.pollutant_VOC:
+                return self._piecewise(V, 60.,
+                    lambda V: self.power(25.75, -0.714, V),
+                    lambda V: self.quadratic(0.00009, -0.019, 1.95, V))
+            if copert_class == self.class_ECE_15_02:
+                if pollutant == self.pollutant_CO:
+                    return self._piecewise(V, 60.,
+                        lambda V: self.power(300, -0.797, V),
+                        lambda V: self.quadratic(0.0026, -0.44, 26.26, V))
+                elif pollutant == self.pollutant_NOx:
+                    if small:
+                        return self.quadratic(0.00018, -0.0037, 1.479, V)
+                    elif medium:
+                        return self.quadratic(0.0002, -0.0038, 1.663, V)
+                    else:
+                        return self.quadratic(0.00022, -0.0039, 1.87, V)
+            else:
+                if pollutant == self.pollutant_CO:
+                    return self._piecewise(V, 20.,
+                        lambda V: self.logarithm(161.36, -45.62, V),
+                        lambda V: self.quadratic(0.00377, -0.68, 37.92, V))
+                elif pollutant == self.pollutant_NOx:
+                    if small:
+                        return self.quadratic(0.00025, -0.0084, 1.616, V)
+                    elif medium:
+                        return self.exponential(1.29, 0.0099, V)
+                    else:
+                        return self.quadratic(0.000294, -0.0112, 2.784, V)
+        elif copert_class == self.class_ECE_15_04:
+            if pollutant == self.pollutant_CO:
+                return self._piecewise(V, 60.,
+                    lambda V: self.power(260.788, -0.91, V),
+                    lambda V: self.quadratic(0.001163, -0.22, 14.653, V))
+            elif pollutant == self.pollutant_VOC:
+                return self._piecewise(V, 60.,
+                    lambda V: self.power(19.079, -0.693, V),
+                    lambda V: self.quadratic(0.000179, -0.037, 2.608, V))
+            elif pollutant == self.pollutant_NOx:
+                if small:
+                    return self.quadratic(0.000097, 0.003, 1.432, V)
+                elif medium:
+                    return self.quadratic(0.000074, 0.013, 1.484, V)
+                else:
+                    return self.quadratic(0.000266, -0.014, 2.427, V)
+        elif copert_class == self.class_Improved_Conventional:
+            if pollutant == self.pollutant_CO:
+                if small:
+                    return self.quadratic(0.002478, -0.294, 14.577, V)
+                return self.quadratic(0.000957, -0.151, 8.273, V)
+            elif pollutant == self.pollutant_VOC:
+                if small:
+                    return self.quadratic(0.000201, -0.034, 2.189, V)
+                return self.quadratic(0.000214, -0.034, 1.999, V)
+            elif pollutant == self.pollutant_NOx:
+                if small:
+                    return self.logarithm(-0.926, 0.719, V)
+                return self.quadratic(0.000247, 0.0014, 1.387, V)
+        else:
+            if pollutant == self.pollutant_CO:
+                if small:
+                    return self.quadratic(0.002825, -0.377, 17.882, V)
+                return self.quadratic(0.002029, -0.230, 9.446, V)
+            elif pollutant == self.pollutant_VOC:
+                if small:
+                    return self.quadratic(0.000256, -0.0423, 2.185, V)
+                return self.quadratic(0.000099, -0.016, 0.808, V)
+            elif pollutant == self.pollutant_NOx:
+                if small:
+                    return self.logarithm(-0.921, 0.616, V)
+                return self.logarithm(-0.761, 0.515, V)
+        return self._full_nan(V)
+
+
+    def _Euro5PassengerCarArray(self, pollutant, V, i_engine, copert_class):
+        """Hot emission factors of Euro 5 and later passenger cars, from the
+        parameters of the engine type and capacity with index i_engine.
+        """
+        i_copert_class = self.index_copert_class_pc[copert_class]
+        i_pollutant = self.index_pollutant[pollutant]
+        a, b, c, d, e, f, g, h, rf, Vmin, Vmax, N_eq \
+            = self.pc_parameter[i_engine, i_copert_class, i_pollutant]
+        if numpy.isnan(N_eq):
+            return self._full_nan(V)
+        emission_factor \
+            = self.list_equation_pc_ldv[int(N_eq)](self, a, b, c, d, e, f, g,
+                                                   h, rf, V)
+        return self._in_range(emission_factor, V, Vmin, Vmax)
+
+
+    def HEFDieselPassengerCarArray(self, pollutant, speed, copert_class,
+                                   engine_capacity, **kwargs):
+        """Computes the hot emissions factor in g/km for diesel passenger
+        cars, as HEFDieselPassengerCar(), for an array of speeds.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        if copert_class == self.class_Euro_3_GDI:
+            return self._full_nan(V)
+        with numpy.errstate(all = 'ignore'):
+            if copert_class < self.class_Euro_1:
+                if pollutant == self.pollutant_CO:
+                    emission_factor = self.power(5.41301, -0.574, V)
+                elif pollutant == self.pollutant_NOx:
+                    if engine_capacity <= 2.0:
+                        emission_factor = self.quadratic(0.000101, -0.014,
+                                                         0.918, V)
+                    else:
+                        emission_factor = self.quadratic(0.000133, -0.018,
+                                                         1.331, V)
+                elif pollutant == self.pollutant_VOC:
+                    emission_factor = self.power(4.61, -0.937, V)
+                elif pollutant == self.pollutant_PM:
+                    emission_factor = self.quadratic(0.000058, -0.0086, 0.45,
+                                                     V)
+                elif pollutant == self.pollutant_FC:
+                    emission_factor = self.quadratic(0.014, -2.084, 118.489,
+                                                     V)
+                else:
+                    emission_factor = self._full_nan(V)
+            elif pollutant >= len(self.efc_diesel_passenger_car):
+                emission_factor = self._full_nan(V)
+            elif copert_class <= self.class_Euro_4:
+                global_class_index = [self.class_Euro_1, self.class_Euro_2,
+                                      self.class_Euro_3, self.class_Euro_4]
+                copert_index = global_class_index.index(copert_class)
+                if engine_capacity == self.engine_capacity_0p8_to_1p4 \
+                   or engine_capacity == self.engine_capacity_1p4_to_2:
+                    i_engine = engine_capacity
+                else:
+                    i_engine = self.engine_capacity_more_2
+                a, b, c, d, e, f = self.efc_diesel_passenger_car\
+                                   [pollutant][copert_index][i_engine]
+                if engine_capacity == self.engine_capacity_0p8_to_1p4 \
+                   and math.isnan(a) and copert_class <= self.class_Euro_3:
+                    emission_factor = self._full_nan(V)
+                elif pollutant == self.pollutant_CO \
+                     and copert_class == self.class_Euro_4:
+                    emission_factor = 17.5e-3 + 86.42 \
+                        * (1 + numpy.exp(-(V + 117.67) / (-21.99)))**(-1)
+                else:
+                    emission_factor = self.EF_30(a, b, c, d, e, f, V)
+            else:
+                if pollutant == self.pollutant_VOC \
+                   or pollutant == self.pollutant_FC:
+                    return self._full_nan(V)
+                if engine_capacity == self.engine_capacity_0p8_to_1p4:
+                    i_engine = 4
+                elif engine_capacity == self.engine_capacity_1p4_to_2:
+                    i_engine = 5
+                else:
+                    i_engine = 6
+                emission_factor \
+                    = self._Euro5PassengerCarArray(pollutant, V, i_engine,
+                                                   copert_class)
+            return self._in_range(emission_factor, V, 10., 130.)
+
+
+    def ColdStartEmissionQuotientArray(self, vehicle_type, engine_type,
+                                       pollutant, speed, copert_class,
+                                       engine_capacity, ambient_temperature,
+                                       **kwargs):
+        """Computes the cold-start emission quotient, as
+        ColdStartEmissionQuotient(), for arrays of speeds and ambient
+        temperatures, which are broadcast against each other.
+        """
+        V, ta = numpy.broadcast_arrays(numpy.asarray(speed, dtype = float),
+                                       numpy.asarray(ambient_temperature,
+                                                     dtype = float))
+        if vehicle_type != self.vehicle_type_passenger_car \
+           and vehicle_type != self.vehicle_type_light_commercial_vehicle:
+            return self._full_nan(V)
+
+        if engine_type == self.engine_type_gasoline:
+            if vehicle_type == self.vehicle_type_light_commercial_vehicle:
+                e_cold_passenger \
+                    = self.ColdStartEmissionQuotientArray(
+                        self.vehicle_type_passenger_car,
+                        self.engine_type_gasoline, pollutant, V,
+                        copert_class, engine_capacity, ta)
+                e_cold_passenger_engine_more_2 \
+                    = self.ColdStartEmissionQuotientArray(
+                        self.vehicle_type_passenger_car,
+                        self.engine_type_gasoline, pollutant, V,
+                        copert_class, self.engine_capacity_more_2, ta)
+                # Both quotients are calculated, so both must be defined.
+                if copert_class < self.class_Euro_1:
+                    return e_cold_passenger + 0. * e_cold_passenger_engine_more_2
+                return e_cold_passenger_engine_more_2 + 0. * e_cold_passenger
+
+            if copert_class < self.class_Euro_1:
+                slopes = {self.pollutant_CO: (3.7, -0.09),
+                          self.pollutant_NOx: (1.14, -0.006),
+                          self.pollutant_VOC: (2.8, -0.06),
+                          self.pollutant_FC: (1.47, -0.009)}
+                return self._ColdStartLinearArray(slopes, pollutant, ta)
+            elif pollutant == self.pollutant_FC:
+                return self._ColdStartLinearArray({self.pollutant_FC:
+                                                   (1.47, -0.009)},
+                                                  pollutant, ta)
+            elif pollutant not in (self.pollutant_CO, self.pollutant_NOx,
+                                   self.pollutant_VOC) \
+                 or engine_capacity not in (self.engine_capacity_0p8_to_1p4,
+                                            self.engine_capacity_1p4_to_2,
+                                            self.engine_capacity_more_2):
+                return self._full_nan(V)
+            else:
+                i_pollu = {self.pollutant_CO: 0, self.pollutant_NOx: 1,
+                           self.pollutant_VOC: 2}[pollutant]
+                i_engine_k = {self.engine_capacity_0p8_to_1p4: 0,
+                              self.engine_capacity_1p4_to_2: 1,
+                              self.engine_capacity_more_2: 2}[engine_capacity]
+                if pollutant == self.pollutant_NOx:
+                    i_v_ta = numpy.where(V <= 25, 0, 1)
+                else:
+                    i_v_ta = numpy.where(ta <= 15,
+                                         numpy.where(V <= 25, 0, 1), 2)
+                A, B, C = numpy.moveaxis(self.cold_start_emission_quotient
+                                         [i_pollu, i_engine_k][i_v_ta], -1, 0)
+                quotient = self.cold_start_eq(A, B, C, ta, V)
+                return numpy.where((V < 5) | (V > 45) | (ta < -20),
+                                   numpy.nan, quotient)
+
+        elif engine_type == self.engine_type_diesel:
+            slopes = {self.pollutant_CO: (1.9, -0.03),
+                      self.pollutant_NOx: (1.3, -0.013),
+                      self.pollutant_VOC: (3.1, -0.09),
+                      self.pollutant_PM: (3.1, -0.1),
+                      self.pollutant_FC: (1.34, -0.008)}
+            return self._ColdStartLinearArray(slopes, pollutant, ta)
+
+        return self._full_nan(V)
+
+
+    def _ColdStartLinearArray(self, slopes, pollutant, ta):
+        """Cold-start quotients that are linear in the ambient temperature,
+        defined between -10 and 30 Celsius degrees, and 1 above 30 Celsius
+        degrees.
+        """
+        if pollutant in slopes:
+            a, b = slopes[pollutant]
+            quotient = a + b * ta
+        else:
+            quotient = self._full_nan(ta)
+        return numpy.where(ta < -10, numpy.nan,
+                           numpy.where(ta > 30, 1.0, quotient))
+
+
+    def HEFLightCommercialVehicleArray(self, pollutant, speed, engine_type,
+                                       copert_class, **kwargs):
+        """Computes the hot emissions factor in g/km for light commercial
+        vehicles, as HEFLightCommercialVehicle(), for an array of speeds.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        index_pollutant_pre_euro_4 = {self.pollutant_CO: 0,
+                                      self.pollutant_NOx: 1,
+                                      self.pollutant_VOC: 2,
+                                      self.pollutant_PM: 3,
+                                      self.pollutant_FC: 4}
+        with numpy.errstate(all = 'ignore'):
+            if copert_class <= self.class_Euro_1:
+                if pollutant not in index_pollutant_pre_euro_4 \
+                   or (engine_type == self.engine_type_gasoline
+                       and pollutant == self.pollutant_PM):
+                    emission_factor = self._full_nan(V)
+                elif copert_class not in [self.class_Improved_Conventional,
+                                          self.class_Euro_1]:
+                    emission_factor = self._full_nan(V)
+                else:
+                    i_copert_class = {self.class_Improved_Conventional: 0,
+                                      self.class_Euro_1: 1}[copert_class]
+                    Vmin, Vmax, a, b, c \
+                        = self.ldv_parameter_pre_euro_1[engine_type,
+                            index_pollutant_pre_euro_4[pollutant],
+                            i_copert_class, :]
+                    emission_factor \
+                        = self._in_range(self.quadratic(a, b, c, V), V, Vmin,
+                                         Vmax)
+            elif copert_class <= self.class_Euro_4:
+                if pollutant == self.pollutant_HC \
+                   or pollutant == self.pollutant_FC \
+                   or copert_class == self.class_Euro_3_GDI:
+                    emission_factor = self._full_nan(V)
+                else:
+                    i_copert_class = {self.class_Euro_2: 0,
+                                      self.class_Euro_3: 1,
+                                      self.class_Euro_4: 2}[copert_class]
+                    reduction_percentage \
+                        = 0.01 * self.ldv_reduction_percentage[engine_type,
+                            i_copert_class,
+                            index_pollutant_pre_euro_4[pollutant]]
+                    emission_factor \
+                        = self.HEFLightCommercialVehicleArray(pollutant, V,
+                                                              engine_type,
+                                                              self.class_Euro_1) \
+                        * (1.0 - reduction_percentage)
+            elif pollutant not in self.index_pollutant:
+                emission_factor = self._full_nan(V)
+            else:
+                i_pollutant = self.index_pollutant[pollutant]
+                i_copert_class = self.index_copert_class_ldv[copert_class]
+                a, b, c, d, e, f, g, h, rf, Vmin, Vmax, N_eq \
+                    = self.ldv_parameter[engine_type, i_copert_class,
+                                         i_pollutant]
+                if numpy.isnan(N_eq):
+                    emission_factor = self._full_nan(V)
+                else:
+                    emission_factor \
+                        = self._in_range(self.list_equation_pc_ldv[int(N_eq)](
+                            self, a, b, c, d, e, f, g, h, rf, V), V, Vmin,
+                                         Vmax)
+            return numpy.where(V == 0.0, 0.0, emission_factor)
+
+
+    def HEFHeavyDutyVehicleArray(self, speed, vehicle_category, hdv_type,
+                                 hdv_copert_class, pollutant, load, slope,
+                                 **kwargs):
+        """Computes the hot emissions factor in g/km for heavy duty vehicles
+        and buses, as HEFHeavyDutyVehicle(), for an array of speeds.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        if pollutant not in self.index_pollutant:
+            return self._full_nan(V)
+        i_hdv_or_bus = self.index_vehicle_type[vehicle_category]
+        i_pollutant = self.index_pollutant[pollutant]
+        a, b, c, d, e, f, g, Vmin, Vmax, N_eq \
+            = self.hdv_parameter[i_hdv_or_bus, hdv_type, hdv_copert_class,
+                                 i_pollutant, load, slope]
+        if not N_eq >= 0:
+            return self._full_nan(V)
+        with numpy.errstate(all = 'ignore'):
+            emission_factor \
+                = self.list_equation_hdv[int(N_eq)](self, a, b, c, d, e, f, g,
+                                                    V)
+            return self._in_range(emission_factor, V, Vmin, Vmax)
+
+
+    def EFMopedArray(self, pollutant, speed, engine_type, copert_class,
+                     **kwargs):
+        """Computes the emission factor for mopeds, as EFMoped(), for an
+        array of speeds. It does not depend on the speed.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        index_engine_type = {self.engine_type_moped_two_stroke_less_50: 0,
+                             self.engine_type_moped_four_stroke_less_50: 1}
+        index_pollutant = {self.pollutant_CO: 0, self.pollutant_NOx: 1,
+                           self.pollutant_VOC: 2, self.pollutant_FC: 3,
+                           self.pollutant_PM: 4}
+        if copert_class not in [self.class_Improved_Conventional,
+                                self.class_Euro_1, self.class_Euro_2,
+                                self.class_Euro_3] \
+           or pollutant not in index_pollutant \
+           or engine_type not in index_engine_type:
+            return self._full_nan(V)
+        i_copert_class = self.index_copert_class_moto[copert_class]
+        return numpy.full(V.shape,
+                          self.moped_parameter[index_engine_type[engine_type],
+                                               i_copert_class,
+                                               index_pollutant[pollutant]])
+
+
+    def EFMotorcycleArray(self, pollutant, speed, engine_type, copert_class,
+                          **kwargs):
+        """Computes the emission factor for motorcycles, as EFMotorcycle(),
+        for an array of speeds.
+        """
+        V = numpy.asarray(speed, dtype = float)
+        if copert_class not in [self.class_Improved_Conventional,
+                                self.class_Euro_1, self.class_Euro_2,
+                                self.class_Euro_3] \
+           or pollutant == self.pollutant_VOC \
+           or engine_type not in self.index_moto_engine_type:
+            return self._full_nan(V)
+        i_engine_type = self.index_moto_engine_type[engine_type]
+        i_pollutant = self.index_pollutant[pollutant]
+        i_copert_class = self.index_copert_class_moto[copert_class]
+        Vmin, Vmax, a5, a4, a3, a2, a1, a0 \
+            = self.moto_parameter[i_engine_type, i_pollutant, i_copert_class]
+        return self._in_range(self.Eq_56(a0, a1, a2, a3, a4, a5, V), V, Vmin,
+                              Vmax)
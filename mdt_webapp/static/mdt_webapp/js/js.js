@@ -1,6 +1,6 @@
 var ids = ['two', 'cars', 'buses', 'lgvs', 'hgvs']
-var vals = [1.0, 1.0, 1.0, 1.0, 1.0, 65.1, 10, true, 0, 100]
-var origVals = [1.0, 1.0, 1.0, 1.0, 1.0, 65.1, 10, true, 0, 100]
+var vals = [1.0, 1.0, 1.0, 1.0, 1.0, 65.1, 10, true, 0, 100, 0]
+var origVals = [1.0, 1.0, 1.0, 1.0, 1.0, 65.1, 10, true, 0, 100, 0]
 
 window.onload = function () {
     ids.forEach(addListeners)
@@ -21,6 +21,7 @@ window.onload = function () {
     document.getElementById("draw").oninput = function() { vals[7] = this.checked; }
     document.getElementById("lower").onchange = function() { vals[8] = parseFloat(this.value); }
     document.getElementById("upper").onchange = function() { vals[9] = parseFloat(this.value); }
+    document.getElementById("pollutant").onchange = function() { vals[10] = parseInt(this.value); }
 };
 
 function downloadNetwork(zip_file) {
@@ -47,6 +48,7 @@ function resetEditor() {
     document.getElementById("draw").checked = true;
     document.getElementById("lower").value = parseInt('0');
     document.getElementById("upper").value = parseInt('100');
+    document.getElementById("pollutant").value = parseInt('0');
 }
 
 function redirectTo(url) {
@@ -130,5 +132,6 @@ function updateVals() {
     vals[7] = document.getElementById("draw").checked;
     vals[8] = parseFloat(document.getElementById("lower").value);
     vals[9] = parseFloat(document.getElementById("upper").value);
+    vals[10] = parseInt(document.getElementById("pollutant").value);
     origVals = vals.slice()
 }
\ No newline at end of file
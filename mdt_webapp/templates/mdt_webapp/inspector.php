@@ -97,6 +97,19 @@
             {{ piechart|safe }}
         </div>
         {% endif %}
+        {% get_emissions_pie segID as emis_piechart %}
+        {% if emis_piechart %}
+        <div class='sidebar-panel-hd'>
+            {{ pollutant_label|safe }} Emissions by Vehicle Type
+            <button class='sidebar-panel-hide' onclick="togglePanel('rd-em-pie-graph')">
+                <img src="{% static 'mdt_webapp/images/down.svg' %}" class="show-hide-btn" style="display: none;" id="rd-em-pie-graph-show">
+                <img src="{% static 'mdt_webapp/images/up.svg' %}" class="show-hide-btn" id="rd-em-pie-graph-hide">
+            </button>
+        </div>
+        <div class='sidebar-panel-dat visible' id="rd-em-pie-graph">
+            {{ emis_piechart|safe }}
+        </div>
+        {% endif %}
         {% get_seg_data segID as seg_data %}
         {% if seg_data %}
         {% autoescape off %}
@@ -157,6 +157,16 @@
                                                 <td style="width: 30%; text-align: center;">Draw Zero Values</td>
                                                 <td style="width: 20%; text-align: center;"><input type="checkbox" id="draw" name="draw" checked="{{ modifiers.2 }}" value="{{ modifiers.2 }}"></td>
                                             </tr>
+                                            <tr>
+                                                <td style="width: 30%; text-align: center;">Pollutant</td>
+                                                <td style="width: 20%; text-align: center;">
+                                                    <select id="pollutant" name="pollutant">
+                                                        {% for index, label in pollutants %}
+                                                        <option value="{{ index }}" {% if index == modifiers.5 %}selected{% endif %}>{{ label|safe }}</option>
+                                                        {% endfor %}
+                                                    </select>
+                                                </td>
+                                            </tr>
                                         </tbody>  
                                     </table>
                                 </form>
@@ -296,7 +306,7 @@
                     </ul>
                 <p>
                     The sidebar to the right of the screen shows the map data in more depth. This includes the hourly averages
-                    for <i>CO<sub>2</sub> emissions</i>, <i>vehicle speed</i> and the <i>traffic flow rate</i>, which is the
+                    for <i>emissions</i> of the selected pollutant, <i>vehicle speed</i> and the <i>traffic flow rate</i>, which is the
                     number of vehicles that pass a given point on a road. The real values of each measurement can also be found below the
                     graphs in the data section. At the bottom of the sidebar panel, the '<i>Show Worst Segments</i> ' will
                     display the road segment with the highest average hourly emissions, and the worst 'speed performance index,'
@@ -317,6 +327,9 @@
                         </li>
                         <li>The engine type distribution changes the proportion of petrol and diesel vehicles on the network.</li>
                         <li>Temperature changes the temperature used during the emissions calculations.</li>
+                        <li>
+                            The pollutant changes which emissions are shown. CO<sub>2</sub> is calculated from fuel consumption, which
+                            Copert only gives for two wheeled vehicles, buses, HGVs and Euro 5 and 6 LGVs.</li>
                         <li>
                             Changing the upper and lower boundary values limits the segments that are drawn on the final map, and
                             can be done for network analysis or to improve performance. These values are used to calculate the bounds
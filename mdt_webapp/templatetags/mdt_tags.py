@@ -1,10 +1,12 @@
 import folium
-from math import modf
+from math import modf, isnan
 import plotly.offline as opy
 import plotly.graph_objs as go
 
 from django import template
 
+from mdt_webapp.mdt.Emissions import pollutant_labels, default_pollutant
+
 register = template.Library()
 times = ['6:00', '7:00', '8:00', '9:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00', '17:00']
 
@@ -31,6 +33,12 @@ def get_attributes(context, seg_key):
                   all_attributes['oneway'].title(), format_coors(all_attributes['centre'])]
     
     headers = ["Road Classification", "Speed Limit", "No. of Lanes", "(Segment) Length", "Width", "Oneway Road", "Road Coordinates"]
+
+    # Segments matched to the TOMTOM network show how confident the match is.
+    if 'matchConfidence' in all_attributes:
+        attributes.append(str(round(all_attributes['matchConfidence']*100, 1))+"%")
+        headers.append("Flow Match Confidence")
+
     return zip(headers, attributes)
 
 @register.simple_tag(takes_context=True)
@@ -49,7 +57,8 @@ def get_seg_data(context, seg_key):
     emissions = zip(times, [round(x, 2) for x in attributes['emissions']])
     flow = zip(times, [round(i[3], 2) for i in attributes['flowData']])
 
-    emissions = [["rd-em", "Hourly CO<sub>2</sub> Emissions", "Times", "CO<sub>2</sub> Emissions (g)"], emissions]
+    label = context.get('pollutant_label', pollutant_labels[default_pollutant])
+    emissions = [["rd-em", "Hourly "+label+" Emissions", "Times", label+" Emissions (g)"], emissions]
     speeds = [["rd-sp", "Hourly Average Speeds", "Times", "Average Speed (mph)"], speeds]
     flow = [["rd-fl", "Hourly Flow Rate", "Times", "No. of Vehicles per Hour"], flow]
 
@@ -117,7 +126,7 @@ def get_seg_graph(context, seg_key, metric):
     if metric == 'Emissions':
         y = attributes['emissions']
         colour = '#6cb165'
-        title = 'Hourly CO<sub>2</sub> Emissions for <i>'+attributes['streetName']+"</i> (g)"
+        title = 'Hourly '+context.get('pollutant_label', pollutant_labels[default_pollutant])+' Emissions for <i>'+attributes['streetName']+"</i> (g)"
 
     if metric == 'Flow':
         y = [i[3] for i in attributes['flowData']]
@@ -185,6 +194,41 @@ def get_vehicle_pie(context, seg_key):
     
     return "<div class='not-enough'><h2>Not enough data to display proportions.</h2></div>"
 
+@register.simple_tag(takes_context=True)
+def get_emissions_pie(context, seg_key):
+    """
+    Creates a piechart of a segment's daily emissions from each
+    vehicle type, read from the inspector's emissions tensor.
+    :param seg_key: segment key
+    :return div:    plotly piechart div
+    """
+    labels = ['Mopeds & Motorcycles','Passenger Cars & Taxis','Buses & Coaches','LGVs', 'HGVs']
+
+    if 'emissions' in context and seg_key in context['emissions']:
+        type_emissions = context['emissions'].get_segment_type_totals(seg_key, context['pollutant'])
+
+        # Vehicle types whose emissions cannot be calculated are left out.
+        labels = [label for label, x in zip(labels, type_emissions) if not isnan(x)]
+        type_emissions = [x for x in type_emissions if not isnan(x)]
+
+        if sum(type_emissions) != 0:
+            fig = go.Figure(data=[go.Pie(labels=labels,
+                                        values=type_emissions,
+                                        texttemplate="%{percent}")])
+
+            fig.update_traces(hoverinfo='label+percent',
+                            textinfo='value')
+            fig.update_layout(
+                margin=dict(r=40, l=60, t=40, b=50),
+                autosize=True,
+                height=300,
+                hovermode="x unified",
+                hoverlabel=dict(bordercolor='white', bgcolor='rgb(244,244,244)', font=dict(color='#9c9c9c'))
+            )
+            return opy.plot(fig, auto_open=False, output_type='div')
+
+    return "<div class='not-enough'><h2>Not enough data to display emissions.</h2></div>"
+
 @register.simple_tag(takes_context=True)
 def get_name(context, seg_key):
     """
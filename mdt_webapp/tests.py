@@ -1,3 +1,674 @@
+import os, json, tempfile, threading, itertools, warnings
+import numpy as np
+from geopy.distance import geodesic
+from sklearn.neighbors import KDTree
+from time import time, sleep
+from collections import Counter
+from unittest import mock
+from urllib.parse import unquote_plus
+from urllib.request import urlopen
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
 from django.test import TestCase
 
-# Create your tests here.
+from mdt_webapp.mdt.OverpassCache import OverpassCache, normalise_query, get_query_key
+from mdt_webapp.mdt.NetworkCreator import Creator
+from mdt_webapp.mdt.Network import Network, Segment, Node
+from mdt_webapp.mdt.Geodesy import vincenty_distance, path_lengths, cartesian_coordinates
+from mdt_webapp.mdt.CoordinateIndex import CoordinateIndex
+from mdt_webapp.mdt.TomTomReader import TomTomReader
+from mdt_webapp.mdt.MapMatcher import query_paths, encode_attached_segments, rank_candidates, match_by_geometry, match_networks
+from mdt_webapp.mdt.MatchTable import MatchTable
+from mdt_webapp.mdt.ArrayNetwork import ArrayNetwork
+from mdt_webapp.mdt.Scenario import Scenario
+from mdt_webapp.mdt.NetworkRegistry import NetworkRegistry
+from mdt_webapp.mdt.Emissions import calculate_net_emissions, calculate_seg_emissions, get_component_factors, get_network_components, get_hot_factor_table, FACTOR_TABLE_TOLERANCE, c as copert
+
+class OverpassServer:
+    def __init__(self, response_dir, host='127.0.0.1', port=0, latency=0, upstream=None):
+        """
+        A local stand-in for the Overpass API, which serves recorded responses
+        so networks can be built without the real API. Responses are stored
+        as '<response_dir>/<query key>.json'. If an upstream API is given,
+        queries without a recorded response are sent to it and recorded.
+        :param response_dir: directory of recorded responses
+        :param host:         host to listen on
+        :param port:         port to listen on, 0 to pick a free port
+        :param latency:      delay added to every response, in seconds
+        :param upstream:     Overpass API url used to record new responses
+        """
+        self.response_dir = response_dir
+        self.latency = latency
+        self.upstream = upstream
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(response_dir, exist_ok=True)
+
+        self.server = ThreadingHTTPServer((host, port), OverpassRequestHandler)
+        self.server.daemon_threads = True
+        self.server.overpass = self
+        self.thread = None
+
+    def get_url(self):
+        """
+        Returns the url to give to overpy.Overpass.
+        :return str: API url
+        """
+        host, port = self.server.server_address[:2]
+        return "http://{0}:{1}/api/interpreter".format(host, port)
+
+    def start(self):
+        """
+        Starts serving requests in a background thread.
+        :return str: API url
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.get_url()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread != None: self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_response(self, query):
+        """
+        Finds the recorded response to a query, recording it from the
+        upstream API if it has not been seen before.
+        :param query: Overpass query
+        :return bytes: JSON response, or None if there is no response
+        """
+        filename = os.path.join(self.response_dir, get_query_key(query)+'.json')
+
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as response_file:
+                return response_file.read()
+
+        if self.upstream == None: return None
+
+        with urlopen(self.upstream, normalise_query(query).encode('utf-8')) as upstream_response:
+            response = upstream_response.read()
+
+        with open(filename+'.tmp', 'wb') as response_file:
+            response_file.write(response)
+        os.replace(filename+'.tmp', filename)
+
+        return response
+
+class OverpassRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        overpass = self.server.overpass
+        with overpass.lock: overpass.requests += 1
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+
+        # The query is either sent as the request body (as overpy does),
+        # or as a 'data' form field.
+        if body.startswith('data='): body = unquote_plus(body[5:])
+
+        if overpass.latency > 0: sleep(overpass.latency)
+
+        response = overpass.get_response(body)
+        if response == None:
+            self.send_error(404, "No recorded response for this query.")
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+def write_overpass_response(response_dir, query, elements):
+    """
+    Records an Overpass response for the test server.
+    :param response_dir: directory of recorded responses
+    :param query:        Overpass query
+    :param elements:     OSM elements in the response
+    """
+    with open(os.path.join(response_dir, get_query_key(query)+'.json'), 'w') as response_file:
+        json.dump({'version': 0.6, 'generator': 'mdt tests', 'elements': elements}, response_file)
+
+class OSMNetworkTests(TestCase):
+    def test_queries_are_built_concurrently(self):
+        latency = 0.5
+
+        with tempfile.TemporaryDirectory() as response_dir:
+            queries = []
+            for i in range(4):
+                query = "[out:json];way({0});(._;>;);out body;".format(100+i)
+                write_overpass_response(response_dir, query, [{'type': 'node', 'id': 10*i+1, 'lat': 53.480, 'lon': -2.240+0.01*i},
+                                                              {'type': 'node', 'id': 10*i+2, 'lat': 53.481, 'lon': -2.240+0.01*i},
+                                                              {'type': 'way', 'id': 100+i, 'nodes': [10*i+1, 10*i+2],
+                                                               'tags': {'highway': 'primary', 'name': 'Road {0}'.format(i)}}])
+                queries.append(query)
+
+            with OverpassServer(response_dir, latency=latency) as server:
+                creator = Creator(osm_workers=len(queries), overpass_url=server.get_url(), cache_path=None, match_table_path=None)
+
+                start_time = time()
+                network = creator.build_osm_networks(queries)
+                elapsed = time() - start_time
+
+            self.assertEqual(server.requests, len(queries))
+            self.assertEqual(sorted(network.get_network_segments().keys()), [100, 101, 102, 103])
+            self.assertEqual(len(network.get_network_nodes()), 8)
+
+            # The queries wait on the server at the same time, rather than
+            # one after another.
+            self.assertLess(elapsed, latency*len(queries)/2)
+
+    def test_missing_nodes_are_fetched(self):
+        with tempfile.TemporaryDirectory() as response_dir:
+            query = "[out:json];way(200);out body;"
+            write_overpass_response(response_dir, query, [{'type': 'node', 'id': 1, 'lat': 53.480, 'lon': -2.240},
+                                                          {'type': 'way', 'id': 200, 'nodes': [1, 2, 3], 'tags': {'highway': 'residential'}},
+                                                          {'type': 'way', 'id': 201, 'nodes': [1], 'tags': {'highway': 'residential'}}])
+
+            # Only the way with missing nodes has its nodes fetched.
+            write_overpass_response(response_dir, "[out:json];way(id:200);node(w);out body;",
+                                    [{'type': 'node', 'id': node_id, 'lat': 53.480+0.001*node_id, 'lon': -2.240} for node_id in [1, 2, 3]])
+
+            with OverpassServer(response_dir) as server:
+                network = Network(query=query, overpass_url=server.get_url())
+
+            self.assertEqual(server.requests, 2)
+            self.assertEqual(network.get_network_segments()[200].get_nodes(), [1, 2, 3])
+
+class TomTomReaderTests(TestCase):
+    segments = [{'segmentId': 1, 'streetName': 'Deansgate', 'shape': [{'latitude': 53.48, 'longitude': -2.25}]},
+                {'segmentId': 2, 'streetName': 'Straße "Ä" ] } [ {', 'shape': []},
+                {'segmentId': 3, 'streetName': '曼彻斯特 🚗 \\', 'segmentTimeResults': [{'timeSet': 1, 'averageSpeed': 20.5}]}]
+
+    def write_export(self, directory, data=None):
+        """
+        Writes a TOMTOM export, with objects before the segment array that
+        look like it, and non-ASCII street names stored as UTF-8.
+        :param directory: directory to write the export in
+        :param data:      bytes to write instead of the whole export
+        :return str:      file path
+        """
+        export = {'jobName': 'test', 'meta': {'segmentResults': 'decoy', 'a': [1, {'b': '[{'}]},
+                  'network': {'name': 'Manchester', 'timeSets': [{'name': 't'}], 'segmentResults': self.segments}}
+
+        path = os.path.join(directory, 'export.json')
+        with open(path, 'wb') as export_file:
+            export_file.write(data if data != None else json.dumps(export, ensure_ascii=False, indent=1).encode('utf-8'))
+        return path
+
+    def test_chunks_split_strings_and_characters(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_export(directory)
+
+            # Small chunks end inside strings, escapes and multi-byte characters.
+            for chunk_size in [1, 2, 3, 5, 7, 64, 2**20]:
+                self.assertEqual(list(TomTomReader(path, chunk_size=chunk_size)), self.segments)
+
+    def test_truncated_exports_raise(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(self.write_export(directory), 'rb') as export_file:
+                data = export_file.read()
+            array_start = data.index(b'"segmentResults": [')
+
+            # Exports are cut before the array, inside a segment, inside a
+            # multi-byte character, and before the end of the array.
+            for end in [array_start, data.index('Ä'.encode('utf-8')) + 1, data.index('🚗'.encode('utf-8')) + 2, len(data) - 6]:
+                path = self.write_export(directory, data[:end])
+                for chunk_size in [3, 2**20]:
+                    with self.assertRaises(ValueError):
+                        list(TomTomReader(path, chunk_size=chunk_size))
+
+class OverpassCacheTests(TestCase):
+    def write_queries(self, response_dir, no_queries):
+        """
+        Records responses of the same size to a number of way queries.
+        :param response_dir: directory of recorded responses
+        :param no_queries:   number of queries
+        :return list:        queries
+        """
+        queries = []
+        for i in range(no_queries):
+            query = "[out:json];way({0});(._;>;);out body;".format(100+i)
+            write_overpass_response(response_dir, query, [{'type': 'node', 'id': 10*i+1, 'lat': 53.480, 'lon': -2.240},
+                                                          {'type': 'node', 'id': 10*i+2, 'lat': 53.481, 'lon': -2.240},
+                                                          {'type': 'way', 'id': 100+i, 'nodes': [10*i+1, 10*i+2], 'tags': {'highway': 'primary'}}])
+            queries.append(query)
+
+        return queries
+
+    def test_expired_responses_are_fetched_again(self):
+        with tempfile.TemporaryDirectory() as response_dir, tempfile.TemporaryDirectory() as cache_dir:
+            query = self.write_queries(response_dir, 1)[0]
+
+            with OverpassServer(response_dir) as server:
+                for ttl, requests in [(None, 1), (0, 2)]:
+                    cache = OverpassCache(os.path.join(cache_dir, str(ttl)), ttl=ttl)
+                    server.requests = 0
+
+                    for _ in range(2):
+                        network = Network(query=query, overpass_url=server.get_url(), overpass_cache=cache)
+                        self.assertEqual(list(network.get_network_segments().keys()), [100])
+
+                    self.assertEqual(server.requests, requests)
+
+    def test_least_recently_used_responses_are_evicted(self):
+        with tempfile.TemporaryDirectory() as response_dir, tempfile.TemporaryDirectory() as cache_dir:
+            queries = self.write_queries(response_dir, 3)
+
+            # The cache holds two responses.
+            response_size = os.path.getsize(os.path.join(response_dir, get_query_key(queries[0])+'.json'))
+            cache = OverpassCache(cache_dir, max_size=2*response_size + response_size//2)
+
+            with OverpassServer(response_dir) as server:
+                def fetch(i):
+                    requests = server.requests
+                    Network(query=queries[i], overpass_url=server.get_url(), overpass_cache=cache)
+                    return server.requests > requests
+
+                self.assertEqual([fetch(0), fetch(1), fetch(0)], [True, True, False])
+
+                # The second response was used least recently, so it is
+                # removed when the third is stored.
+                self.assertTrue(fetch(2))
+                self.assertEqual([fetch(0), fetch(2), fetch(1)], [False, False, True])
+
+class CoordinateIndexTests(TestCase):
+    def test_points_are_snapped_to_grid_cells(self):
+        index = CoordinateIndex(resolution=1e-4)
+
+        # The second point is in the first point's grid cell, the third and
+        # fifth are exact duplicates, and the fourth is just over the edge
+        # of the first point's cell.
+        points = [(53.48, -2.24), (53.48003, -2.23998), (53.48, -2.24), (53.48006, -2.24), (53.48006, -2.24)]
+        keys, new = zip(*[index.add(lat, lon) for lat, lon in points])
+
+        self.assertEqual(list(new), [True, False, False, True, False])
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(keys[0], keys[2])
+        self.assertNotEqual(keys[0], keys[3])
+        self.assertEqual(keys[3], keys[4])
+        self.assertEqual(index.get_key(53.48004, -2.24004), keys[0])
+
+        # Nodes keep the coordinates of their first point.
+        self.assertEqual(index.cells[keys[0]], points[0])
+        self.assertEqual(index.get_statistics(), {'points': 5, 'nodes': 2, 'duplicates': 2, 'merged': 1})
+
+class GeodesyTests(TestCase):
+    def test_distances_match_geopy(self):
+        rng = np.random.default_rng(0)
+
+        # Points around Manchester, and pairs of points far apart.
+        lat1 = np.concatenate([53.48 + rng.uniform(-0.1, 0.1, 200), rng.uniform(-80, 80, 50)])
+        lon1 = np.concatenate([-2.24 + rng.uniform(-0.1, 0.1, 200), rng.uniform(-180, 180, 50)])
+        lat2 = np.concatenate([53.48 + rng.uniform(-0.1, 0.1, 200), rng.uniform(-80, 80, 50)])
+        lon2 = np.concatenate([-2.24 + rng.uniform(-0.1, 0.1, 200), rng.uniform(-180, 180, 50)])
+
+        distances = vincenty_distance(lat1, lon1, lat2, lon2)
+        expected = [geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)]
+        np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-6)
+
+    def test_path_lengths_match_geopy(self):
+        rng = np.random.default_rng(1)
+        paths = [(53.48 + np.cumsum(rng.uniform(-0.001, 0.001, (n, 2)), axis=0)).tolist() for n in [1, 2, 5, 40]]
+
+        lengths, centres = path_lengths(paths)
+        expected = [sum(geodesic(a, b).km for a, b in zip(path[:-1], path[1:])) for path in paths]
+        np.testing.assert_allclose(lengths, expected, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(centres, [np.mean(path, axis=0) for path in paths])
+
+def build_tomtom_network(roads):
+    """
+    Builds a TOMTOM network with flow data on every segment.
+    :param roads:    list of (street name, [[lat, lon], ...]) pairs
+    :return Network: network, with segments keyed by their position in roads
+    """
+    network = Network()
+    for key, (street_name, coors) in enumerate(roads):
+        network.segments[key] = Segment([], coors, attributes={'streetName': street_name, 'flowData': [[1, 30, 30, 10]]})
+
+    return network
+
+def offset_coordinates(points, origin=(53.48, -2.24)):
+    """
+    Converts points given in metres north and east of an origin into
+    coordinates.
+    :param points: list of [north, east] offsets (m)
+    :param origin: [lat, lon] of the origin
+    :return list:  list of [lat, lon] coordinates
+    """
+    points = np.asarray(points, dtype=np.float64)
+    scale = np.array([111320.0, 111320.0 * np.cos(np.radians(origin[0]))])
+    return (np.array(origin) + points / scale).tolist()
+
+class MapMatcherTests(TestCase):
+    def test_ranking_matches_most_common_order(self):
+        rng = np.random.default_rng(3)
+
+        # Few segments are attached to many nodes, so candidates often tie.
+        nodes = {}
+        for key in range(60):
+            nodes[key] = Node(*rng.uniform(0, 1, 2))
+            for segment_id in rng.choice(12, rng.integers(1, 4), replace=False).tolist():
+                nodes[key].attach_segment('s{0}'.format(segment_id))
+
+        node_keys = list(nodes)
+        kdtree = KDTree([nodes[key].get_coors() for key in node_keys])
+        paths = [rng.uniform(0, 1, (n, 2)).tolist() for n in rng.integers(1, 6, 200)] + [[]]
+
+        offsets, distances, indices = query_paths(kdtree, paths, k=3)
+        candidate_keys, node_offsets, node_segments = encode_attached_segments(node_keys, nodes)
+        candidate_offsets, candidates, votes = rank_candidates(offsets, indices, distances, node_offsets, node_segments)
+
+        for i in range(len(paths)):
+            closest_segments = []
+            for index in indices[offsets[i]:offsets[i+1]].ravel().tolist():
+                closest_segments += nodes[node_keys[index]].get_attached()
+            expected = Counter(closest_segments).most_common()
+
+            ranked = [candidate_keys[index] for index in candidates[candidate_offsets[i]:candidate_offsets[i+1]].tolist()]
+            self.assertEqual(ranked, [key for key, _ in expected])
+            np.testing.assert_array_equal(votes[candidate_offsets[i]:candidate_offsets[i+1]], [count for _, count in expected])
+
+    def test_geometry_matches_do_not_depend_on_workers(self):
+        rng = np.random.default_rng(4)
+
+        # Roads spread over a few kilometres, so they fall in many tiles,
+        # and OSM segments that follow them with some noise.
+        starts = np.array([53.48, -2.24]) + rng.uniform(-0.02, 0.02, (150, 2))
+        steps = rng.uniform(-0.0005, 0.0005, (150, 1, 2)) * np.arange(4)[None, :, None]
+        roads = [(str(name), (start + step).tolist()) for name, start, step in zip(rng.integers(0, 5, 150), starts, steps)]
+        tt_network = build_tomtom_network(roads)
+
+        osm_coors = [(np.array(coors) + rng.normal(0, 0.00005, (len(coors), 2))).tolist() for _, coors in roads]
+        osm_names = [name for name, _ in roads]
+
+        serial = match_by_geometry(osm_coors, osm_names, tt_network, tile_size=500, workers=1)
+        parallel = match_by_geometry(osm_coors, osm_names, tt_network, tile_size=500, workers=2)
+
+        self.assertEqual(serial[0], parallel[0])
+        np.testing.assert_array_equal(serial[1], parallel[1])
+        self.assertTrue((serial[1] > 0).any())
+
+    def test_geometry_prefers_parallel_road_with_same_name(self):
+        # A crossing road is nearer by shape than the parallel road with the
+        # same name, but crosses at right angles. A third road is too far
+        # from the second OSM segment to be a match.
+        tt_network = build_tomtom_network([('A Street', offset_coordinates([[12, 0], [12, 100]])),
+                                           ('B Road', offset_coordinates([[-8, 50], [8, 50]])),
+                                           ('C Lane', offset_coordinates([[500, 0], [500, 100]]))])
+        osm_coors = [offset_coordinates([[0, 0], [0, 100]]), offset_coordinates([[400, 0], [400, 100]])]
+
+        matches, confidence = match_by_geometry(osm_coors, ['A Street', 'C Lane'], tt_network)
+
+        self.assertEqual(matches, [0, 2])
+        self.assertGreater(confidence[0], 0)
+        self.assertEqual(confidence[1], 0)
+
+    def test_geometry_without_close_pairs_falls_back(self):
+        # The OSM segment is inside the L shaped road's bounding box, but far
+        # from the road itself.
+        tt_network = build_tomtom_network([('A Street', offset_coordinates([[0, 0], [0, 200], [200, 200]]))])
+        osm_coors = [offset_coordinates([[150, 20], [160, 20]])]
+
+        matches, confidence = match_by_geometry(osm_coors, ['A Street'], tt_network)
+
+        self.assertEqual(matches, [0])
+        self.assertEqual(confidence[0], 0)
+
+def build_flow_network(seed, no_segments=12, no_hours=24):
+    """
+    Builds a network of unconnected segments with random flow data, lengths
+    and vehicle type proportions. Some time slots have no vehicles, and the
+    last segment has none at all.
+    :param seed:        random seed, so the same network can be built again
+    :param no_segments: number of segments
+    :param no_hours:    number of hours of flow data
+    :return Network:    network
+    """
+    rng = np.random.default_rng(seed)
+    network = Network()
+
+    for key in range(no_segments):
+        speeds = np.round(rng.uniform(3, 120, no_hours), 2)
+        samples = rng.integers(0, 20, no_hours) * (rng.uniform(size=no_hours) > 0.2) * (key < no_segments - 1)
+        flow_data = [[hour, speed, speed, int(n)] for hour, speed, n in zip(range(no_hours), speeds.tolist(), samples.tolist())]
+        vehicle_props = rng.dirichlet(np.ones(5)).tolist()
+
+        coors = offset_coordinates([[0, 100*key], [50, 100*key]])
+        network.segments[key] = Segment([2*key, 2*key + 1], coors,
+                                        attributes={'flowData': flow_data, 'length': rng.uniform(0.01, 0.5), 'vehicleProps': vehicle_props})
+        for node_key, coor in zip([2*key, 2*key + 1], coors):
+            network.nodes[node_key] = Node(*coor)
+            network.nodes[node_key].attach_segment(key)
+
+    return network
+
+class MatchTableTests(TestCase):
+    roads = [('A Street', [[0, 0], [0, 100]]), ('B Road', [[50, 200], [150, 200]]), ('C Lane', [[300, 0], [300, 100]])]
+
+    def match(self, table_path, moved=None):
+        """
+        Matches OSM segments that follow the TOMTOM roads, using a match table.
+        :param table_path: match table file path
+        :param moved:      OSM segment moved 5 m north, if any
+        :return dict:      match confidence of each OSM segment
+        :return list:      coordinates of the OSM segments that were matched rather than reused
+        """
+        tt_network = build_tomtom_network([(name, offset_coordinates(points)) for name, points in self.roads])
+        osm_network = build_tomtom_network([(name, offset_coordinates(np.array(points) + [[3 + 5*(key == moved), 0]]))
+                                            for key, (name, points) in enumerate(self.roads)])
+        vehicle_kdtree = KDTree(cartesian_coordinates(offset_coordinates([[0, 0], [300, 300]])))
+
+        with mock.patch('mdt_webapp.mdt.MapMatcher.match_by_geometry', wraps=match_by_geometry) as matcher:
+            confidence = match_networks(osm_network, tt_network, vehicle_kdtree, [[0.1, 0.6, 0.1, 0.1, 0.1]]*2, match_table=MatchTable(table_path))
+
+        return confidence, [coors for call in matcher.call_args_list for coors in call.args[0]]
+
+    def test_unchanged_rebuild_reuses_matches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            table_path = os.path.join(directory, 'match_table.json')
+
+            confidence, matched = self.match(table_path)
+            self.assertEqual(len(matched), len(self.roads))
+
+            reused_confidence, matched = self.match(table_path)
+            self.assertEqual(matched, [])
+            self.assertEqual(reused_confidence, confidence)
+
+    def test_moved_segment_is_rematched(self):
+        with tempfile.TemporaryDirectory() as directory:
+            table_path = os.path.join(directory, 'match_table.json')
+            confidence, _ = self.match(table_path)
+
+            new_confidence, matched = self.match(table_path, moved=1)
+            self.assertEqual(matched, [offset_coordinates(np.array(self.roads[1][1]) + [[8, 0]])])
+            self.assertEqual(new_confidence[0], confidence[0])
+            self.assertEqual(new_confidence[2], confidence[2])
+            self.assertLess(new_confidence[1], confidence[1])
+
+class EmissionsTests(TestCase):
+    def test_network_emissions_match_segment_emissions(self):
+        modifier_sets = [{},
+                         {'temperature': -5.0},
+                         {'temperature': 30.0, 'engine_petrol_prop': 0.2},
+                         {'type_modifiers': [2, 1, 0.5, 1, 3]},
+                         {'type_modifiers': [0, 0, 0, 0, 0]}]
+
+        for modifiers in modifier_sets:
+            petrol_prop = modifiers.get('engine_petrol_prop', 0.635)
+            segment_modifiers = {'engine_type_distribution': [petrol_prop, 1 - petrol_prop], 'temperature': modifiers.get('temperature', 9.0),
+                                 'type_modifiers': modifiers.get('type_modifiers')}
+
+            # Each segment is calculated on its own, as the reference.
+            network = build_flow_network(5)
+            expected = {}
+            for key, segment in network.get_network_segments().items():
+                emissions = calculate_seg_emissions(segment, segment.get_attributes()['vehicleProps'], key=key, **segment_modifiers)
+                expected[key] = (emissions.values[0, :emissions.no_slots[0]], segment.get_attributes()['emissions'])
+
+            # The segments of a network are calculated together, and those of
+            # a scenario from the emission components of its array network.
+            network = build_flow_network(5)
+            scenario = Scenario(ArrayNetwork.from_network(build_flow_network(5)))
+
+            for result in [network, scenario]:
+                emissions = calculate_net_emissions(result, **modifiers)
+
+                for key, (values, hourly_emissions) in expected.items():
+                    i = emissions.index[key]
+                    np.testing.assert_allclose(emissions.values[i, :emissions.no_slots[i]], values, rtol=1e-9, atol=0)
+                    np.testing.assert_allclose(result.get_network_segments()[key].get_attributes()['emissions'], hourly_emissions, rtol=1e-9, atol=0)
+
+    def test_modifier_changes_only_recombine_components(self):
+        base = ArrayNetwork.from_network(build_flow_network(6))
+
+        with mock.patch('mdt_webapp.mdt.Emissions.get_component_factors', wraps=get_component_factors) as factors:
+            # The hot and cold start factors are calculated on first use.
+            calculate_net_emissions(Scenario(base))
+            components = get_network_components(base)
+            self.assertEqual(factors.call_count, 2)
+
+            # Other modifiers at the same temperature reuse them.
+            for modifiers in [{'type_modifiers': [2, 1, 0.5, 1, 3]}, {'engine_petrol_prop': 0.2}, {}]:
+                calculate_net_emissions(Scenario(base), **modifiers)
+            self.assertEqual(factors.call_count, 2)
+            self.assertIs(get_network_components(base), components)
+
+            # A new temperature only adds its cold start factors.
+            calculate_net_emissions(Scenario(base), temperature=-5.0)
+            self.assertEqual(factors.call_count, 3)
+            self.assertEqual(sorted(components.cold_start), [-5.0, 9.0])
+
+    def test_reloaded_network_gets_new_components(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'mdt_network')
+            build_flow_network(7).save(path)
+            registry = NetworkRegistry(path)
+
+            first = calculate_net_emissions(registry.get_network())
+            base = registry.get_base_network()
+
+            # The network file is rewritten with other flow data.
+            build_flow_network(8).save(path)
+            second = calculate_net_emissions(registry.get_network())
+
+            self.assertIsNot(registry.get_base_network(), base)
+            self.assertIsNot(get_network_components(registry.get_base_network()), get_network_components(base))
+            np.testing.assert_allclose(second.values, calculate_net_emissions(build_flow_network(8)).values, rtol=1e-9, atol=0)
+            self.assertFalse(np.allclose(first.values, second.values, equal_nan=True))
+
+class FactorTableTests(TestCase):
+    def test_hot_factors_match_exact_factors(self):
+        rng = np.random.default_rng(2)
+
+        # Speeds beyond the table are included, which are calculated exactly.
+        speeds = np.concatenate([rng.uniform(0, 130, 5000), rng.uniform(130, 150, 50)])
+        table = get_hot_factor_table()
+        exact_factors = get_hot_factor_table(None)
+
+        for name in table.functions:
+            values = table.lookup(name, speeds)
+            exact = exact_factors.lookup(name, speeds)
+
+            np.testing.assert_array_equal(np.isnan(values), np.isnan(exact))
+            defined = ~np.isnan(exact)
+            self.assertTrue((np.abs(values[defined] - exact[defined]) <= FACTOR_TABLE_TOLERANCE * np.abs(exact[defined])).all(), name)
+
+class CopertTests(TestCase):
+    def compare_scalar_and_array(self, scalar, array, speeds):
+        """
+        Compares a scalar Copert method with its array version at each speed.
+        Where the scalar method returns a value, the array method must return
+        the same value, and where it returns None or raises an exception, the
+        array method must return NaN. Speeds where the scalar code fails on a
+        mistake, with a NameError or AttributeError, are not compared, as the
+        array methods calculate these factors.
+        :param scalar: function of one speed
+        :param array:  function of an array of speeds
+        :param speeds: speeds to compare
+        :return set:   names of the exception types raised by the scalar method
+        """
+        values = np.asarray(array(speeds), dtype=np.float64).reshape(-1)
+        raised = set()
+
+        for speed, value in zip(speeds.tolist(), values.tolist()):
+            try:
+                expected = scalar(speed)
+            except (NameError, AttributeError) as error:
+                raised.add(type(error).__name__)
+                continue
+            except Exception as error:
+                raised.add(type(error).__name__)
+                expected = None
+
+            if expected == None: self.assertTrue(np.isnan(value))
+            else: self.assertTrue(np.isclose(value, expected, rtol=1e-12, atol=0))
+
+        return raised
+
+    def test_scalar_factors_match_array_factors(self):
+        speeds = np.array([0, 2.5, 4.99, 5, 10, 12, 45, 45.01, 60, 100, 129.99, 130.01, 140])
+        pollutants = [copert.pollutant_CO, copert.pollutant_HC, copert.pollutant_NOx, copert.pollutant_PM, copert.pollutant_FC, copert.pollutant_VOC]
+        capacities = [copert.engine_capacity_less_0p8, copert.engine_capacity_0p8_to_1p4, copert.engine_capacity_1p4_to_2, copert.engine_capacity_more_2]
+        hdv_types, hdv_classes = copert.hdv_parameter.shape[1:3]
+        raised = {}
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+
+            for pollutant, copert_class, capacity in itertools.product(pollutants, range(15), capacities):
+                raised.setdefault('HEFGasolinePassengerCar', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.HEFGasolinePassengerCar(pollutant, v, copert_class, capacity),
+                    lambda V: copert.HEFGasolinePassengerCarArray(pollutant, V, copert_class, capacity), speeds))
+                raised.setdefault('HEFDieselPassengerCar', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.HEFDieselPassengerCar(pollutant, v, copert_class, capacity),
+                    lambda V: copert.HEFDieselPassengerCarArray(pollutant, V, copert_class, capacity), speeds))
+
+            for pollutant, engine_type, copert_class in itertools.product(pollutants, [0, 1], range(15)):
+                raised.setdefault('HEFLightCommercialVehicle', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.HEFLightCommercialVehicle(pollutant, v, engine_type, copert_class),
+                    lambda V: copert.HEFLightCommercialVehicleArray(pollutant, V, engine_type, copert_class), speeds))
+
+            for vehicle_type, engine_type, pollutant, copert_class, temperature in itertools.product(
+                    [copert.vehicle_type_passenger_car, copert.vehicle_type_light_commercial_vehicle], [0, 1], pollutants, range(15), [-10, 0, 10, 25, 35]):
+                raised.setdefault('ColdStartEmissionQuotient', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.ColdStartEmissionQuotient(vehicle_type, engine_type, pollutant, v, copert_class, copert.engine_capacity_1p4_to_2, temperature),
+                    lambda V: copert.ColdStartEmissionQuotientArray(vehicle_type, engine_type, pollutant, V, copert_class, copert.engine_capacity_1p4_to_2, temperature), speeds))
+
+            for vehicle_category, hdv_type, hdv_class, pollutant in itertools.product(
+                    [copert.vehicle_type_heavy_duty_vehicle, copert.vehicle_type_bus], range(hdv_types), range(hdv_classes), pollutants):
+                raised.setdefault('HEFHeavyDutyVehicle', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.HEFHeavyDutyVehicle(v, vehicle_category, hdv_type, hdv_class, pollutant, copert.hdv_load_50, 0),
+                    lambda V: copert.HEFHeavyDutyVehicleArray(V, vehicle_category, hdv_type, hdv_class, pollutant, copert.hdv_load_50, 0), speeds))
+
+            for pollutant, engine_type, copert_class in itertools.product(pollutants, range(15), range(15)):
+                raised.setdefault('EFMoped', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.EFMoped(pollutant, v, engine_type, copert_class),
+                    lambda V: copert.EFMopedArray(pollutant, V, engine_type, copert_class), speeds))
+                raised.setdefault('EFMotorcycle', set()).update(self.compare_scalar_and_array(
+                    lambda v: copert.EFMotorcycle(pollutant, v, engine_type, copert_class),
+                    lambda V: copert.EFMotorcycleArray(pollutant, V, engine_type, copert_class), speeds))
+
+        # The scalar methods raise the same exceptions as the original
+        # Copert code.
+        self.assertEqual(raised, {'HEFGasolinePassengerCar':   {'Exception', 'IndexError', 'ValueError', 'NameError'},
+                                  'HEFDieselPassengerCar':     {'Exception', 'IndexError'},
+                                  'HEFLightCommercialVehicle': {'Exception', 'KeyError'},
+                                  'ColdStartEmissionQuotient': {'Exception'},
+                                  'HEFHeavyDutyVehicle':       {'Exception', 'KeyError'},
+                                  'EFMoped':                   {'Exception', 'AttributeError'},
+                                  'EFMotorcycle':              {'Exception', 'KeyError'}})
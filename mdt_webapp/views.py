@@ -1,4 +1,4 @@
-import sys, os.path, json, pickle
+import sys, os.path, json
 import pandas as pd
 import numpy as np
 import plotly.express as px
@@ -8,7 +8,8 @@ import plotly.graph_objs as go
 from mdt_webapp.mdt.FoliumMap import FoliumMap
 from mdt_webapp.mdt.Network import Network, Segment, Node
 from mdt_webapp.mdt.NetworkCreator import Creator
-from mdt_webapp.mdt.Emissions import calculate_net_emissions, calculate_seg_emissions
+from mdt_webapp.mdt.NetworkRegistry import get_registry
+from mdt_webapp.mdt.Emissions import calculate_net_emissions, calculate_seg_emissions, pollutants, pollutant_labels, default_pollutant
 
 from mdt_project.settings import OBJ_DIR, CSV_DIR
 
@@ -29,6 +30,10 @@ emissions_colour = '#6cb165'
 speed_colour = '#db4d41'
 flow_colour = '#4c66ba'
 
+# The MDT network is loaded once per worker, and each request is given
+# its own scenario of it.
+mdt_registry = get_registry(OBJ_DIR+"mdt_network")
+
 @login_required()
 def create_objs(request):
     """
@@ -59,32 +64,36 @@ def show_emissions(request):
     Displays the emissions map and data.
     """
     
-    network = pickle.load( open( OBJ_DIR+"mdt_network.p", "rb" ) )
+    network = mdt_registry.get_network()
     fol = FoliumMap(style=CartoDB_PositronNoLabels)
 
     # Emissions are calculated with any modifications. The average factors
     # can then be calculated, along with finding the worst emitting and most
     # congested segment.
     modifiers = handle_network_modifiers(request)
-    calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6])
+    pollutant = get_pollutant(modifiers)
+    emissions = calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6], pollutant=pollutant)
     congested, emitter, max_val = network.calculate_factors(get_highest_emissions=True)
 
-    fol.draw_network(network, metric='emissions', lower_bounds=max_val*(modifiers[8]/100), upper_bounds=max_val*(modifiers[9]/100), draw_zero_values=modifiers[7], seg_limit=seg_limit)
+    fol.draw_network(network, metric='emissions', lower_bounds=max_val*(modifiers[8]/100), upper_bounds=max_val*(modifiers[9]/100), draw_zero_values=modifiers[7], seg_limit=seg_limit,
+                     colour_scale=get_colour_scale(emissions, pollutant))
     fol.add_time_layers()
 
     context = {'my_map': fol,
                'network': network,
                'metric': 'Emissions',
                # Graphs are generated during the request stage to show to the user.
-               'graphs': [[[emissionsID, 'Average Hourly Segment Emissions'], make_barchart(network.get_av_emissions(), 'Total CO<sub>2</sub> Emissions per Hour (g)', emissions_colour)],
+               'graphs': [[[emissionsID, 'Average Hourly Segment Emissions'], make_barchart(network.get_av_emissions(), 'Total '+pollutant_labels[pollutant]+' Emissions per Hour (g)', emissions_colour)],
                           [[flowID, 'Average Segment Traffic Flow Rate'], make_barchart(network.get_av_vph(),'No. of Vehicles per Hour',flow_colour)]],
                # Data is formatted so that it can be easily displayed by Django.
-               'data': format_data(network),
+               'data': format_data(network, pollutant=pollutant),
                'worst': zip(['Most Congested', 'Largest Emitter'], [congested, emitter]),
                'editor': True,
                # The modifiers are also returned to the template so the network modifier
                # displays the previously given values.
                'type_props': zip(['two', 'cars', 'buses', 'lgvs', 'hgvs'], ['Mopeds/Motorcycles', 'Passenger Cars/Taxis', 'Buses/coaches', 'LGVs', 'HGVs'], modifiers[:5]),
+               'pollutants': zip(range(len(pollutants)), [pollutant_labels[name] for name in pollutants]),
+               'pollutant_label': pollutant_labels[pollutant],
                'modifiers': modifiers[5:]}
 
     return render(request, 'mdt_webapp/map.php', context)
@@ -93,13 +102,14 @@ def show_flow(request):
     """
     Displays flow map and data.
     """
-    network = pickle.load( open( OBJ_DIR+"mdt_network.p", "rb" ) )
+    network = mdt_registry.get_network()
     fol = FoliumMap()
     
     # Emissions still have to be calculated here as the data is still displayed on the
     # flow map page and in the inspector panel.
     modifiers = handle_network_modifiers(request)
-    calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6])
+    pollutant = get_pollutant(modifiers)
+    calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6], pollutant=pollutant)
     congested, emitter, max_val = network.calculate_factors(get_highest_speed=True)
 
     fol.draw_network(network, metric='flow', lower_bounds=max_val*(modifiers[8]/100), upper_bounds=max_val*(modifiers[9]/100), draw_zero_values=modifiers[7], seg_limit=seg_limit)
@@ -112,10 +122,12 @@ def show_flow(request):
                # order that prioritises the flow data.
                'graphs': [[[speedID, 'Average Vehicle Speed'], make_barchart([val * 0.62137119223733 for val in network.get_av_speed()], 'Speed (mph)', speed_colour)],
                           [[flowID, 'Average Segment Traffic Flow Rate'], make_barchart(network.get_av_vph(),'No. of Vehicles per Hour',flow_colour)]],
-               'data': format_data(network, False),
+               'data': format_data(network, False, pollutant),
                'worst': zip(['Most Congested', 'Largest Emitter'], [congested, emitter]),
                'editor': True,
                'type_props': zip(['two', 'cars', 'buses', 'lgvs', 'hgvs'], ['Mopeds/Motorcycles', 'Passenger Cars/Taxis', 'Buses/coaches', 'LGVs', 'HGVs'], modifiers[:5]),
+               'pollutants': zip(range(len(pollutants)), [pollutant_labels[name] for name in pollutants]),
+               'pollutant_label': pollutant_labels[pollutant],
                'modifiers': modifiers[5:]}
 
     return render(request, 'mdt_webapp/map.php', context)
@@ -126,14 +138,18 @@ def create_inspector(request, segID, modifiers):
     :param segID:     ID for segment being inspected
     :param modifiers: string containing network modifiers
     """
-    network = pickle.load( open( OBJ_DIR+"mdt_network.p", "rb" ) )
+    network = mdt_registry.get_network()
     modifiers = format_modifier_string(modifiers)
     segment = network.get_network_segments()[segID]
 
-    # Emissions are calculated according to the network modifiers.
-    calculate_seg_emissions(segment, segment.get_attributes()['vehicleProps'], engine_type_distribution=[modifiers[5]/100, 1-(modifiers[5]/100)], type_modifiers=modifiers[:5], temperature=modifiers[6])
+    # Emissions are calculated according to the network modifiers. The
+    # emissions graph and pie chart both read from the same calculation.
+    pollutant = get_pollutant(modifiers)
+    emissions = calculate_seg_emissions(segment, segment.get_attributes()['vehicleProps'], engine_type_distribution=[modifiers[5]/100, 1-(modifiers[5]/100)], type_modifiers=modifiers[:5],
+                                        temperature=modifiers[6], pollutant=pollutant, key=segID)
 
-    return render(request, 'mdt_webapp/inspector.php', {'network': network, 'segID': segID, 'type_props': modifiers[:5]})
+    return render(request, 'mdt_webapp/inspector.php', {'network': network, 'segID': segID, 'type_props': modifiers[:5], 'emissions': emissions,
+                                                        'pollutant': pollutant, 'pollutant_label': pollutant_labels[pollutant]})
 
 def create_landing(request):
     """
@@ -155,11 +171,11 @@ def download_network(request, zip_output, modifiers):
     Creates a zip file for the current network, and returns
     the file as a response.
     """
-    network = pickle.load( open( OBJ_DIR+"mdt_network.p", "rb" ) )
+    network = mdt_registry.get_network()
     modifiers = format_modifier_string(modifiers)
-    calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6])
+    emissions = calculate_net_emissions(network, type_modifiers=modifiers[:5], engine_petrol_prop=modifiers[5]/100, temperature=modifiers[6], pollutant=get_pollutant(modifiers))
 
-    zip_file = network.export_network(zip_output=zip_output)
+    zip_file = network.export_network(zip_output=zip_output, emissions=emissions)
 
     with open(zip_file, 'rb') as network: 
         response = HttpResponse(network.read()) 
@@ -194,14 +210,15 @@ def make_barchart(y, y_label, colour):
     div = opy.plot(fig, auto_open=False, output_type='div')
     return div
 
-def format_data(network, emissions_first=True):
+def format_data(network, emissions_first=True, pollutant=default_pollutant):
     """
     Formats the network data in arrays that Django
     can easily process in the page template.
     :param emissions_first: whether emissions are prioritised
+    :param pollutant:       pollutant of the network's emissions
     :return data:           data array for Django to print
     """
-    em_hds = ["em", "Emissions Data", "Time", "CO<sub>2</sub> Emissions per Hour (g)", "Percent Deviation (%)"]
+    em_hds = ["em", "Emissions Data", "Time", pollutant_labels[pollutant]+" Emissions per Hour (g)", "Percent Deviation (%)"]
     sp_hds = ["sp", "Speed Data", "Time", "Average Speed (mph)", "Percent Deviation (%)"]
     fl_hds = ["fl", "Flow Rate Data", "Time", "Average Flow Rate", "Percent Deviation (%)"]
 
@@ -251,7 +268,7 @@ def handle_network_modifiers(request):
     if request.method == "POST":
         # If there are POST variables, there has changed the network,
         # so modifiers are formatted.
-        params = ['two', 'cars', 'buses', 'lgvs', 'hgvs', 'petrol', 'temp', 'draw', 'lower', 'upper']
+        params = ['two', 'cars', 'buses', 'lgvs', 'hgvs', 'petrol', 'temp', 'draw', 'lower', 'upper', 'pollutant']
         modifiers = []
         for param in params:
             if param != 'draw':
@@ -268,7 +285,7 @@ def handle_network_modifiers(request):
     else:
         # If the method is not POST, the user has not changed the network,
         # so default modifier values are provided.
-        return [1, 1, 1, 1, 1, 65.1, 10, True, 0, 100]
+        return [1, 1, 1, 1, 1, 65.1, 10, True, 0, 100, pollutants.index(default_pollutant)]
 
 def format_modifier_string(modifiers):
     """
@@ -284,4 +301,26 @@ def format_modifier_string(modifiers):
             new_modifiers.append(float(modifiers[i]))
         elif modifiers[i] == 'True': new_modifiers.append(True)
         else: new_modifiers.append(False)
-    return new_modifiers
\ No newline at end of file
+    return new_modifiers
+
+def get_pollutant(modifiers):
+    """
+    Finds the pollutant selected in the network modifiers.
+    :param modifiers: network modifiers
+    :return str:      pollutant name
+    """
+    if len(modifiers) > 10 and 0 <= int(modifiers[10]) < len(pollutants): return pollutants[int(modifiers[10])]
+    return default_pollutant
+
+def get_colour_scale(emissions, pollutant):
+    """
+    Scales the emissions map's colours by the pollutant's total emissions
+    relative to the default pollutant, so every pollutant is coloured
+    across a similar range.
+    :param emissions: network emissions tensor
+    :param pollutant: pollutant drawn on the map
+    :return float:    colour scale
+    """
+    default_total = emissions.get_totals(default_pollutant).sum()
+    if pollutant == default_pollutant or default_total == 0: return 1.0
+    return float(emissions.get_totals(pollutant).sum() / default_total)